@@ -0,0 +1,126 @@
+import os
+import csv
+import hashlib
+import tempfile
+
+
+CSV_FIELDS = ('searge', 'name', 'side', 'desc')
+
+
+def fetch_rows(cur, size=1000):
+    """Iterate over a cursor without pulling the whole result in memory"""
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+
+def csv_value(value):
+    # what csv.writer would write for this value, so rows can be compared with the previous export
+    if value is None:
+        return ''
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+
+def file_hash(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(65536), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def read_export(filename):
+    """Previous export as a {(searge, side): (name, desc)} dict"""
+    rows = {}
+    if not os.path.isfile(filename):
+        return rows
+    with open(filename, 'rb') as fh:
+        reader = csv.reader(fh)
+        next(reader, None)
+        for row in reader:
+            if len(row) == len(CSV_FIELDS):
+                rows[(row[0], row[2])] = (row[1], row[3])
+    return rows
+
+
+class HashingFile(object):
+    def __init__(self, fh):
+        self.fh = fh
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.md5.update(data)
+        self.fh.write(data)
+
+
+class CSVExport(object):
+    """Streams rows into a temporary file next to filename, then atomically renames it into place. The live file is
+    left untouched if the new content hashes the same. With delta_filename set, rows that are new or changed since
+    the previous export are also written there."""
+
+    def __init__(self, filename, delta_filename=None):
+        self.filename = filename
+        self.delta_filename = delta_filename
+        self.nrows = 0
+        self.ndelta = 0
+        self.changed = False
+
+    def write(self, rows):
+        previous = None
+        if self.delta_filename:
+            previous = read_export(self.filename)
+
+        delta_name = None
+        delta_writer = None
+        if previous is not None:
+            delta_fh, delta_name = self._tempfile(self.delta_filename)
+            delta_writer = csv.writer(delta_fh)
+            delta_writer.writerow(CSV_FIELDS)
+
+        out_fh, out_name = self._tempfile(self.filename)
+        try:
+            hashing_fh = HashingFile(out_fh)
+            writer = csv.writer(hashing_fh)
+            writer.writerow(CSV_FIELDS)
+            for row in rows:
+                values = [csv_value(row[field]) for field in CSV_FIELDS]
+                writer.writerow(values)
+                self.nrows += 1
+                if delta_writer and previous.get((values[0], values[2])) != (values[1], values[3]):
+                    delta_writer.writerow(values)
+                    self.ndelta += 1
+            out_fh.close()
+            if delta_writer:
+                delta_fh.close()
+
+            if os.path.isfile(self.filename) and file_hash(self.filename) == hashing_fh.md5.hexdigest():
+                return False
+
+            self._replace(out_name, self.filename)
+            out_name = None
+            if delta_writer:
+                self._replace(delta_name, self.delta_filename)
+                delta_name = None
+            self.changed = True
+            return True
+        finally:
+            for name in [out_name, delta_name]:
+                if name and os.path.exists(name):
+                    os.remove(name)
+
+    @staticmethod
+    def _tempfile(filename):
+        trgdir, basename = os.path.split(filename)
+        fileno, name = tempfile.mkstemp(prefix='.%s.' % basename, dir=trgdir or '.')
+        return os.fdopen(fileno, 'wb'), name
+
+    @staticmethod
+    def _replace(tmpname, filename):
+        # mkstemp creates the file private, the exports are served to everyone
+        os.chmod(tmpname, 0o644)
+        os.rename(tmpname, filename)
@@ -0,0 +1,77 @@
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class QueryCache(object):
+    """LRU cache of query results. Keys include the data generation of the DBHandler, which is bumped by every write,
+    so entries from before a change are never hit again and simply age out."""
+
+    def __init__(self, size=1000, max_rows=500):
+        self.size = size
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self._entries[key] = value
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        # large results would push everything else out for a single search
+        if isinstance(value, (list, tuple)) and len(value) > self.max_rows:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'size': self.size, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+def _copy_rows(rows):
+    # sqlite3.Row can't be changed, the records of the index can and are copied
+    return [row.copy() if hasattr(row, 'copy') else row for row in rows]
+
+
+def cached(func):
+    """Answer a DBQueries getter from the cache of its DBHandler when the same call was made since the last write"""
+    @wraps(func)
+    def wrapper(self, *args, **kargs):
+        cache = self.dbh.cache
+        if cache is None:
+            return func(self, *args, **kargs)
+        # the generation is read first, a write committed while the query runs leaves this entry behind
+        key = (func.__name__, args, tuple(sorted(kargs.items())), self.version_id, self.dbh.generation)
+        value = cache.get(key)
+        if value is _MISSING:
+            value = func(self, *args, **kargs)
+            if isinstance(value, list):
+                value = tuple(value)
+            cache.put(key, value)
+        if isinstance(value, tuple):
+            # the entry is kept apart from what the callers get, changing one doesn't change the other
+            return _copy_rows(value)
+        return value
+    return wrapper
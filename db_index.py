@@ -0,0 +1,269 @@
+import threading
+
+
+def _intern(value):
+    # only byte strings can be interned, unicode names are rare enough to be left alone
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+def _searge_id(searge):
+    # func_1234_a -> 1234, the part matched by "searge LIKE 'func!_1234!_%'"
+    parts = searge.split('_', 2)
+    if len(parts) < 3:
+        return None
+    return parts[1].lower()
+
+
+def _has_wildcard(value):
+    # '_' is also a LIKE wildcard, but searge ids are plain numbers so a name containing one can only ever be an
+    # exact match, '%' on the other hand has to go to the database
+    return '%' in value
+
+
+class Record(object):
+    """Row of the index, read like a sqlite3.Row. Records are changed in place when the index is updated."""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def copy(self):
+        record = object.__new__(type(self))
+        for name in self.__slots__:
+            setattr(record, name, getattr(self, name))
+        return record
+
+
+class MemberRecord(Record):
+    __slots__ = ('id', 'searge', 'notch', 'name', 'desc', 'oldname', 'olddesc', 'sig', 'notchsig', 'classname',
+                 'classnotch', 'forced')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.searge = _intern(row['searge'])
+        self.notch = _intern(row['notch'])
+        self.name = _intern(row['name'])
+        self.desc = row['desc']
+        self.oldname = _intern(row['oldname'])
+        self.olddesc = row['olddesc']
+        self.sig = _intern(row['sig'])
+        self.notchsig = _intern(row['notchsig'])
+        self.classname = _intern(row['classname'])
+        self.classnotch = _intern(row['classnotch'])
+        # None when the member has no pending change, otherwise the forced flag of the pending change
+        self.forced = row['forced']
+
+    @property
+    def fullname(self):
+        if self.classname is None or self.name is None:
+            return None
+        return self.classname + '.' + self.name
+
+    @property
+    def fullnotch(self):
+        if self.classnotch is None or self.notch is None:
+            return None
+        return self.classnotch + '.' + self.notch
+
+
+class ClassRecord(Record):
+    __slots__ = ('id', 'name', 'notch', 'supername')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = _intern(row['name'])
+        self.notch = _intern(row['notch'])
+        self.supername = _intern(row['supername'])
+
+
+def _add(lookup, key, record):
+    if key is None:
+        return
+    records = lookup.get(key)
+    if records is None:
+        lookup[key] = [record]
+    else:
+        records.append(record)
+
+
+def _remove(lookup, key, record):
+    records = lookup.get(key)
+    if records is None:
+        return
+    records.remove(record)
+    if not records:
+        del lookup[key]
+
+
+class MemberTable(object):
+    """Members of one type and side, indexed by searge numeric id, searge, notch and current name"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix + '_'
+        self.records = {}
+        self.by_id = {}
+        self.by_searge = {}
+        self.by_notch = {}
+        self.by_name = {}
+        self.dirty = {}
+
+    def add(self, record):
+        self.records[record.id] = record
+        _add(self.by_id, _searge_id(record.searge), record)
+        _add(self.by_searge, record.searge, record)
+        _add(self.by_notch, record.notch, record)
+        _add(self.by_name, record.name, record)
+        if record.forced is not None:
+            self.dirty[record.id] = record
+
+    def rename(self, record, name, desc):
+        if name != record.name:
+            _remove(self.by_name, record.name, record)
+            record.name = _intern(name)
+            _add(self.by_name, record.name, record)
+        record.desc = desc
+
+    def by_searge_like(self, mname):
+        # searge LIKE 'func!_<mname>!_%' ESCAPE '!' OR searge=<mname>
+        found = {}
+        if '_' not in mname:
+            for record in self.by_id.get(mname.lower(), []):
+                found[record.id] = record
+        for record in self.by_searge.get(mname, []):
+            found[record.id] = record
+        return found
+
+    def lookup(self, mname):
+        # (searge LIKE 'func!_<mname>!_%' ESCAPE '!' OR searge=<mname> OR notch=<mname> OR name=<mname>)
+        found = self.by_searge_like(mname)
+        for record in self.by_notch.get(mname, []):
+            found[record.id] = record
+        for record in self.by_name.get(mname, []):
+            found[record.id] = record
+        return found
+
+
+class MappingIndex(object):
+    """In memory read model of the current version, answering the getter queries without touching the views.
+    Kept in sync by DBQueries once the writes have been committed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version_id = None
+        self.members = {}
+        self.classes = {}
+        self.class_names = {}
+
+    def load(self, db_con, version_id):
+        members = {}
+        classes = {}
+        class_names = {}
+        for side in [0, 1]:
+            for etype, prefix in [('methods', 'func'), ('fields', 'field')]:
+                members[(side, etype)] = MemberTable(prefix)
+            classes[side] = {}
+            class_names[side] = set()
+
+        cur = db_con.cursor()
+        for etype in ['methods', 'fields']:
+            query = """
+                SELECT id, side, searge, notch, name, oldname, desc, olddesc, sig, notchsig, classname, classnotch,
+                  forced
+                FROM v{etype}
+                WHERE versionid=:version
+            """.format(etype=etype)
+            cur.execute(query, {'version': version_id})
+            for row in cur:
+                members[(row['side'], etype)].add(MemberRecord(row))
+
+        query = """
+            SELECT id, side, name, notch, supername
+            FROM vclasses
+            WHERE versionid=:version
+        """
+        cur.execute(query, {'version': version_id})
+        for row in cur:
+            record = ClassRecord(row)
+            _add(classes[row['side']], record.name, record)
+            if record.notch != record.name:
+                _add(classes[row['side']], record.notch, record)
+            class_names[row['side']].add(record.name.lower())
+
+        with self._lock:
+            self.members = members
+            self.classes = classes
+            self.class_names = class_names
+            self.version_id = version_id
+
+    def get_classes(self, search_class, side):
+        with self._lock:
+            return list(self.classes[side].get(search_class, []))
+
+    def has_class_name(self, name, side):
+        return name.lower() in self.class_names[side]
+
+    def get_member(self, cname, mname, sname, side, etype):
+        """Returns None if the query can't be answered from the index"""
+        if _has_wildcard(mname):
+            return None
+        with self._lock:
+            found = self.members[(side, etype)].lookup(mname)
+        rows = []
+        for record_id in sorted(found):
+            record = found[record_id]
+            if cname and cname not in (record.classname, record.classnotch):
+                continue
+            if sname and sname not in (record.sig, record.notchsig):
+                continue
+            rows.append(record)
+        return rows
+
+    def get_member_searge(self, name, side, etype):
+        if _has_wildcard(name):
+            return None
+        table = self.members[(side, etype)]
+        with self._lock:
+            found = table.by_searge_like(name)
+        return [found[record_id] for record_id in sorted(found)
+                if found[record_id].searge.lower().startswith(table.prefix)]
+
+    def get_member_name(self, name, side, etype):
+        with self._lock:
+            records = self.members[(side, etype)].by_name.get(name)
+            if records:
+                return records[0]
+        return None
+
+    def update_member(self, memberid, newname, newdesc, side, etype, forced):
+        table = self.members[(side, etype)]
+        with self._lock:
+            record = table.records.get(memberid)
+            if record is None:
+                return
+            table.rename(record, newname, newdesc)
+            record.forced = int(bool(forced))
+            table.dirty[record.id] = record
+
+    def revert_member(self, member, side, etype):
+        """Returns False if the change can't be applied in place and the index needs to be reloaded"""
+        if _has_wildcard(member):
+            return False
+        table = self.members[(side, etype)]
+        with self._lock:
+            for record in table.by_searge_like(member).values():
+                table.rename(record, record.oldname, record.olddesc)
+                record.forced = None
+                table.dirty.pop(record.id, None)
+        return True
+
+    def commit(self, forced):
+        with self._lock:
+            for table in self.members.values():
+                for record in list(table.dirty.values()):
+                    if forced or not record.forced:
+                        record.oldname = record.name
+                        record.olddesc = record.desc
+                        record.forced = None
+                        del table.dirty[record.id]
@@ -1,39 +1,263 @@
+import os
 import re
 import time
+import logging
 import sqlite3
 import threading
+from Queue import Queue
 
+from functools import wraps
 from contextlib import contextmanager
+from irc_lib.utils.metrics import Registry
 from mcpbotcmds import CmdError
+from db_index import MappingIndex
+from db_cache import QueryCache, cached
+
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (schema version, script, object created by the script), applied in order to databases with an older version. A
+# database already holding the object only gets its version bumped, the script was applied by hand.
+MIGRATIONS = [
+    (1, 'mcpbot_classesstats.sql', 'classesstats'),
+    (2, 'mcpbot_indexes.sql', 'methods_name_side_versionid_idx'),
+]
+
+
+def sql_statements(script):
+    """Split an SQL script in statements, leaving out BEGIN and COMMIT so it can run inside another transaction"""
+    statements = []
+    statement = ''
+    for line in script.splitlines(True):
+        if line.startswith('--'):
+            continue
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip().rstrip(';').upper() not in ['BEGIN', 'COMMIT']:
+                statements.append(statement)
+            statement = ''
+    return statements
 
 
 class DBHandler(object):
-    def __init__(self, db_name):
-        self._db_lock = threading.Lock()
+    """Keeps a pool of long lived read only connections that can be used concurrently, and a single writer
+    connection serialised by _db_lock. The database is switched to WAL so readers never block on the writer.
+    With index set the getters of the current version are answered from an in memory MappingIndex.
+    Searches use the trigram full text tables from mcpbot_search.sql when they exist. Databases with an older schema
+    are migrated when opened. Getter results are kept in a QueryCache of cache_size entries, every write bumps
+    generation which invalidates them all. Query times and waits for connections are recorded in metrics."""
+
+    def __init__(self, db_name, readers=4, index=False, cache_size=1000, metrics=None):
+        self.logger = logging.getLogger('IRCBot.DB')
+        if metrics is None:
+            metrics = Registry()
+        self.metrics = metrics
+        self._db_lock = threading.RLock()
+        self._write_depth = 0
+        self._on_commit = []
         self.db_name = db_name
+        self.generation = 0
+        self.cache = None
+        if cache_size:
+            self.cache = QueryCache(cache_size)
+            self.metrics.gauge('db_cache_entries', lambda: self.cache.stats()['entries'])
+            self.metrics.gauge('db_cache_hits', lambda: self.cache.hits)
+            self.metrics.gauge('db_cache_misses', lambda: self.cache.misses)
+            self.metrics.gauge('db_cache_evictions', lambda: self.cache.evictions)
+
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self.migrate()
+
+        self._readers = Queue()
+        for _ in range(readers):
+            db_con = self._connect()
+            db_con.execute('PRAGMA query_only=ON')
+            self._readers.put(db_con)
+
+        with self.get_con() as db_con:
+            cur = db_con.cursor()
+            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='methodsfts'")
+            self.fts = cur.fetchone() is not None
+
+        self.index = None
+        if index:
+            self.index = MappingIndex()
+            self.load_index()
+
+    def _connect(self):
+        # connections are handed from thread to thread, but only ever used by one thread at a time
+        db_con = sqlite3.connect(self.db_name, check_same_thread=False)
+        db_con.text_factory = sqlite3.OptimizedUnicode
+        db_con.row_factory = sqlite3.Row
+        return db_con
+
+    def schema_version(self):
+        cur = self._writer.cursor()
+        cur.execute("SELECT value FROM config WHERE name='schemaversion'")
+        row = cur.fetchone()
+        if row is None:
+            return 0
+        return int(row['value'])
+
+    def migrate(self):
+        """Apply the migrations newer than the schema version of the database, each one in a transaction of its own
+        along with the version bump"""
+        version = self.schema_version()
+        for new_version, script, created in MIGRATIONS:
+            if new_version <= version:
+                continue
+            # the module commits on its own before DDL, the transaction has to be handled by hand
+            self._writer.isolation_level = None
+            cur = self._writer.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute("SELECT name FROM sqlite_master WHERE name=:name", {'name': created})
+                if cur.fetchone() is None:
+                    self.logger.info('# Migrating database to schema %d with %s', new_version, script)
+                    with open(os.path.join(SCHEMA_DIR, script)) as fh:
+                        for statement in sql_statements(fh.read()):
+                            cur.execute(statement)
+                cur.execute("INSERT OR REPLACE INTO config (name, value) VALUES ('schemaversion', :version)",
+                            {'version': new_version})
+                cur.execute('COMMIT')
+            except sqlite3.Error:
+                cur.execute('ROLLBACK')
+                raise
+            finally:
+                self._writer.isolation_level = ''
+
+    def checkout_reader(self):
+        """Take a read only connection from the pool, it has to be given back with checkin_reader"""
+        start = time.time()
+        db_con = self._readers.get()
+        self.metrics.observe('db_reader_wait_seconds', time.time() - start)
+        return db_con
+
+    def checkin_reader(self, db_con):
+        self._readers.put(db_con)
 
     @contextmanager
     def get_con(self):
+        """Borrow a read only connection from the pool"""
+        db_con = self.checkout_reader()
+        try:
+            yield db_con
+        finally:
+            self.checkin_reader(db_con)
+
+    @contextmanager
+    def get_writer(self):
+        """Take the writer connection. Blocks can be nested by the same thread, the transaction is committed (or
+        rolled back) when the outermost one exits."""
+        start = time.time()
         with self._db_lock:
-            with sqlite3.connect(self.db_name) as db_con:
-                db_con.text_factory = sqlite3.OptimizedUnicode
-                db_con.row_factory = sqlite3.Row
-                yield db_con
+            if not self._write_depth:
+                # nested blocks get the lock right away, they would only hide the real waits
+                self.metrics.observe('db_lock_wait_seconds', time.time() - start)
+            self._write_depth += 1
+            try:
+                if self._write_depth > 1:
+                    yield self._writer
+                else:
+                    self._on_commit = []
+                    with self._writer:
+                        yield self._writer
+                    try:
+                        for func, args in self._on_commit:
+                            func(*args)  # pylint: disable-msg=W0142
+                    finally:
+                        # only once the index caught up too, or stale results could be cached as current ones
+                        self.generation += 1
+            finally:
+                self._write_depth -= 1
+
+    def after_commit(self, func, *args):
+        """Call func once the current write transaction has been committed, it is dropped on rollback"""
+        if self._write_depth:
+            self._on_commit.append((func, args))
+        else:
+            func(*args)  # pylint: disable-msg=W0142
+
+    def load_index(self):
+        with self.get_con() as db_con:
+            queries = self.get_queries(db_con)
+            self.index.load(db_con, queries.version_id)
 
-    @staticmethod
-    def get_queries(db_con):
-        return DBQueries(db_con)
+    def revert_index(self, member, side, etype):
+        if not self.index.revert_member(member, side, etype):
+            self.load_index()
+
+    def get_queries(self, db_con):
+        return DBQueries(db_con, self)
 
 
 SIDE_LOOKUP = {'client': 0, 'server': 1}
 TYPE_LOOKUP = {'methods': 'func', 'fields': 'field'}
 
 
+def like_range(pattern):
+    """Bounds of the strings matching the literal start of a LIKE pattern escaped with '!'. LIKE can't use an index
+    with a bound pattern, a range on the same column can. The range is for lower case columns like searge, LIKE
+    ignores the case of the pattern and the bounds do too."""
+    prefix = ''
+    escaped = False
+    for char in pattern:
+        if not escaped and char == '!':
+            escaped = True
+            continue
+        if not escaped and char in '%_':
+            break
+        prefix += char
+        escaped = False
+    if not prefix:
+        # nothing to bound, every string is in the range
+        return u'', unichr(0xffff)
+    prefix = prefix.lower()
+    return prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+
+def sql_limit(limit):
+    # a negative LIMIT is no limit in sqlite, so the query stays the same either way
+    if limit is None:
+        return -1
+    return limit
+
+
+def page_rows(rows, limit, offset):
+    """Same as LIMIT and OFFSET for rows already in memory"""
+    if limit is None:
+        return rows[offset:]
+    return rows[offset:offset + limit]
+
+
+def fts_match(column, search_str):
+    # match the whole string as one phrase, which the trigram tokenizer treats as a substring search
+    return '{0} : "{1}"'.format(column, search_str.replace('"', '""'))
+
+
+def timed(func):
+    """Record the time spent in a DBQueries method, labelled with its name"""
+    @wraps(func)
+    def wrapper(self, *args, **kargs):
+        with self.dbh.metrics.time('db_query_seconds', query=func.__name__):
+            return func(self, *args, **kargs)
+    return wrapper
+
+
 class DBQueries(object):
-    def __init__(self, db_con):
+    def __init__(self, db_con, dbh):
         self.db_con = db_con
+        self.dbh = dbh
         self.version_id = self.get_version()
 
+    def get_index(self):
+        index = self.dbh.index
+        if index is not None and index.version_id == self.version_id:
+            return index
+        return None
+
+    @timed
     def get_version(self):
         cur = self.db_con.cursor()
         query = """
@@ -46,6 +270,7 @@ class DBQueries(object):
         version_id = row['value']
         return version_id
 
+    @timed
     def get_mcpversion(self):
         cur = self.db_con.cursor()
         query = """
@@ -58,7 +283,12 @@ class DBQueries(object):
         mcpversion = row['mcpversion']
         return mcpversion
 
+    @cached
+    @timed
     def get_classes(self, search_class, side):
+        index = self.get_index()
+        if index:
+            return index.get_classes(search_class, SIDE_LOOKUP[side])
         cur = self.db_con.cursor()
         query = """
             SELECT name, notch, supername
@@ -70,6 +300,8 @@ class DBQueries(object):
                             'side': SIDE_LOOKUP[side], 'version': self.version_id})
         return cur.fetchall()
 
+    @cached
+    @timed
     def get_constructors(self, search_class, side):
         cur = self.db_con.cursor()
         query = """
@@ -82,7 +314,14 @@ class DBQueries(object):
                             'side': SIDE_LOOKUP[side], 'version': self.version_id})
         return cur.fetchall()
 
-    def get_member(self, cname, mname, sname, side, etype):
+    @cached
+    @timed
+    def get_member(self, cname, mname, sname, side, etype, limit=None, offset=0):
+        index = self.get_index()
+        if index:
+            rows = index.get_member(cname, mname, sname, SIDE_LOOKUP[side], etype)
+            if rows is not None:
+                return page_rows(rows, limit, offset)
         cur = self.db_con.cursor()
         mname_esc = '{0}!_{1}!_%'.format(TYPE_LOOKUP[etype], mname)
         if cname and sname:
@@ -94,6 +333,8 @@ class DBQueries(object):
                   AND (classname=:cname OR classnotch=:cname)
                   AND (sig=:sname OR notchsig=:sname)
                   AND side=:side AND versionid=:version
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
             """.format(etype=etype)
         elif cname and not sname:
             query = """
@@ -103,6 +344,8 @@ class DBQueries(object):
                 WHERE (searge LIKE :mname_esc ESCAPE '!' OR searge=:mname OR notch=:mname OR name=:mname)
                   AND (classname=:cname OR classnotch=:cname)
                   AND side=:side AND versionid=:version
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
             """.format(etype=etype)
         elif not cname and sname:
             query = """
@@ -112,6 +355,8 @@ class DBQueries(object):
                 WHERE (searge LIKE :mname_esc ESCAPE '!' OR searge=:mname OR notch=:mname OR name=:mname)
                   AND (sig=:sname OR notchsig=:sname)
                   AND side=:side AND versionid=:version
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
             """.format(etype=etype)
         else:
             query = """
@@ -120,25 +365,54 @@ class DBQueries(object):
                 FROM v{etype}
                 WHERE (searge LIKE :mname_esc ESCAPE '!' OR searge=:mname OR notch=:mname OR name=:mname)
                   AND side=:side AND versionid=:version
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
             """.format(etype=etype)
         cur.execute(query, {'mname_esc': mname_esc, 'mname': mname, 'cname': cname, 'sname': sname,
-                            'side': SIDE_LOOKUP[side], 'version': self.version_id})
+                            'side': SIDE_LOOKUP[side], 'version': self.version_id, 'limit': sql_limit(limit),
+                            'offset': offset})
         return cur.fetchall()
 
-    def search_class(self, search_str, side):
+    def use_fts(self, search_str):
+        # the trigram tokenizer can't match anything shorter than 3 characters
+        return self.dbh.fts and len(search_str) >= 3
+
+    @cached
+    @timed
+    def search_class(self, search_str, side, limit=None, offset=0):
         cur = self.db_con.cursor()
-        search_esc = '%{0}%'.format(search_str)
-        query = """
-            SELECT name, notch
-            FROM vclasses
-            WHERE name LIKE :search_esc ESCAPE '!'
-              AND side=:side AND versionid=:version
-        """
-        cur.execute(query, {'search_esc': search_esc,
-                            'side': SIDE_LOOKUP[side], 'version': self.version_id})
+        if self.use_fts(search_str):
+            query = """
+                SELECT name, notch
+                FROM vclasses
+                WHERE id IN (SELECT rowid FROM classesfts WHERE classesfts MATCH :search_match
+                    AND side=:side AND versionid=CAST(:version AS INTEGER))
+                  AND side=:side AND versionid=:version
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
+            """
+        else:
+            query = """
+                SELECT name, notch
+                FROM vclasses
+                WHERE name LIKE :search_esc ESCAPE '!'
+                  AND side=:side AND versionid=:version
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
+            """
+        cur.execute(query, {'search_esc': '%{0}%'.format(search_str), 'search_match': fts_match('name', search_str),
+                            'side': SIDE_LOOKUP[side], 'version': self.version_id, 'limit': sql_limit(limit),
+                            'offset': offset})
         return cur.fetchall()
 
+    @cached
+    @timed
     def get_member_searge(self, name, side, etype):
+        index = self.get_index()
+        if index:
+            rows = index.get_member_searge(name, SIDE_LOOKUP[side], etype)
+            if rows is not None:
+                return rows
         cur = self.db_con.cursor()
         type_esc = '{0}!_%'.format(TYPE_LOOKUP[etype])
         name_esc = '{0}!_{1}!_%'.format(TYPE_LOOKUP[etype], name)
@@ -146,13 +420,16 @@ class DBQueries(object):
             SELECT name, notch, searge, sig, notchsig, desc, classname, classnotch, id,
               classname || '.' || name AS fullname, classnotch || '.' || notch AS fullnotch
             FROM v{etype}
-            WHERE searge LIKE :type_esc ESCAPE '!' AND (searge LIKE :name_esc ESCAPE '!' OR searge=:name)
+            WHERE searge LIKE :type_esc ESCAPE '!'
+              AND (searge >= :name_low AND searge < :name_high AND searge LIKE :name_esc ESCAPE '!' OR searge=:name)
               AND side=:side AND versionid=:version
         """.format(etype=etype)
-        cur.execute(query, {'type_esc': type_esc, 'name_esc': name_esc, 'name': name,
-                            'side': SIDE_LOOKUP[side], 'version': self.version_id})
+        name_low, name_high = like_range(name_esc)
+        cur.execute(query, {'type_esc': type_esc, 'name_esc': name_esc, 'name': name, 'name_low': name_low,
+                            'name_high': name_high, 'side': SIDE_LOOKUP[side], 'version': self.version_id})
         return cur.fetchall()
 
+    @timed
     def check_member_name(self, name, side, etype, forced):
         cur = self.db_con.cursor()
 
@@ -164,71 +441,91 @@ class DBQueries(object):
         if re.search(r'[^A-Za-z0-9$_]', name):
             raise CmdError("Illegal character in name")
 
+        index = self.get_index()
+
         # WE CHECK IF WE ARE NOT CONFLICTING WITH A CLASS NAME
-        query = """
-            SELECT name
-            FROM vclasses
-            WHERE lower(name)=lower(:newname)
-              AND side=:side AND versionid=:version
-        """
-        cur.execute(query, {'newname': name,
-                            'side': SIDE_LOOKUP[side], 'version': self.version_id})
-        row = cur.fetchone()
+        if index:
+            row = index.has_class_name(name, SIDE_LOOKUP[side])
+        else:
+            query = """
+                SELECT name
+                FROM vclasses
+                WHERE lower(name)=lower(:newname)
+                  AND side=:side AND versionid=:version
+            """
+            cur.execute(query, {'newname': name,
+                                'side': SIDE_LOOKUP[side], 'version': self.version_id})
+            row = cur.fetchone()
         if row:
             raise CmdError("Illegal to use class names for fields or methods")
 
         # WE CHECK THAT WE HAVE A UNIQUE NAME
         if not forced:
+            for check_etype, desc in [('methods', 'method'), ('fields', 'field')]:
+                if index:
+                    row = index.get_member_name(name, SIDE_LOOKUP[side], check_etype)
+                else:
+                    query = """
+                        SELECT searge, name
+                        FROM v{etype}
+                        WHERE name=:name
+                          AND side=:side AND versionid=:version
+                    """.format(etype=check_etype)
+                    cur.execute(query, {'name': name,
+                                        'side': SIDE_LOOKUP[side], 'version': self.version_id})
+                    row = cur.fetchone()
+                if row:
+                    raise CmdError("Conflicting with at least one other %s: %s" % (desc, row['searge']))
+
+    @timed
+    def update_member(self, member, newname, newdesc, side, etype, nick, forced, cmd):
+        with self.dbh.get_writer() as db_con:
+            cur = db_con.cursor()
+            rows = self.get_member_searge(member, side, etype)
+            row = rows[0]
+            query = """
+                INSERT INTO {etype}hist
+                VALUES (:id, :memberid, :oldname, :olddesc, :newname, :newdesc, :timestamp, :nick, :forced, :cmd)
+            """.format(etype=etype)
+            cur.execute(query, {'id': None, 'memberid': int(row['id']), 'oldname': row['name'], 'olddesc': row['desc'],
+                                'newname': newname, 'newdesc': newdesc, 'timestamp': int(time.time()), 'nick': nick,
+                                'forced': forced, 'cmd': cmd})
+            if self.get_index():
+                self.dbh.after_commit(self.dbh.index.update_member, int(row['id']), newname, newdesc,
+                                      SIDE_LOOKUP[side], etype, forced)
+
+    @cached
+    @timed
+    def search_member(self, search_str, side, etype, column='name', limit=None, offset=0):
+        cur = self.db_con.cursor()
+        if self.use_fts(search_str):
             query = """
-                SELECT searge, name
-                FROM vmethods
-                WHERE name=:name
+                SELECT name, notch, searge, sig, notchsig, desc, classname, classnotch,
+                  classname || '.' || name AS fullname, classnotch || '.' || notch AS fullnotch
+                FROM v{etype}
+                WHERE id IN (SELECT rowid FROM {etype}fts WHERE {etype}fts MATCH :search_match
+                    AND side=:side AND versionid=CAST(:version AS INTEGER))
                   AND side=:side AND versionid=:version
-            """
-            cur.execute(query, {'name': name,
-                                'side': SIDE_LOOKUP[side], 'version': self.version_id})
-            row = cur.fetchone()
-            if row:
-                raise CmdError("Conflicting with at least one other method: %s" % row['searge'])
-
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
+            """.format(etype=etype)
+        else:
             query = """
-                SELECT searge, name
-                FROM vfields
-                WHERE name=:name
+                SELECT name, notch, searge, sig, notchsig, desc, classname, classnotch,
+                  classname || '.' || name AS fullname, classnotch || '.' || notch AS fullnotch
+                FROM v{etype}
+                WHERE {column} LIKE :search_esc ESCAPE '!'
                   AND side=:side AND versionid=:version
-            """
-            cur.execute(query, {'name': name,
-                                'side': SIDE_LOOKUP[side], 'version': self.version_id})
-            row = cur.fetchone()
-            if row:
-                raise CmdError("Conflicting with at least one other field: %s" % row['searge'])
-
-    def update_member(self, member, newname, newdesc, side, etype, nick, forced, cmd):
-        cur = self.db_con.cursor()
-        rows = self.get_member_searge(member, side, etype)
-        row = rows[0]
-        query = """
-            INSERT INTO {etype}hist
-            VALUES (:id, :memberid, :oldname, :olddesc, :newname, :newdesc, :timestamp, :nick, :forced, :cmd)
-        """.format(etype=etype)
-        cur.execute(query, {'id': None, 'memberid': int(row['id']), 'oldname': row['name'], 'olddesc': row['desc'],
-                            'newname': newname, 'newdesc': newdesc, 'timestamp': int(time.time()), 'nick': nick,
-                            'forced': forced, 'cmd': cmd})
-
-    def search_member(self, search_str, side, etype):
-        cur = self.db_con.cursor()
-        search_esc = '%{0}%'.format(search_str)
-        query = """
-            SELECT name, notch, searge, sig, notchsig, desc, classname, classnotch,
-              classname || '.' || name AS fullname, classnotch || '.' || notch AS fullnotch
-            FROM v{etype}
-            WHERE name LIKE :search_esc ESCAPE '!'
-              AND side=:side AND versionid=:version
-        """.format(etype=etype)
-        cur.execute(query, {'search_esc': search_esc,
-                            'side': SIDE_LOOKUP[side], 'version': self.version_id})
+                ORDER BY id
+                LIMIT :limit OFFSET :offset
+            """.format(etype=etype, column=column)
+        cur.execute(query, {'search_esc': '%{0}%'.format(search_str), 'search_match': fts_match(column, search_str),
+                            'side': SIDE_LOOKUP[side], 'version': self.version_id, 'limit': sql_limit(limit),
+                            'offset': offset})
         return cur.fetchall()
 
+    @cached
+    @timed
     def log_member(self, member, side, etype):
         cur = self.db_con.cursor()
         member_esc = '{0}!_{1}!_%'.format(TYPE_LOOKUP[etype], member)
@@ -239,26 +536,37 @@ class DBQueries(object):
             FROM {etype} m
               INNER JOIN versions v ON v.id=m.versionid
               INNER JOIN {etype}hist mh ON mh.memberid=m.id
-            WHERE (m.searge LIKE :member_esc ESCAPE '!' OR m.searge=:member OR m.notch=:member OR m.name=:member)
+            WHERE (m.searge >= :member_low AND m.searge < :member_high AND m.searge LIKE :member_esc ESCAPE '!'
+                OR m.searge=:member OR m.notch=:member OR m.name=:member)
               AND m.side=:side
         """.format(etype=etype)
-        cur.execute(query, {'member_esc': member_esc, 'member': member,
-                            'side': SIDE_LOOKUP[side]})
+        member_low, member_high = like_range(member_esc)
+        cur.execute(query, {'member_esc': member_esc, 'member': member, 'member_low': member_low,
+                            'member_high': member_high, 'side': SIDE_LOOKUP[side]})
         return cur.fetchall()
 
+    @timed
     def revert_member(self, member, side, etype):
-        cur = self.db_con.cursor()
-        member_esc = '{0}!_{1}!_%'.format(TYPE_LOOKUP[etype], member)
-        query = """
-            UPDATE {etype}
-            SET dirtyid=0
-            WHERE (searge LIKE :member_esc ESCAPE '!' OR searge=:member)
-              AND side=:side AND versionid=:version
-        """.format(etype=etype)
-        cur.execute(query, {'member_esc': member_esc, 'member': member,
-                            'side': SIDE_LOOKUP[side], 'version': self.version_id})
-
-    def get_log(self, side, etype):
+        with self.dbh.get_writer() as db_con:
+            cur = db_con.cursor()
+            member_esc = '{0}!_{1}!_%'.format(TYPE_LOOKUP[etype], member)
+            query = """
+                UPDATE {etype}
+                SET dirtyid=0
+                WHERE (searge >= :member_low AND searge < :member_high AND searge LIKE :member_esc ESCAPE '!'
+                    OR searge=:member)
+                  AND side=:side AND versionid=:version
+            """.format(etype=etype)
+            member_low, member_high = like_range(member_esc)
+            cur.execute(query, {'member_esc': member_esc, 'member': member, 'member_low': member_low,
+                                'member_high': member_high, 'side': SIDE_LOOKUP[side], 'version': self.version_id})
+            if self.get_index():
+                self.dbh.after_commit(self.dbh.revert_index, member, SIDE_LOOKUP[side], etype)
+
+    @cached
+    @timed
+    def get_log(self, side, etype, limit=None, offset=0):
+        """The pending changes, the normal ones first and then the forced ones, oldest first"""
         cur = self.db_con.cursor()
         query = """
             SELECT m.name, m.searge, m.desc, h.newname, h.newdesc,
@@ -266,52 +574,80 @@ class DBQueries(object):
             FROM {etype} m
               INNER JOIN {etype}hist h ON h.id=m.dirtyid
             WHERE m.side=:side AND m.versionid=:version
-            ORDER BY h.timestamp
+              AND m.dirtyid != 0
+            ORDER BY h.forced, h.timestamp, h.id
+            LIMIT :limit OFFSET :offset
         """.format(etype=etype)
-        cur.execute(query, {'side': SIDE_LOOKUP[side], 'version': self.version_id})
+        cur.execute(query, {'side': SIDE_LOOKUP[side], 'version': self.version_id, 'limit': sql_limit(limit),
+                            'offset': offset})
         return cur.fetchall()
 
+    @timed
     def db_commit(self, forced):
-        cur = self.db_con.cursor()
+        """Applies the pending changes with one UPDATE per member type and returns a report of what was committed:
+        {'entries': n, 'forced': n, 'normal': n, 'counts': {('client', 'methods'): n, ...}, 'nicks': [nick, ...]}"""
+        report = {'entries': 0, 'forced': 0, 'normal': 0, 'counts': {}, 'nicks': []}
+        nicks = set()
+        side_names = dict((v, k) for k, v in SIDE_LOOKUP.items())
+        with self.dbh.get_writer() as db_con:
+            cur = db_con.cursor()
 
-        nentries = 0
-        for etype in ['methods', 'fields']:
             if forced:
-                query = """
-                    SELECT m.id, h.newname, h.newdesc
-                    FROM {etype} m
-                      INNER JOIN {etype}hist h ON h.id=m.dirtyid
-                    WHERE m.versionid=:version
-                """.format(etype=etype)
+                pending = "m.dirtyid != 0"
             else:
+                pending = "m.dirtyid != 0 AND NOT (SELECT f.forced FROM {etype}hist f WHERE f.id=m.dirtyid)=1"
+
+            for etype in ['methods', 'fields']:
                 query = """
-                    SELECT m.id, h.newname, h.newdesc
+                    SELECT m.side, h.forced, h.nick, COUNT(*) AS nentries
                     FROM {etype} m
                       INNER JOIN {etype}hist h ON h.id=m.dirtyid
-                    WHERE NOT h.forced=1
-                      AND m.versionid=:version
-                """.format(etype=etype)
-            cur.execute(query, {'version': self.version_id})
-            rows = cur.fetchall()
-            nentries += len(rows)
-
-            for row in rows:
+                    WHERE m.versionid=:version
+                      AND {pending}
+                    GROUP BY m.side, h.forced, h.nick
+                """.format(etype=etype, pending=pending.format(etype=etype))
+                cur.execute(query, {'version': self.version_id})
+                for row in cur.fetchall():
+                    key = (side_names[row['side']], etype)
+                    report['counts'][key] = report['counts'].get(key, 0) + row['nentries']
+                    if row['forced'] == 1:
+                        report['forced'] += row['nentries']
+                    else:
+                        report['normal'] += row['nentries']
+                    report['entries'] += row['nentries']
+                    nicks.add(row['nick'])
+
+                # SET expressions all see the row before the update, so dirtyid can be used and cleared in one go
                 query = """
                     UPDATE {etype}
-                    SET name=:newname, desc=:newdesc, dirtyid=0
-                    WHERE id=:id
-                """.format(etype=etype)
-                cur.execute(query, {'newname': row['newname'], 'newdesc': row['newdesc'], 'id': row['id']})
-        return nentries
-
+                    SET name=(SELECT h.newname FROM {etype}hist h WHERE h.id={etype}.dirtyid),
+                      desc=(SELECT h.newdesc FROM {etype}hist h WHERE h.id={etype}.dirtyid),
+                      dirtyid=0
+                    WHERE id IN (
+                      SELECT m.id
+                      FROM {etype} m
+                      WHERE m.versionid=:version
+                        AND {pending}
+                    )
+                """.format(etype=etype, pending=pending.format(etype=etype))
+                cur.execute(query, {'version': self.version_id})
+
+            report['nicks'] = sorted(nicks)
+            if report['entries'] and self.get_index():
+                self.dbh.after_commit(self.dbh.index.commit, forced)
+            return report
+
+    @timed
     def add_commit(self, nick):
-        cur = self.db_con.cursor()
-        query = """
-            INSERT INTO commits
-            VALUES (:id, :timestamp, :nick)
-        """
-        cur.execute(query, {'id': None, 'timestamp': int(time.time()), 'nick': nick})
+        with self.dbh.get_writer() as db_con:
+            cur = db_con.cursor()
+            query = """
+                INSERT INTO commits
+                VALUES (:id, :timestamp, :nick)
+            """
+            cur.execute(query, {'id': None, 'timestamp': int(time.time()), 'nick': nick})
 
+    @timed
     def csv_member(self, etype):
         cur = self.db_con.cursor()
         query = """
@@ -323,8 +659,11 @@ class DBQueries(object):
             ORDER BY side, searge
         """.format(etype=etype)
         cur.execute(query, {'version': self.version_id})
-        return cur.fetchall()
+        # returns the cursor itself, the export can be large so it is streamed with fetch_rows
+        return cur
 
+    @cached
+    @timed
     def status(self):
         cur = self.db_con.cursor()
         query = """
@@ -335,24 +674,74 @@ class DBQueries(object):
         cur.execute(query, {'version': self.version_id})
         return cur.fetchone()
 
+    @cached
+    @timed
     def status_members(self, side, etype):
         cur = self.db_con.cursor()
         query = """
             SELECT total({etype}t) AS total, total({etype}r) AS ren, total({etype}u) AS urn
-            FROM vclassesstats
+            FROM classesstats
             WHERE side=:side AND versionid=:version
         """.format(etype=etype)
         cur.execute(query, {'side': SIDE_LOOKUP[side], 'version': self.version_id})
         return cur.fetchone()
 
+    @cached
+    @timed
     def todo(self, side):
         cur = self.db_con.cursor()
         query = """
             SELECT name, methodst+fieldst AS memberst, methodsr+fieldsr AS membersr, methodsu+fieldsu AS membersu
-            FROM vclassesstats
+            FROM classesstats
             WHERE side=:side AND versionid=:version
             ORDER BY methodsu+fieldsu DESC
             LIMIT 10
         """
         cur.execute(query, {'side': SIDE_LOOKUP[side], 'version': self.version_id})
         return cur.fetchall()
+
+    @timed
+    def rebuild_stats(self):
+        with self.dbh.get_writer() as db_con:
+            cur = db_con.cursor()
+            query = """
+                DELETE FROM classesstats
+            """
+            cur.execute(query)
+            query = """
+                INSERT INTO classesstats (id, name, side, versionid, methodst, fieldst, methodsr, fieldsr, methodsu,
+                  fieldsu)
+                SELECT id, name, side, versionid, methodst, fieldst, methodsr, fieldsr, methodsu, fieldsu
+                FROM vclassesstats
+            """
+            cur.execute(query)
+            return cur.rowcount
+
+    @timed
+    def rebuild_search(self):
+        with self.dbh.get_writer() as db_con:
+            cur = db_con.cursor()
+            query = """
+                DELETE FROM classesfts
+            """
+            cur.execute(query)
+            query = """
+                INSERT INTO classesfts (rowid, name, side, versionid)
+                SELECT id, name, side, versionid
+                FROM classes
+            """
+            cur.execute(query)
+            nentries = cur.rowcount
+            for etype in ['methods', 'fields']:
+                query = """
+                    DELETE FROM {etype}fts
+                """.format(etype=etype)
+                cur.execute(query)
+                query = """
+                    INSERT INTO {etype}fts (rowid, name, desc, side, versionid)
+                    SELECT id, name, desc, side, versionid
+                    FROM v{etype}
+                """.format(etype=etype)
+                cur.execute(query)
+                nentries += cur.rowcount
+            return nentries
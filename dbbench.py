@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+
+import synthdb
+from loadtest import git_revision, percentile
+from db_sqlite import DBHandler
+
+
+class RecordingCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        self.connection.statements.append((sql, params))
+        return sqlite3.Cursor.execute(self, sql, params)
+
+
+class RecordingConnection(sqlite3.Connection):
+    """Connection keeping the statements run through it, so their plans can be looked at afterwards"""
+
+    def __init__(self, *args, **kargs):
+        sqlite3.Connection.__init__(self, *args, **kargs)
+        self.statements = []
+
+    def cursor(self, factory=RecordingCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+
+class RecordingDBHandler(DBHandler):
+    """DBHandler whose connections all record into the same statements list. It has no query cache, the repeated
+    calls of a case would otherwise time cache hits instead of the queries."""
+
+    def __init__(self, db_name, index=False):
+        self.statements = []
+        DBHandler.__init__(self, db_name, readers=1, index=index, cache_size=0)
+
+    def _connect(self):
+        db_con = sqlite3.connect(self.db_name, check_same_thread=False, factory=RecordingConnection)
+        db_con.text_factory = sqlite3.OptimizedUnicode
+        db_con.row_factory = sqlite3.Row
+        db_con.statements = self.statements
+        return db_con
+
+
+def pick_args(db_con, version_id):
+    """Representative arguments for the queries, taken from the current version of the database"""
+    def first(query):
+        return db_con.execute(query, {'version': version_id}).fetchone()
+
+    cls = first("SELECT c.name, c.notch FROM classes c WHERE c.side=0 AND c.versionid=:version "
+                "AND c.superid IS NOT NULL ORDER BY c.id LIMIT 1")
+    named = {}
+    unnamed = {}
+    for etype in ['methods', 'fields']:
+        named[etype] = first("SELECT m.searge, m.name, m.sig, c.name AS classname FROM {etype} m "
+                             "INNER JOIN classes c ON c.id=m.topid WHERE m.side=0 AND m.versionid=:version "
+                             "AND m.name != m.searge AND m.dirtyid=0 AND m.id IN (SELECT memberid FROM {etype}hist) "
+                             "ORDER BY m.id LIMIT 1".format(etype=etype))
+        unnamed[etype] = first("SELECT m.searge FROM {etype} m WHERE m.side=0 AND m.versionid=:version "
+                               "AND m.name=m.searge AND m.dirtyid=0 ORDER BY m.id LIMIT 1".format(etype=etype))
+    return cls, named, unnamed
+
+
+# cases reading a whole version or table on purpose, exports and rebuilds
+FULL_SCAN_CASES = ['csv_member', 'rebuild_stats', 'rebuild_search']
+
+
+def searge_id(searge):
+    return searge.split('_')[1]
+
+
+def build_cases(cls, named, unnamed):
+    """(label, method name, args, repeat or None for the default) in the order they are run, the writes come last
+    so the reads see the database as it was generated"""
+    method, field = named['methods'], named['fields']
+    cases = [
+        ('get_version', 'get_version', (), None),
+        ('get_mcpversion', 'get_mcpversion', (), None),
+        ('get_classes', 'get_classes', (cls['name'], 'client'), None),
+        ('get_classes/notch', 'get_classes', (cls['notch'], 'client'), None),
+        ('get_constructors', 'get_constructors', (cls['name'], 'client'), None),
+        ('get_member/name', 'get_member', (None, method['name'], None, 'client', 'methods'), None),
+        ('get_member/id', 'get_member', (None, searge_id(method['searge']), None, 'client', 'methods'), None),
+        ('get_member/class', 'get_member', (method['classname'], method['name'], None, 'client', 'methods'), None),
+        ('get_member/class+sig', 'get_member', (method['classname'], method['name'], method['sig'], 'client',
+                                                'methods'), None),
+        ('get_member/field', 'get_member', (None, field['name'], None, 'client', 'fields'), None),
+        ('search_class', 'search_class', (cls['name'][:4], 'client'), None),
+        ('search_class/short', 'search_class', (cls['name'][:2], 'client'), None),
+        ('search_member', 'search_member', (method['name'][:4], 'client', 'methods'), None),
+        ('search_member/short', 'search_member', (method['name'][:2], 'client', 'methods'), None),
+        # first page of the same search, as sent by the bot
+        ('search_member/short/page', 'search_member', (method['name'][:2], 'client', 'methods', 'name', 11, 0),
+         None),
+        ('search_member/desc', 'search_member', ('description', 'client', 'fields', 'desc'), None),
+        ('get_member_searge', 'get_member_searge', (searge_id(method['searge']), 'client', 'methods'), None),
+        ('get_member_searge/field', 'get_member_searge', (searge_id(field['searge']), 'client', 'fields'), None),
+        ('check_member_name', 'check_member_name', ('benchUnusedName', 'client', 'methods', False), None),
+        ('log_member', 'log_member', (searge_id(method['searge']), 'client', 'methods'), None),
+        ('get_log', 'get_log', ('client', 'methods'), None),
+        ('get_log/page', 'get_log', ('client', 'methods', 11, 0), None),
+        ('csv_member', 'csv_member', ('methods',), 1),
+        ('status', 'status', (), None),
+        ('status_members', 'status_members', ('client', 'methods'), None),
+        ('todo', 'todo', ('client',), None),
+    ]
+    for etype in ['methods', 'fields']:
+        member = searge_id(unnamed[etype]['searge'])
+        cases.extend([
+            ('update_member/%s' % etype, 'update_member', (member, 'benchName', 'Bench description', 'client', etype,
+                                                           'dbbench', False, 'scm'), None),
+            ('revert_member/%s' % etype, 'revert_member', (member, 'client', etype), None),
+        ])
+    cases.extend([
+        ('db_commit', 'db_commit', (False,), 1),
+        ('db_commit/forced', 'db_commit', (True,), 1),
+        ('add_commit', 'add_commit', ('dbbench',), None),
+        ('rebuild_stats', 'rebuild_stats', (), 1),
+        ('rebuild_search', 'rebuild_search', (), 1),
+    ])
+    return cases
+
+
+def fetch_all(result):
+    # csv_member hands back its cursor, the time to read the rows is part of the query
+    if isinstance(result, sqlite3.Cursor):
+        return len(result.fetchall())
+    if isinstance(result, list):
+        return len(result)
+    return None
+
+
+def query_plan(db_con, sql, params):
+    try:
+        return [str(row[3]) for row in db_con.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+    except sqlite3.Error as exc:
+        return ['error: %s' % exc]
+
+
+def full_scans(plan):
+    """Plan lines reading a whole table, index scans, virtual tables and constant rows don't count"""
+    return [line for line in plan if line.startswith('SCAN ') and ' USING ' not in line and
+            'VIRTUAL TABLE' not in line and 'CONSTANT ROW' not in line]
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+class Bench(object):
+    def __init__(self, args):
+        self.args = args
+
+    def setup(self):
+        args = self.args
+        if not args.reuse or not os.path.exists(args.db):
+            synthdb.create(args.db, args.classes, seed=args.seed, nversions=args.versions)
+        # the write queries change the database, run everything on a copy
+        self.work_db = args.db + '.work'
+        shutil.copyfile(args.db, self.work_db)
+        self.dbh = RecordingDBHandler(self.work_db, index=args.index)
+        self.plan_con = sqlite3.connect(self.work_db)
+        self.plan_con.row_factory = sqlite3.Row
+
+    def run_case(self, method, args, repeat):
+        times = []
+        nrows = None
+        statements = []
+        for idx in range(repeat or self.args.repeat):
+            del self.dbh.statements[:]
+            with self.dbh.get_con() as db_con:
+                start = time.time()
+                queries = self.dbh.get_queries(db_con)
+                nrows = fetch_all(getattr(queries, method)(*args))  # pylint: disable-msg=W0142
+                times.append(time.time() - start)
+            if idx == 0:
+                statements = list(self.dbh.statements)
+
+        # the plans are taken after the call, the tables they use are the same
+        plans = []
+        seen = set()
+        for sql, params in statements:
+            sql = normalize(sql)
+            if sql in seen or sql.startswith('PRAGMA'):
+                continue
+            seen.add(sql)
+            plan = query_plan(self.plan_con, sql, params)
+            plans.append({'sql': sql, 'plan': plan, 'scans': full_scans(plan)})
+
+        times.sort()
+        return {
+            'method': method,
+            'args': [repr(arg) for arg in args],
+            'calls': len(times),
+            'rows': nrows,
+            'mean': sum(times) / len(times),
+            'p50': percentile(times, 50),
+            'max': times[-1],
+            'statements': plans,
+        }
+
+    def run(self):
+        self.setup()
+        with self.dbh.get_con() as db_con:
+            version_id = self.dbh.get_queries(db_con).version_id
+        cls, named, unnamed = pick_args(self.plan_con, version_id)
+        cases = {}
+        for label, method, args, repeat in build_cases(cls, named, unnamed):
+            cases[label] = self.run_case(method, args, repeat)
+        counts = {}
+        for table in ['classes', 'methods', 'fields', 'methodshist', 'fieldshist', 'methodslk', 'fieldslk',
+                      'versions']:
+            counts[table] = self.plan_con.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+        self.plan_con.close()
+        os.remove(self.work_db)
+        for suffix in ['-wal', '-shm']:
+            if os.path.exists(self.work_db + suffix):
+                os.remove(self.work_db + suffix)
+        return {
+            'revision': git_revision(),
+            'timestamp': int(time.time()),
+            'sqlite': sqlite3.sqlite_version,
+            'config': vars(self.args),
+            'rows': counts,
+            'cases': cases,
+        }
+
+
+def compare(results, baseline, slowdown, min_time):
+    """Regressions of results against a baseline run: a query now scanning a table it didn't, or a case slower by
+    more than the slowdown factor (ignoring cases faster than min_time seconds)"""
+    regressions = []
+    for label, case in sorted(results['cases'].items()):
+        base = baseline['cases'].get(label)
+        if base is None:
+            continue
+        base_scans = set()
+        for statement in base['statements']:
+            base_scans.update(statement['scans'])
+        for statement in case['statements']:
+            for scan in statement['scans']:
+                if scan not in base_scans:
+                    regressions.append('%s: new full table scan "%s" in %s' % (label, scan, statement['sql']))
+        if case['mean'] > min_time and case['mean'] > base['mean'] * slowdown:
+            regressions.append('%s: %.2fms, was %.2fms' % (label, case['mean'] * 1000, base['mean'] * 1000))
+    return regressions
+
+
+def check_scans(results):
+    """Statements reading a whole table outside of FULL_SCAN_CASES, they should all go through an index"""
+    problems = []
+    for label, case in sorted(results['cases'].items()):
+        if label in FULL_SCAN_CASES:
+            continue
+        for statement in case['statements']:
+            for scan in statement['scans']:
+                problems.append('%s: full table scan "%s" in %s' % (label, scan, statement['sql']))
+    return problems
+
+
+def print_results(results, baseline=None):
+    print 'Revision %s, sqlite %s' % (results['revision'], results['sqlite'])
+    print ', '.join('%s %d' % item for item in sorted(results['rows'].items()))
+    print '%-26s %6s %9s %9s %9s %7s  %s' % ('case', 'calls', 'mean ms', 'p50 ms', 'was ms', 'rows', 'full scans')
+    for label, case in sorted(results['cases'].items()):
+        was = '-'
+        if baseline and label in baseline['cases']:
+            was = '%.2f' % (baseline['cases'][label]['mean'] * 1000)
+        scans = sorted(set(scan for statement in case['statements'] for scan in statement['scans']))
+        rows = '-' if case['rows'] is None else str(case['rows'])
+        print '%-26s %6d %9.2f %9.2f %9s %7s  %s' % (label, case['calls'], case['mean'] * 1000, case['p50'] * 1000,
+                                                     was, rows, ', '.join(scans))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every DBQueries method on a synthetic database and check '
+                                                 'the query plans')
+    parser.add_argument('--db', default='dbbench.sqlite')
+    parser.add_argument('--classes', type=int, default=5000, help='classes per side and version')
+    parser.add_argument('--versions', type=int, default=3)
+    parser.add_argument('--reuse', action='store_true', help='reuse an existing database')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help='calls per query')
+    parser.add_argument('--index', action='store_true', help='answer the getters from the in memory index')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--check', action='store_true', help='fail if a query scans a whole table')
+    parser.add_argument('--slowdown', type=float, default=1.5, help='slowdown reported as a regression')
+    parser.add_argument('--min-time', type=float, default=0.001, help='cases faster than this are never regressions')
+    parser.add_argument('--output', help='results file, dbbench-<revision>.json by default')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+    results = Bench(args).run()
+    print_results(results, baseline)
+    output = args.output or 'dbbench-%s.json' % results['revision']
+    with open(output, 'w') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+    print 'Results saved to %s' % output
+
+    regressions = []
+    if baseline:
+        regressions.extend(compare(results, baseline, args.slowdown, args.min_time))
+    if args.check:
+        regressions.extend(check_scans(results))
+    for regression in regressions:
+        print 'REGRESSION %s' % regression
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
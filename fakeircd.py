@@ -0,0 +1,313 @@
+import sys
+import time
+import socket
+import logging
+import threading
+import itertools
+
+from irc_lib.utils.framer import LineFramer
+
+
+SERVER_NAME = 'fakeircd'
+NICKSERV = 'NickServ'
+
+
+class Client(object):
+    """Connection of a real IRC client"""
+
+    def __init__(self, server, skt, addr):
+        self.server = server
+        self.socket = skt
+        self.host = addr[0]
+        self.nick = None
+        self.user = None
+        self.identified = False
+        self.lock = threading.Lock()
+
+    @property
+    def prefix(self):
+        return '%s!%s@%s' % (self.nick, self.user or self.nick, self.host)
+
+    def send(self, line):
+        with self.lock:
+            try:
+                self.socket.sendall(line + '\r\n')
+            except socket.error:
+                pass
+
+    def read_loop(self):
+        framer = LineFramer(self.host)
+        try:
+            while framer.recv(self.socket):
+                for line in framer.lines():
+                    self.server.handle(self, line)
+        except socket.error:
+            pass
+        finally:
+            self.server.disconnect(self)
+
+
+class VirtualClient(object):
+    """In process client, lines sent to it are handed to a callback, used to simulate a crowd without a socket each"""
+
+    def __init__(self, nick, host, callback):
+        self.nick = nick
+        self.user = nick.lower()
+        self.host = host
+        self.callback = callback
+        self.identified = True
+
+    @property
+    def prefix(self):
+        return '%s!%s@%s' % (self.nick, self.user, self.host)
+
+    def send(self, line):
+        self.callback(line)
+
+
+class FakeIRCd(object):
+    """Minimal single network IRC server for local tests and benchmarks. Supports registration, channels, private
+    messages, WHOIS and server PINGs, and includes a NickServ answering IDENTIFY and ACC. Every PING sent to a real
+    client is tracked so late and missing PONGs can be reported."""
+
+    def __init__(self, host='127.0.0.1', port=0, ping_interval=30, ping_late=5):
+        self.logger = logging.getLogger('FakeIRCd')
+        self.ping_interval = ping_interval
+        self.ping_late = ping_late
+        self.lock = threading.RLock()
+        self.clients = {}
+        self.channels = {}
+        self.registered = {}
+        self.listen_socket = socket.socket()
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_socket.bind((host, port))
+        self.listen_socket.listen(16)
+        self.host, self.port = self.listen_socket.getsockname()
+        self.running = False
+        self.ping_ids = itertools.count()
+        # token -> (nick, time sent), and the round trip times of the answered ones
+        self.pings = {}
+        self.pongs = []
+        self.npings = 0
+        self.nlate = 0
+
+    def start(self):
+        self.running = True
+        for target, name in [(self.accept_loop, 'IRCdAccept'), (self.ping_loop, 'IRCdPing')]:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.listen_socket.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                skt, addr = self.listen_socket.accept()
+            except socket.error:
+                return
+            client = Client(self, skt, addr)
+            thread = threading.Thread(target=client.read_loop, name='IRCdClient')
+            thread.daemon = True
+            thread.start()
+
+    def ping_loop(self):
+        while self.running:
+            time.sleep(self.ping_interval)
+            with self.lock:
+                clients = [client for client in self.clients.values() if isinstance(client, Client)]
+            for client in clients:
+                token = 'fake%d' % next(self.ping_ids)
+                with self.lock:
+                    self.pings[token] = (client.nick, time.time())
+                    self.npings += 1
+                client.send('PING :%s' % token)
+
+    def register_nick(self, nick, password):
+        self.registered[nick.lower()] = password
+
+    def add_virtual(self, nick, host, callback):
+        client = VirtualClient(nick, host, callback)
+        with self.lock:
+            self.clients[nick.lower()] = client
+        return client
+
+    def disconnect(self, client, reason='Connection closed'):
+        with self.lock:
+            if client.nick and self.clients.get(client.nick.lower()) is client:
+                del self.clients[client.nick.lower()]
+                self.send_common(client, ':%s QUIT :%s' % (client.prefix, reason))
+                for members in self.channels.values():
+                    members.discard(client.nick.lower())
+
+    def send_common(self, client, line):
+        """Send line to everyone sharing a channel with client"""
+        nicks = set()
+        for members in self.channels.values():
+            if client.nick.lower() in members:
+                nicks.update(members)
+        nicks.discard(client.nick.lower())
+        for nick in nicks:
+            self.clients[nick].send(line)
+
+    def numeric(self, client, num, *args):
+        line = ':%s %s %s %s' % (SERVER_NAME, num, client.nick or '*', ' '.join(args[:-1]))
+        client.send(line.rstrip() + ' :' + args[-1])
+
+    def handle(self, client, line):
+        """Process a line sent by client, virtual clients call this directly"""
+        if line.startswith(':'):
+            _, _, line = line.partition(' ')
+        msg, _, trailing = line.partition(' :')
+        args = msg.split()
+        if not args:
+            return
+        if trailing:
+            args.append(trailing)
+        cmd = args.pop(0).upper()
+        handler = getattr(self, 'irc_%s' % cmd, None)
+        if handler:
+            with self.lock:
+                handler(client, args)
+
+    def irc_NICK(self, client, args):
+        nick = args[0]
+        if nick.lower() in self.clients and self.clients[nick.lower()] is not client:
+            self.numeric(client, '433', nick, 'Nickname is already in use')
+            return
+        if client.nick:
+            del self.clients[client.nick.lower()]
+            self.send_common(client, ':%s NICK %s' % (client.prefix, nick))
+            for members in self.channels.values():
+                if client.nick.lower() in members:
+                    members.discard(client.nick.lower())
+                    members.add(nick.lower())
+            client.identified = False
+        client.nick = nick
+        self.clients[nick.lower()] = client
+
+    def irc_USER(self, client, args):
+        client.user = args[0]
+        self.numeric(client, '001', 'Welcome to the fake IRC network %s' % client.prefix)
+
+    def irc_PING(self, client, args):
+        client.send(':%s PONG %s :%s' % (SERVER_NAME, SERVER_NAME, args[0]))
+
+    def irc_PONG(self, client, args):
+        token = args[-1]
+        if token in self.pings:
+            _, sent = self.pings.pop(token)
+            delay = time.time() - sent
+            self.pongs.append(delay)
+            if delay > self.ping_late:
+                self.nlate += 1
+
+    def irc_JOIN(self, client, args):
+        for chan in args[0].split(','):
+            members = self.channels.setdefault(chan.lower(), set())
+            members.add(client.nick.lower())
+            for nick in members:
+                self.clients[nick].send(':%s JOIN %s' % (client.prefix, chan))
+            self.irc_NAMES(client, [chan])
+
+    def irc_NAMES(self, client, args):
+        chan = args[0]
+        members = self.channels.get(chan.lower(), set())
+        self.numeric(client, '353', '=', chan, ' '.join(self.clients[nick].nick for nick in members))
+        self.numeric(client, '366', chan, 'End of /NAMES list.')
+
+    def irc_PART(self, client, args):
+        chan = args[0]
+        members = self.channels.get(chan.lower())
+        if members and client.nick.lower() in members:
+            for nick in members:
+                self.clients[nick].send(':%s PART %s' % (client.prefix, chan))
+            members.discard(client.nick.lower())
+
+    def irc_QUIT(self, client, args):
+        self.disconnect(client, args[0] if args else 'Quit')
+
+    def irc_PRIVMSG(self, client, args, cmd='PRIVMSG'):
+        target, text = args[0], args[-1]
+        if target.lower() == NICKSERV.lower():
+            if cmd == 'PRIVMSG':
+                self.nickserv(client, text)
+            return
+        line = ':%s %s %s :%s' % (client.prefix, cmd, target, text)
+        if target[0] in ['#', '&']:
+            for nick in self.channels.get(target.lower(), set()):
+                if nick != client.nick.lower():
+                    self.clients[nick].send(line)
+        elif target.lower() in self.clients:
+            self.clients[target.lower()].send(line)
+        else:
+            self.numeric(client, '401', target, 'No such nick/channel')
+
+    def irc_NOTICE(self, client, args):
+        self.irc_PRIVMSG(client, args, 'NOTICE')
+
+    def irc_WHOIS(self, client, args):
+        nick = args[-1]
+        target = self.clients.get(nick.lower())
+        if target is None:
+            self.numeric(client, '401', nick, 'No such nick/channel')
+            return
+        self.numeric(client, '311', target.nick, target.user or target.nick, target.host, '*', target.nick)
+        self.numeric(client, '318', target.nick, 'End of /WHOIS list.')
+
+    def nickserv(self, client, text):
+        def reply(msg):
+            client.send(':%s!%s@services. NOTICE %s :%s' % (NICKSERV, NICKSERV, client.nick, msg))
+
+        words = text.split()
+        if not words:
+            return
+        cmd = words[0].upper()
+        if cmd == 'IDENTIFY' and len(words) > 1:
+            password = self.registered.get(client.nick.lower())
+            if password is None or password == words[-1]:
+                client.identified = True
+                reply('You are now identified for \x02%s\x02.' % client.nick)
+            else:
+                reply('Invalid password for \x02%s\x02.' % client.nick)
+        elif cmd == 'ACC' and len(words) > 1:
+            target = self.clients.get(words[1].lower())
+            if target is None:
+                status = 0
+            elif target.identified:
+                status = 3
+            else:
+                status = 1
+            reply('%s ACC %d' % (words[1], status))
+        elif cmd == 'LOGOUT':
+            client.identified = False
+            reply('You have been logged out.')
+
+    def ping_stats(self):
+        """Counts of the PINGs sent to real clients, answered ones, late ones and ones never answered"""
+        with self.lock:
+            now = time.time()
+            pongs = sorted(self.pongs)
+            dropped = len([token for token, (_, sent) in self.pings.items() if now - sent > self.ping_late])
+            return {'sent': self.npings, 'answered': len(pongs), 'late': self.nlate, 'dropped': dropped,
+                    'max': pongs[-1] if pongs else None}
+
+
+def main():
+    port = 6667
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    server = FakeIRCd(port=port)
+    server.start()
+    server.logger.info('# Fake IRC server listening on %s:%d', server.host, server.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
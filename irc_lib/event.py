@@ -1,30 +1,62 @@
 import time
+import itertools
 
 from irc_lib.utils.ircname import split_prefix
 
 
+def _intern(value):
+    # only byte strings can be interned
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+# next() on a count is atomic in CPython, so ids stay unique across the handler threads
+_event_ids = itertools.count()
+
+
 class Event(object):
-    maxid = 0
+    __slots__ = ('senderfull', 'cmd', 'target', 'msg', 'type', 'dcc', 'stamp', 'id', '_prefix')
 
     def __init__(self, sender, cmd, target, msg, etype, dcc=False):
-        self.sender, self.senderuser, self.senderhost = split_prefix(sender)
         self.senderfull = sender
-        self.cmd = cmd
+        self.cmd = _intern(cmd)
         self.target = target
         self.msg = msg
         self.type = etype
         self.dcc = dcc
-        if target:
-            self.ischan = target[0] in ['#', '&']
-        else:
-            self.ischan = False
-        if self.ischan:
-            self.chan = self.target
-        else:
-            self.chan = None
         self.stamp = time.time()
-        self.id = Event.maxid
-        Event.maxid += 1
+        self.id = next(_event_ids)
+        # split on first use of sender, senderuser or senderhost
+        self._prefix = None
+
+    def _split_prefix(self):
+        if self._prefix is None:
+            nick, user, host = split_prefix(self.senderfull)
+            self._prefix = (_intern(nick), user, host)
+        return self._prefix
+
+    @property
+    def sender(self):
+        return self._split_prefix()[0]
+
+    @property
+    def senderuser(self):
+        return self._split_prefix()[1]
+
+    @property
+    def senderhost(self):
+        return self._split_prefix()[2]
+
+    @property
+    def ischan(self):
+        return bool(self.target) and self.target[0] in ['#', '&']
+
+    @property
+    def chan(self):
+        if self.ischan:
+            return self.target
+        return None
 
     def __repr__(self):
         return '< Event : [%s][%s][%s] S: %s T: %s M: %s >' % (time.ctime(), self.type.ljust(5), self.cmd.ljust(10),
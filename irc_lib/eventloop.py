@@ -0,0 +1,259 @@
+import os
+import time
+import heapq
+import errno
+import select
+import logging
+import threading
+from collections import deque
+
+
+class Timer(object):
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+
+# Events a file is watched for, the same for every poller
+EVENT_READ = 1
+EVENT_WRITE = 2
+
+
+class SelectPoller(object):
+    """select() over the registered fds, builds its lists on every poll and is limited to FD_SETSIZE fds"""
+    def __init__(self):
+        self.fds = {}
+
+    def register(self, fd, events):
+        self.fds[fd] = events
+
+    def modify(self, fd, events):
+        self.fds[fd] = events
+
+    def unregister(self, fd):
+        self.fds.pop(fd, None)
+
+    def poll(self, timeout):
+        rlist = [fd for fd, events in self.fds.items() if events & EVENT_READ]
+        wlist = [fd for fd, events in self.fds.items() if events & EVENT_WRITE]
+        readable, writable, _ = select.select(rlist, wlist, [], timeout)
+        ready = dict.fromkeys(readable, EVENT_READ)
+        for fd in writable:
+            ready[fd] = ready.get(fd, 0) | EVENT_WRITE
+        return ready.items()
+
+    def close(self):
+        self.fds = {}
+
+
+class EpollPoller(object):
+    """epoll, keeps the registered fds in the kernel so a poll costs the number of ready fds, not of watched ones"""
+    def __init__(self):
+        self.epoll = select.epoll()
+
+    @staticmethod
+    def mask(events):
+        mask = 0
+        if events & EVENT_READ:
+            mask |= select.EPOLLIN
+        if events & EVENT_WRITE:
+            mask |= select.EPOLLOUT
+        return mask
+
+    def register(self, fd, events):
+        self.epoll.register(fd, self.mask(events))
+
+    def modify(self, fd, events):
+        try:
+            self.epoll.modify(fd, self.mask(events))
+        except IOError as exc:
+            # closing a fd drops it from the epoll set, its number may have been reused since
+            if exc.errno != errno.ENOENT:
+                raise
+            self.epoll.register(fd, self.mask(events))
+
+    def unregister(self, fd):
+        try:
+            self.epoll.unregister(fd)
+        except (IOError, ValueError):
+            # already closed
+            pass
+
+    def poll(self, timeout):
+        ready = []
+        for fd, mask in self.epoll.poll(timeout):
+            events = 0
+            # errors and hang ups go to both callbacks, the one reading or writing next gets the error
+            if mask & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP):
+                events |= EVENT_READ
+            if mask & (select.EPOLLOUT | select.EPOLLERR | select.EPOLLHUP):
+                events |= EVENT_WRITE
+            ready.append((fd, events))
+        return ready
+
+    def close(self):
+        self.epoll.close()
+
+
+if hasattr(select, 'epoll'):
+    DefaultPoller = EpollPoller
+else:
+    DefaultPoller = SelectPoller
+
+
+class EventLoop(object):
+    """Single threaded loop running socket callbacks, timers and calls posted from other threads. Files are watched
+    through epoll where available, select otherwise. Readers and writers are to be added and removed from the loop
+    thread, or before it runs."""
+
+    def __init__(self, max_wait=1.0, poller=None):
+        self.logger = logging.getLogger('IRCBot.EventLoop')
+        self.max_wait = max_wait
+        if poller is None:
+            poller = DefaultPoller()
+        self.poller = poller
+        # callbacks and watched events per fd
+        self.readers = {}
+        self.writers = {}
+        self.events = {}
+        # fd of each watched file object, to still find it once the file is closed
+        self.fds = {}
+        self.timers = []
+        self.pending = deque()
+        self.running = False
+        self.thread = None
+        self._wake_r, self._wake_w = os.pipe()
+        self.poller.register(self._wake_r, EVENT_READ)
+
+    def _fd(self, fileobj):
+        fd = self.fds.get(fileobj)
+        if fd is None:
+            fd = self.fds[fileobj] = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        return fd
+
+    def add_reader(self, fileobj, func, *args):
+        fd = self._fd(fileobj)
+        self.readers[fd] = (func, args)
+        self._update(fileobj, fd)
+
+    def remove_reader(self, fileobj):
+        fd = self.fds.get(fileobj)
+        if fd is not None:
+            self.readers.pop(fd, None)
+            self._update(fileobj, fd)
+
+    def add_writer(self, fileobj, func, *args):
+        fd = self._fd(fileobj)
+        self.writers[fd] = (func, args)
+        self._update(fileobj, fd)
+
+    def remove_writer(self, fileobj):
+        fd = self.fds.get(fileobj)
+        if fd is not None:
+            self.writers.pop(fd, None)
+            self._update(fileobj, fd)
+
+    def _update(self, fileobj, fd):
+        events = 0
+        if fd in self.readers:
+            events |= EVENT_READ
+        if fd in self.writers:
+            events |= EVENT_WRITE
+        current = self.events.get(fd)
+        if events == current:
+            return
+        if not events:
+            self.poller.unregister(fd)
+            del self.events[fd]
+            del self.fds[fileobj]
+        elif current is None:
+            self.poller.register(fd, events)
+            self.events[fd] = events
+        else:
+            self.poller.modify(fd, events)
+            self.events[fd] = events
+
+    def call_later(self, delay, func, *args):
+        """Schedule func to run on the loop after delay seconds, must be called from the loop thread"""
+        timer = Timer(time.time() + delay, func, args)
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def call_soon_threadsafe(self, func, *args):
+        """Schedule func to run on the loop, can be called from any thread"""
+        self.pending.append((func, args))
+        self.wakeup()
+
+    def in_loop(self):
+        return threading.current_thread() is self.thread
+
+    def wakeup(self):
+        if self.in_loop():
+            return
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError:
+            pass
+
+    def stop(self):
+        self.running = False
+        self.wakeup()
+
+    def run(self, until=None):
+        """Run the loop until stop() is called or until() returns True"""
+        self.thread = threading.current_thread()
+        self.running = True
+        try:
+            while self.running and not (until and until()):
+                self._run_once()
+        finally:
+            self.running = False
+            self.logger.info('*** EventLoop.run: exited')
+
+    def _run_once(self):
+        timeout = self.max_wait
+        if self.pending:
+            timeout = 0
+        elif self.timers:
+            timeout = max(0, min(timeout, self.timers[0].when - time.time()))
+
+        try:
+            ready = self.poller.poll(timeout)
+        except (select.error, IOError) as exc:
+            if exc.args[0] == errno.EINTR:
+                return
+            raise
+
+        for fd, events in ready:
+            if fd == self._wake_r:
+                os.read(self._wake_r, 4096)
+                continue
+            # a callback may have removed the ones of a later fd
+            if events & EVENT_READ and fd in self.readers:
+                self._call(*self.readers[fd])
+            if events & EVENT_WRITE and fd in self.writers:
+                self._call(*self.writers[fd])
+
+        now = time.time()
+        while self.timers and self.timers[0].when <= now:
+            timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                self._call(timer.func, timer.args)
+
+        for _ in range(len(self.pending)):
+            func, args = self.pending.popleft()
+            self._call(func, args)
+
+    def _call(self, func, args):
+        try:
+            func(*args)  # pylint: disable-msg=W0142
+        except Exception:  # pylint: disable-msg=W0703
+            self.logger.exception('ERROR in %s', getattr(func, '__name__', func))
@@ -1,21 +1,23 @@
 import socket
 import time
 import logging
-import re
 import os
 import pickle
 import threading
 from Queue import Queue, Empty
 
 from irc_lib.event import Event
+from irc_lib.eventloop import EventLoop
 from irc_lib.user import User
-from irc_lib.utils.threadpool import ThreadPool
+from irc_lib.utils.threadpool import ThreadPool, PROTOCOL
+from irc_lib.utils.outqueue import OutQueue, INTERACTIVE
+from irc_lib.utils.resolver import Resolver, UNKNOWN_IP
+from irc_lib.utils.framer import LineFramer
+from irc_lib.utils.metrics import Registry, MetricsServer
+from irc_lib.protocol import inline
 from irc_lib.protocols.irc import IRCProtocol
 
 
-LINESEP_REGEXP = re.compile(r'\r?\n')
-
-
 class Error(Exception):
     pass
 
@@ -27,18 +29,27 @@ class IRCBotError(Error):
 class IRCBotBase(object):
     """Base clase handling bot internal states and protocols.
     Provides a threadpool to handle bot commands, a user list updated as information become available,
-    and access to all the procotols through self.<protocol> (irc, ctcp, dcc, and nickserv)"""
+    and access to all the procotols through self.<protocol> (irc, ctcp, dcc, and nickserv)
+    Bots run by a BotSupervisor are given its threadpool and a view of its metrics, and a name telling their
+    service threads apart."""
 
-    def __init__(self, nick='IRCBotLib', char=':', flood=1000, log_level=logging.WARN):
+    def __init__(self, nick='IRCBotLib', char=':', flood=1000, log_level=logging.WARN, external_ip=None,
+                 threadpool=None, metrics=None, name=None):
         self.log_config(log_level)
         self.logger = logging.getLogger('IRCBot')
 
+        self.name = name
+
+        # Address announced in DCC offers, looked up on ifconfig.me if not given
+        self.external_ip = external_ip
+
         self.whitelist = {}
 
         self.controlchar = char
 
         # Flood protection. Number of char / 30 secs (It is the way it works on esper.net)
         self.floodprotec = flood
+        self.allowed_chars = flood
 
         self.cnick = nick
 
@@ -53,14 +64,37 @@ class IRCBotBase(object):
 
         self.debug = False
 
-        self.nthreads = 10
-        self.threadpool = ThreadPool(self.nthreads)
+        # Seconds a NickServ ACC status is trusted before asking again
+        self.status_ttl = 300
+
+        # Seconds a WHOIS host/IP is trusted, and how long get_ip waits for the WHOIS and DNS answers
+        self.ip_ttl = 600
+        self.whois_timeout = 10
+        self.resolver = Resolver()
+
+        # Latencies, queue depths and counters, shown by !stats and served by serve_metrics
+        if metrics is None:
+            metrics = Registry()
+        self.metrics = metrics
+
+        # CommandProfiler set by !profile, commands run unprofiled while it is None
+        self.profiler = None
+
+        # a shared threadpool is reported once by the supervisor owning it
+        if threadpool is None:
+            threadpool = ThreadPool()
+            threadpool.add_gauges(self.metrics)
+        self.threadpool = threadpool
 
-        # Outbound msgs
-        self.out_msg = Queue()
+        # Outbound msgs, scheduled by priority and target
+        self.out_msg = OutQueue()
 
         self.commandq = Queue()
 
+        self.metrics.gauge('outqueue_depth', self.out_msg.qsize)
+        self.metrics.gauge('commandq_depth', self.commandq.qsize)
+        self.metrics.gauge('flood_allowed_chars', lambda: int(self.allowed_chars))
+
         # IRC Protocol handler
         self.irc = IRCProtocol(self.cnick, self.locks, self, self)
         self.nickserv = self.irc.nickserv
@@ -73,7 +107,10 @@ class IRCBotBase(object):
         self.channels = set()
         self.users = {}
 
-        self.threadpool.add_task(self.command_loop, threadname='CommandLoop')
+        # Per user state of the paged replies of the commands, by nick
+        self.cursors = {}
+
+        self.start_command_loop()
 
     @staticmethod
     def log_config(level=logging.WARN):
@@ -90,11 +127,12 @@ class IRCBotBase(object):
         # This way, everything slow down when we reach the flood limit, but after 30 seconds, the bucket is full again.
 
         try:
-            allowed_chars = self.floodprotec
+            self.allowed_chars = self.floodprotec
             start_time = time.time()
             while not self.exit:
                 delta_time = time.time() - start_time
-                allowed_chars = min(allowed_chars + (self.floodprotec / 30.0) * delta_time, self.floodprotec)
+                self.allowed_chars = min(self.allowed_chars + (self.floodprotec / 30.0) * delta_time,
+                                         self.floodprotec)
                 start_time = time.time()
 
                 if not self.irc_socket:
@@ -107,14 +145,15 @@ class IRCBotBase(object):
 
                 self.logger.debug('> %s', repr(msg))
                 out_line = msg + '\r\n'
-                if len(out_line) > int(allowed_chars):
+                if len(out_line) > int(self.allowed_chars):
+                    self.metrics.counter('flood_delays').inc()
                     time.sleep((len(out_line) * 1.25) / (self.floodprotec / 30.0))
                 try:
                     self.irc_socket.sendall(out_line)
                 except socket.error:
                     self.out_msg.task_done()
                     raise
-                allowed_chars -= len(out_line)
+                self.allowed_chars -= len(out_line)
                 self.out_msg.task_done()
         finally:
             self.logger.info('*** IRCBot.outbound_loop: exited')
@@ -122,30 +161,54 @@ class IRCBotBase(object):
     def inbound_loop(self):
         """Incoming message thread. Check for new data on the socket and send the data to the irc protocol handler."""
         try:
-            buf = ''
+            framer = LineFramer('irc')
             while not self.exit:
                 if not self.irc_socket:
                     raise IRCBotError('no socket')
 
                 # breaks with error: [Errno 104] Connection reset by peer
                 try:
-                    new_data = self.irc_socket.recv(512)
+                    if not framer.recv(self.irc_socket):
+                        raise IRCBotError('no data')
                 except socket.timeout:
                     continue
-                if not new_data:
-                    raise IRCBotError('no data')
-
-                msg_list = LINESEP_REGEXP.split(buf + new_data)
-
-                # Push last line back into buffer in case its truncated
-                buf = msg_list.pop()
 
-                for msg in msg_list:
+                for msg in framer.lines():
                     self.logger.debug('< %s', repr(msg))
                     self.irc.process_msg(msg)
         finally:
             self.logger.info('*** IRCBot.inbound_loop: exited')
 
+    def threadname(self, name):
+        if self.name:
+            return '%s.%s' % (self.name, name)
+        return name
+
+    def start_command_loop(self):
+        self.threadpool.add_task(self.command_loop, threadname=self.threadname('CommandLoop'))
+
+    def start_dcc(self, dcc):
+        """DCC sessions run on an event loop of their own, in a single thread whatever their number"""
+        loop = EventLoop()
+        dcc.start(loop)
+        self.threadpool.add_task(self.dcc_loop, dcc, loop, threadname=self.threadname('DCCLoop'))
+
+    def dcc_loop(self, dcc, loop):
+        try:
+            loop.run(lambda: self.exit)
+        finally:
+            dcc.close_all()
+
+    def dispatch(self, func, *args):
+        """Run an event handler, directly if it is marked @inline, on the protocol lane of the threadpool otherwise"""
+        if getattr(func, 'inline', False):
+            try:
+                func(*args)  # pylint: disable-msg=W0142
+            except Exception:  # pylint: disable-msg=W0703
+                self.logger.exception('ERROR in %s', func.__name__)
+        else:
+            self.threadpool.add_task(func, *args, lane=PROTOCOL)
+
     def command_loop(self):
         try:
             while not self.exit:
@@ -183,7 +246,10 @@ class IRCBotBase(object):
             outmsg = ''
 
         evcmd = Event(sender, outcmd, target, outmsg, 'CMD', dcc=dcc)
-        self.commandq.put(evcmd)
+        self.queue_command(evcmd)
+
+    def queue_command(self, evt):
+        self.commandq.put(evt)
 
     def connect(self, server, port=6667, password=None):
         """Connect to a server, handle authentification and start the communication threads."""
@@ -194,8 +260,8 @@ class IRCBotBase(object):
         self.irc_socket.connect((server, port))
         self.irc_socket.settimeout(5)
 
-        self.threadpool.add_task(self.inbound_loop, threadname='MainInLoop')
-        self.threadpool.add_task(self.outbound_loop, threadname='MainOutLoop')
+        self.threadpool.add_task(self.inbound_loop, threadname=self.threadname('MainInLoop'))
+        self.threadpool.add_task(self.outbound_loop, threadname=self.threadname('MainOutLoop'))
 
         self.irc.password(password)
         self.irc.nick()
@@ -204,39 +270,79 @@ class IRCBotBase(object):
         # wait until we are connected before returning
         self.locks['ServReg'].wait()
 
+    @inline
     def on_default(self, evt):
         """Default event handler (do nothing)"""
         pass
 
     def get_ip(self, nick):
-        if nick not in self.users:
-            self.users[nick] = User(nick)
+        with self.locks['WhoIs']:
+            if nick not in self.users:
+                self.users[nick] = User(nick)
+            user = self.users[nick]
+            if user.ip is not None and time.time() - user.ip_time < self.ip_ttl:
+                return user.ip
+            user.ip = None
+        start = time.time()
         self.irc.whois(nick)
+        deadline = start + self.whois_timeout
         with self.locks['WhoIs']:
-            while self.users[nick].ip is None:
-                self.locks['WhoIs'].wait()
-        return self.users[nick].ip
+            while user.ip is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.logger.warning('*** IRCBot.get_ip: timed out: %s', nick)
+                    self.metrics.counter('whois_timeouts').inc()
+                    return UNKNOWN_IP
+                self.locks['WhoIs'].wait(remaining)
+            self.metrics.observe('whois_seconds', time.time() - start)
+            return user.ip
 
     def get_status(self, nick):
-        if nick not in self.users:
-            self.users[nick] = User(nick)
-        if self.nickserv.online:
-            self.nickserv.status(nick)
-            with self.locks['NSStatus']:
-                while self.users[nick].status is None:
-                    self.locks['NSStatus'].wait()
-        else:
-            self.users[nick].status = 3
-        return self.users[nick].status
+        with self.locks['NSStatus']:
+            if nick not in self.users:
+                self.users[nick] = User(nick)
+            user = self.users[nick]
+            # the QUIT and NICK of a user sharing no channel with the bot are never seen, its status can't be kept
+            if user.chans and user.status is not None and time.time() - user.status_time < self.status_ttl:
+                return user.status
+            if not self.nickserv.online:
+                user.status = 3
+                user.status_time = time.time()
+                return user.status
+            user.status = None
+        start = time.time()
+        self.nickserv.status(nick)
+        with self.locks['NSStatus']:
+            while user.status is None:
+                self.locks['NSStatus'].wait()
+            self.metrics.observe('nickserv_status_seconds', time.time() - start)
+            return user.status
+
+    def invalidate_status(self, nick=None):
+        """Forget the cached NickServ status of nick, or of every user if nick is None"""
+        with self.locks['NSStatus']:
+            if nick is None:
+                users = self.users.values()
+            elif nick in self.users:
+                users = [self.users[nick]]
+            else:
+                users = []
+            for user in users:
+                if user.status is not None:
+                    user.status = None
+                    user.status_time = 0
+
+    def rawcmd(self, msg, priority=INTERACTIVE, target=None):
+        self.out_msg.put(msg, priority, target)
 
-    def rawcmd(self, msg):
-        self.out_msg.put(msg)
+    def rawcmds(self, msgs, priority=INTERACTIVE, target=None):
+        self.out_msg.put_many(msgs, priority, target)
 
     def say(self, target, msg, dcc=False):
         if not msg:
             return
         if dcc:
-            if target in self.dcc.sockets and self.dcc.sockets[target]:
+            if target in self.dcc.sessions:
                 self.dcc.say(target, msg)
         else:
             if target[0] in ['#', '&']:
@@ -244,6 +350,16 @@ class IRCBotBase(object):
             else:
                 self.irc.notice(target, msg)
 
+    def say_block(self, target, msgs, dcc=False):
+        """Send lines already converted by conv_s2i, as one block that other replies to target can't split"""
+        if not msgs:
+            return
+        if dcc:
+            if target in self.dcc.sessions:
+                self.dcc.say_block(target, msgs)
+        else:
+            self.irc.say_block(target, msgs)
+
     def add_whitelist(self, nick, level=4):
         self.whitelist[nick] = level
 
@@ -259,6 +375,12 @@ class IRCBotBase(object):
             with open(filename, 'r') as fh:
                 self.whitelist = pickle.load(fh)
 
+    def serve_metrics(self, port, host='127.0.0.1'):
+        """Serve the metrics in the Prometheus text format on http://host:port/metrics until the bot exits"""
+        server = MetricsServer(self.metrics, port, host)
+        self.threadpool.add_task(server.serve_until, lambda: self.exit, threadname=self.threadname('MetricsLoop'))
+        return server
+
     def start(self):
         """Start an infinite loop which can be exited by ctrl+c. Take care of cleaning the threads when exiting."""
         try:
@@ -0,0 +1,155 @@
+import time
+import errno
+import socket
+import logging
+from Queue import Empty
+
+from irc_lib.eventloop import EventLoop
+from irc_lib.ircbot import IRCBotBase, IRCBotError
+from irc_lib.utils.framer import LineFramer
+from irc_lib.utils.outqueue import INTERACTIVE
+
+
+class LoopBotBase(IRCBotBase):
+    """Alternative to IRCBotBase running socket reads, writes, flood pacing and DCC sessions on a single event loop.
+    Protocol handlers marked @inline are called from the loop, the others and bot commands (and any blocking DB work
+    they do) are handed to the threadpool, which is used as an executor."""
+
+    def __init__(self, nick='IRCBotLib', char=':', flood=1000, log_level=logging.WARN, external_ip=None,
+                 threadpool=None, metrics=None, name=None):
+        self.loop = EventLoop()
+
+        self.framer = LineFramer('irc')
+        self.out_buffer = ''
+
+        # Flood protection state, see IRCBotBase.outbound_loop
+        self.last_refill = time.time()
+        self.delayed_line = None
+        self.delayed_timer = None
+
+        IRCBotBase.__init__(self, nick, char, flood, log_level, external_ip, threadpool, metrics, name)
+
+    def start_command_loop(self):
+        # commands are handed to the threadpool directly by queue_command
+        pass
+
+    def queue_command(self, evt):
+        cmd_func = getattr(self, 'on_cmd', self.on_default)
+        # the loop can't wait for room in the command lane, drop the command instead
+        if not self.threadpool.try_add_task(cmd_func, evt):
+            self.logger.warning('*** LoopBot.queue_command: command lane full, dropped %s from %s', evt.cmd,
+                                evt.sender)
+            self.say(evt.sender, 'Too busy right now, try again later', evt.dcc)
+
+    def start_dcc(self, dcc):
+        dcc.start(self.loop)
+
+    def run_loop(self):
+        try:
+            self.loop.run(lambda: self.exit)
+        finally:
+            self.dcc.close_all()
+
+    def connect(self, server, port=6667, password=None):
+        """Connect to a server, handle authentification and start the event loop."""
+        if self.irc_socket:
+            raise IRCBotError('Socket already existing, can not complete the connect command')
+        self.logger.info('# Connecting to %s:%d', server, port)
+        self.irc_socket = socket.socket()
+        self.irc_socket.connect((server, port))
+        self.irc_socket.setblocking(0)
+
+        self.loop.add_reader(self.irc_socket, self.handle_read)
+        self.threadpool.add_task(self.run_loop, threadname=self.threadname('EventLoop'))
+
+        self.irc.password(password)
+        self.irc.nick()
+        self.irc.user()
+
+        # wait until we are connected before returning
+        self.locks['ServReg'].wait()
+
+    def connection_lost(self, reason):
+        """Stop the bot, an exception raised here would only be logged by the loop"""
+        self.logger.error('*** LoopBot: connection lost: %s', reason)
+        self.loop.remove_reader(self.irc_socket)
+        self.loop.remove_writer(self.irc_socket)
+        self.exit = True
+        self.loop.stop()
+
+    def handle_read(self):
+        try:
+            nbytes = self.framer.recv(self.irc_socket)
+        except socket.error as exc:
+            if exc.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.connection_lost(str(exc))
+            return
+        if not nbytes:
+            self.connection_lost('no data')
+            return
+
+        for msg in self.framer.lines():
+            self.logger.debug('< %s', repr(msg))
+            self.irc.process_msg(msg)
+
+    def handle_write(self):
+        try:
+            sent = self.irc_socket.send(self.out_buffer)
+        except socket.error as exc:
+            if exc.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.connection_lost(str(exc))
+                return
+            sent = 0
+        self.out_buffer = self.out_buffer[sent:]
+        if self.out_buffer:
+            self.loop.add_writer(self.irc_socket, self.handle_write)
+        else:
+            self.loop.remove_writer(self.irc_socket)
+
+    def send_line(self, out_line):
+        self.out_buffer += out_line
+        self.allowed_chars -= len(out_line)
+        self.handle_write()
+
+    def rawcmd(self, msg, priority=INTERACTIVE, target=None):
+        self.out_msg.put(msg, priority, target)
+        self.loop.call_soon_threadsafe(self.flush_outbound)
+
+    def rawcmds(self, msgs, priority=INTERACTIVE, target=None):
+        self.out_msg.put_many(msgs, priority, target)
+        self.loop.call_soon_threadsafe(self.flush_outbound)
+
+    def flush_outbound(self):
+        """Move queued lines to the socket buffer as long as the flood protection allows it. If a line doesn't fit in
+        the char bucket it is held back on a timer instead of sleeping, so the loop keeps running."""
+        if self.delayed_timer or not self.irc_socket:
+            return
+        while True:
+            now = time.time()
+            self.allowed_chars = min(self.allowed_chars + (self.floodprotec / 30.0) * (now - self.last_refill),
+                                     self.floodprotec)
+            self.last_refill = now
+
+            try:
+                msg = self.out_msg.get_nowait()
+            except Empty:
+                return
+            self.out_msg.task_done()
+
+            self.logger.debug('> %s', repr(msg))
+            out_line = msg + '\r\n'
+            if len(out_line) > int(self.allowed_chars):
+                self.metrics.counter('flood_delays').inc()
+                self.delayed_line = out_line
+                self.delayed_timer = self.loop.call_later((len(out_line) * 1.25) / (self.floodprotec / 30.0),
+                                                          self.send_delayed)
+                return
+            self.send_line(out_line)
+
+    def send_delayed(self):
+        out_line = self.delayed_line
+        self.delayed_line = None
+        self.delayed_timer = None
+        self.send_line(out_line)
+        self.flush_outbound()
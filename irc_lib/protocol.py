@@ -1,6 +1,24 @@
 import logging
 
 
+def inline(func):
+    """Mark an event handler as cheap and non blocking, so it is run directly by the thread reading the socket
+    instead of being submitted to the threadpool"""
+    func.inline = True
+    return func
+
+
+def handler_table(obj, prefix):
+    """{event: bound method} for all the <prefix><event> handlers of obj, built once so events don't need a getattr.
+    The <prefix>default handler, if any, is stored under None."""
+    table = {}
+    for name in dir(obj):
+        if name.startswith(prefix):
+            table[name[len(prefix):]] = getattr(obj, name)
+    table[None] = table.pop('default', None)
+    return table
+
+
 class Protocol(object):
     def __init__(self, nick, locks, bot, parent, logger='IRCBot.protocol'):
         self.logger = logging.getLogger(logger)
@@ -8,3 +26,11 @@ class Protocol(object):
         self.locks = locks
         self.bot = bot
         self.parent = parent
+
+    def handler_tables(self, prefix, bot_default=True):
+        """Handler tables of the protocol and of the bot, the bot default falls back to on_default if bot_default"""
+        handlers = handler_table(self, prefix)
+        bot_handlers = handler_table(self.bot, prefix)
+        if bot_default and bot_handlers[None] is None:
+            bot_handlers[None] = self.bot.on_default
+        return handlers, bot_handlers
@@ -1,7 +1,7 @@
 import time
 
 from irc_lib.event import Event
-from irc_lib.protocol import Protocol
+from irc_lib.protocol import Protocol, inline
 from irc_lib.protocols.dcc import DCCProtocol
 
 
@@ -12,6 +12,7 @@ class CTCPProtocol(Protocol):
     def __init__(self, nick, locks, bot, parent):
         Protocol.__init__(self, nick, locks, bot, parent, 'IRCBot.CTCP')
         self.irc = self.parent
+        self.handlers, self.bot_handlers = self.handler_tables('onCTCP_')
         self.dcc = DCCProtocol(self.cnick, self.locks, self.bot, self)
 
     def process_msg(self, prefix, target, msg):
@@ -29,33 +30,42 @@ class CTCPProtocol(Protocol):
 
         evt = Event(prefix, cmd, target, data, 'CTCP')
 
-        cmd_func = getattr(self, 'onCTCP_%s' % evt.cmd, self.onCTCP_default)
-        cmd_func(evt)
+        # called from onIRC_PRIVMSG on the reader, only the handlers marked @inline may run there
+        cmd_func = self.handlers.get(evt.cmd) or self.handlers[None]
+        self.bot.dispatch(cmd_func, evt)
 
-        cmd_func = getattr(self.bot, 'onCTCP_%s' % evt.cmd, getattr(self.bot, 'onCTCP_default', self.bot.on_default))
-        cmd_func(evt)
+        cmd_func = self.bot_handlers.get(evt.cmd) or self.bot_handlers[None]
+        self.bot.dispatch(cmd_func, evt)
 
+    @inline
     def onCTCP_DCC(self, evt):
         self.dcc.process_msg(evt.senderfull, evt.target, evt.msg)
 
+    @inline
     def onCTCP_VERSION(self, evt):
         self.ctcp_notice(evt.sender, 'VERSION', 'PMIrcLib:0.1:Python')
 
+    @inline
     def onCTCP_USERINFO(self, evt):
         self.ctcp_notice(evt.sender, 'USERINFO', 'I am a bot.')
 
+    @inline
     def onCTCP_CLIENTINFO(self, evt):
         self.ctcp_notice(evt.sender, 'CLIENTINFO', 'PING VERSION TIME USERINFO CLIENTINFO')
 
+    @inline
     def onCTCP_PING(self, evt):
         self.ctcp_notice(evt.sender, 'PING', evt.msg)
 
+    @inline
     def onCTCP_TIME(self, evt):
         self.ctcp_notice(evt.sender, 'TIME', time.ctime())
 
+    @inline
     def onCTCP_ACTION(self, evt):
         pass
 
+    @inline
     def onCTCP_default(self, evt):
         self.logger.info('RAW CTCP EVENT: %s %s %s %s', evt.sender, evt.target, evt.cmd, repr(evt.msg))
 
@@ -1,30 +1,106 @@
+import time
+import errno
 import socket
 import urllib
-import select
+import threading
 
 from irc_lib.event import Event
 from irc_lib.utils.colors import conv_s2i
-from irc_lib.protocol import Protocol
-import irc_lib.ircbot
+from irc_lib.protocol import Protocol, inline
+from irc_lib.utils.framer import LineFramer
+from irc_lib.utils.resolver import UNKNOWN_IP
 
 
-class DCCSocket(object):
-    def __init__(self, socket_, nick):
-        self.buffer = ''
+# Bytes of output a session can hold for a client not reading them before it is disconnected
+MAX_BUFFER = 256 * 1024
+# Seconds an offered chat waits for the user to connect
+OFFER_TTL = 120
+
+# States of a session. A closing one takes no more output and is closed by the loop.
+OPEN, CLOSING, CLOSED = 'open', 'closing', 'closed'
+
+
+class DCCSession(object):
+    """A chat with nick over a non-blocking socket. Output from any thread is appended to the session buffer and
+    written by the DCC loop as fast as the client takes it. The buffer is bounded by max_buffer, except for a
+    single block written to an empty buffer."""
+    def __init__(self, socket_, nick, max_buffer=MAX_BUFFER):
+        socket_.setblocking(0)
+        self.framer = LineFramer(nick)
         self.socket = socket_
+        # kept for the loop to unregister the socket once closed
+        self.fd = socket_.fileno()
         self.nick = nick
+        self.max_buffer = max_buffer
+        self.lock = threading.Lock()
+        self.chunks = []
+        self.size = 0
+        self.opened = time.time()
+        self.state = OPEN
 
     def fileno(self):
-        return self.socket.fileno()
+        return self.fd
+
+    def write(self, data):
+        """Append data to the output buffer, False if the session isn't open or the buffer is full"""
+        with self.lock:
+            if self.state != OPEN or self.size and self.size + len(data) > self.max_buffer:
+                return False
+            self.chunks.append(data)
+            self.size += len(data)
+            return True
+
+    def flush(self):
+        """Send as much of the buffer as the socket takes without blocking, True once it is empty"""
+        with self.lock:
+            if not self.chunks or self.state != OPEN:
+                return True
+            data = ''.join(self.chunks)
+            try:
+                sent = self.socket.send(data)
+            except socket.error as exc:
+                if exc.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                sent = 0
+            data = data[sent:]
+            self.chunks = [data] if data else []
+            self.size = len(data)
+            return not data
+
+    def shutdown(self):
+        """Stop taking output, True for the caller moving the session from open to closing"""
+        with self.lock:
+            if self.state != OPEN:
+                return False
+            self.state = CLOSING
+            return True
+
+    def close(self):
+        with self.lock:
+            self.state = CLOSED
+            self.chunks = []
+            self.size = 0
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
 
 
 class DCCProtocol(Protocol):
     def __init__(self, nick, locks, bot, parent):
         Protocol.__init__(self, nick, locks, bot, parent, 'IRCBot.DCC')
         self.ctcp = self.parent
-
-        self.sockets = {}
-        self.ip2nick = {}
+        self.handlers, self.bot_handlers = self.handler_tables('onDCC_')
+
+        # sessions and offers are changed by the DCC loop and by the command threads
+        self.lock = threading.Lock()
+        self.sessions = {}
+        # nick and expiry time of the chat offered, per ip of the user
+        self.offers = {}
+        # lines to send to a nick as soon as the chat it was offered is accepted, dropped with the offer
+        self.pending = {}
+        self.max_buffer = MAX_BUFFER
+        self.loop = None
         self.inip = None
         self.inport = None
 
@@ -38,12 +114,26 @@ class DCCProtocol(Protocol):
         except socket.error:
             self.logger.exception('*** DCC: bind insocket failed')
             return
-        externalip = urllib.urlopen('http://ifconfig.me/ip').readlines()[0]
+        externalip = self.bot.external_ip
+        if not externalip:
+            try:
+                externalip = urllib.urlopen('http://ifconfig.me/ip').readlines()[0].strip()
+            except (IOError, IndexError):
+                self.logger.exception('*** DCC: external ip lookup failed, DCC disabled')
+                return
         self.inip = self.conv_ip_std_long(externalip)
         self.inport = listenport
         self.logger.info('# DCC listening on %s:%d %s', listenhost, listenport, externalip)
 
-        self.bot.threadpool.add_task(self.inbound_loop, threadname='DCCInLoop')
+        self.bot.metrics.gauge('dcc_sessions', lambda: len(self.sessions))
+        self.bot.metrics.gauge('dcc_buffered_bytes', lambda: sum(session.size for session in self.sessions.values()))
+        self.bot.start_dcc(self)
+
+    def start(self, loop):
+        """Serve the chats on loop, run by the bot. Everything touching the sockets happens on the loop thread."""
+        self.loop = loop
+        self.insocket.setblocking(0)
+        loop.add_reader(self.insocket, self.accept)
 
     def process_msg(self, sender, target, msg):
         dcccmd, _, dccargs = msg.partition(' ')
@@ -51,19 +141,19 @@ class DCCProtocol(Protocol):
         # regenerate event with parsed dcc details
         evt = Event(sender, dcccmd, target, dccargs, 'DCC')
 
-        cmd_func = getattr(self, 'onDCC_%s' % dcccmd, self.onDCC_default)
-        cmd_func(evt)
+        cmd_func = self.handlers.get(dcccmd) or self.handlers[None]
+        self.bot.dispatch(cmd_func, evt)
 
-        cmd_func = getattr(self.bot, 'onDCC_%s' % dcccmd, getattr(self.bot, 'onDCC_default', self.bot.on_default))
-        cmd_func(evt)
+        cmd_func = self.bot_handlers.get(dcccmd) or self.bot_handlers[None]
+        self.bot.dispatch(cmd_func, evt)
 
     def process_DCCmsg(self, sender, msg):
         evt = Event(sender, 'DCCMSG', self.cnick, msg, 'DCC', dcc=True)
 
-        self.bot.threadpool.add_task(self.onDCC_msg, evt)
+        self.bot.dispatch(self.onDCC_msg, evt)
 
-        cmd_func = getattr(self.bot, 'onDCC_msg', self.bot.on_default)
-        self.bot.threadpool.add_task(cmd_func, evt)
+        cmd_func = self.bot_handlers.get('msg') or self.bot.on_default
+        self.bot.dispatch(cmd_func, evt)
 
     def conv_ip_long_std(self, longip):
         try:
@@ -95,67 +185,87 @@ class DCCProtocol(Protocol):
             longip += ip_part << shift
         return longip
 
-    def inbound_loop(self):
-        inp = [self.insocket]
-        while not self.bot.exit:
-            inputready, _, _ = select.select(inp, [], [], 5)
-
-            for skt in inputready:
-                if skt == self.insocket:
-                    self.logger.info('# Received connection request')
-                    # handle the server socket
-                    buffsocket, buffip = self.insocket.accept()
-                    ip = buffip[0]
-                    if ip in self.ip2nick:
-                        nick = self.ip2nick[ip]
-                        self.logger.info('# User identified as: %s %s', nick, ip)
-                        self.sockets[nick] = DCCSocket(buffsocket, nick)
-                        self.say(nick, 'Connection with user %s established' % nick)
-                        inp.append(self.sockets[nick])
-                    else:
-                        self.logger.warn('*** DCC.inbound_loop: connect from unknown ip: %s', ip)
-                else:
-                    # handle all other sockets
-                    new_data = None
-                    close_socket = False
-                    try:
-                        new_data = skt.socket.recv(512)
-                    except socket.timeout:
-                        self.logger.info('*** DCC.inbound_loop: Connection closed [timeout]: %s', skt.nick)
-                        close_socket = True
-                    except socket.error as exc:
-                        if 'Connection reset by peer' in exc:
-                            self.logger.info('*** DCC.inbound_loop: Connection closed [reset]: %s', skt.nick)
-                        elif 'Connection timed out' in exc:
-                            self.logger.info('*** DCC.inbound_loop: Connection closed [timeout]: %s', skt.nick)
-                        else:
-                            self.logger.exception('*** DCC.inbound_loop: Connection closed [error]: %s', skt.nick)
-                        close_socket = True
-                    if not close_socket and not new_data:
-                        self.logger.info('*** DCC.inbound_loop: Connection closed [no data]: %s', skt.nick)
-                        close_socket = True
-                    if close_socket:
-                        if skt.nick in self.sockets:
-                            del self.sockets[skt.nick]
-                        else:
-                            self.logger.info('*** DCC.inbound_loop: not in sockets: %s', skt.nick)
-                        skt.socket.close()
-                        inp.remove(skt)
-                        continue
-
-                    msg_list = irc_lib.ircbot.LINESEP_REGEXP.split(skt.buffer + new_data)
-
-                    # Push last line back into buffer in case its truncated
-                    skt.buffer = msg_list.pop()
-
-                    for msg in msg_list:
-                        self.logger.debug('< %s %s', skt.nick, repr(msg))
-                        self.process_DCCmsg(skt.nick, msg)
-        self.logger.info('*** DCC.inbound_loop: exited')
+    def accept(self):
+        """Accept a pending connection on the listening socket if it comes from the ip a chat was offered to. A
+        previous session of the same nick is closed once the new one is up."""
+        try:
+            skt, address = self.insocket.accept()
+        except socket.error as exc:
+            if exc.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.logger.exception('*** DCC.accept: accept failed')
+            return
+        ip = address[0]
+        with self.lock:
+            self.expire_offers()
+            nick, _ = self.offers.pop(ip, (None, 0))
+        if nick is None:
+            self.logger.warn('*** DCC.accept: connect from unknown ip: %s', ip)
+            skt.close()
+            return
+        self.logger.info('# User identified as: %s %s', nick, ip)
+        session = DCCSession(skt, nick, self.max_buffer)
+        with self.lock:
+            old_session = self.sessions.get(nick)
+            self.sessions[nick] = session
+            pending = self.pending.pop(nick, [])
+        if old_session is not None:
+            self.close_session(old_session, 'replaced')
+        self.loop.add_reader(session, self.read, session)
+        self.say(nick, 'Connection with user %s established' % nick)
+        self.say_block(nick, pending)
+
+    def read(self, session):
+        """Read available data from a session, closing it on error or once the client is gone"""
+        try:
+            nbytes = session.framer.recv(session.socket)
+        except socket.error as exc:
+            if exc.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.close_session(session, exc.args[-1])
+            return
+        if not nbytes:
+            self.close_session(session, 'no data')
+            return
+
+        for msg in session.framer.lines():
+            self.logger.debug('< %s %s', session.nick, repr(msg))
+            self.process_DCCmsg(session.nick, msg)
 
+    def flush(self, session):
+        """Write the buffer of a session, watching the socket for room as long as some of it is left"""
+        if session.state != OPEN:
+            return
+        try:
+            done = session.flush()
+        except socket.error as exc:
+            self.close_session(session, exc.args[-1])
+            return
+        if done:
+            self.loop.remove_writer(session)
+        else:
+            self.loop.add_writer(session, self.flush, session)
+
+    def close_session(self, session, reason):
+        """Unregister and close a session, on the loop thread"""
+        with self.lock:
+            if self.sessions.get(session.nick) is session:
+                del self.sessions[session.nick]
+        if session.state == CLOSED:
+            return
+        self.logger.info('*** DCC: Connection closed [%s]: %s', reason, session.nick)
+        self.loop.remove_reader(session)
+        self.loop.remove_writer(session)
+        session.close()
+
+    def close_all(self):
+        for session in self.sessions.values():
+            self.close_session(session, 'exit')
+
+    @inline
     def onDCC_msg(self, evt):
         self.bot.process_msg(evt.sender, self.cnick, evt.msg, dcc=evt.dcc)
 
+    @inline
     def onDCC_CHAT(self, evt):
         nick = evt.sender
         args = evt.msg.split()
@@ -168,6 +278,7 @@ class DCCProtocol(Protocol):
 
         self.logger.info('onDCC_CHAT: %s %s | IP:%s Port:%s', evt.sender, repr(evt.msg), dccip, dccport)
 
+    @inline
     def onDCC_default(self, evt):
         self.logger.info('RAW DCC EVENT: %s %s %s %s', evt.sender, evt.target, evt.cmd, repr(evt.msg))
 
@@ -182,33 +293,77 @@ class DCCProtocol(Protocol):
     def say(self, nick, msg, color=True):
         if color:
             msg = conv_s2i(msg)
-        if nick not in self.sockets:
-            self.logger.error('*** DCC.say: unknown nick: %s', nick)
-            return
-
         self.logger.debug('> %s %s', nick, repr(msg))
-        out_line = msg + '\r\n'
-        try:
-            self.sockets[nick].socket.sendall(out_line)
-        except socket.error:
-            self.logger.exception('*** DCC.say: socket.error: %s', nick)
-            return
-        except KeyError:
-            self.logger.error('*** DCC.say: unknown nick: %s', nick)
-            return
+        self.send(nick, msg + '\r\n')
+
+    def send(self, nick, data):
+        """Queue data on the session of nick without blocking, the loop writes it. A session whose buffer is full is
+        closed, returns False then or if nick has no session."""
+        session = self.sessions.get(nick)
+        if session is None:
+            self.logger.error('*** DCC.send: unknown nick: %s', nick)
+            return False
+        if not session.write(data):
+            if session.shutdown():
+                self.logger.warn('*** DCC.send: output buffer full: %s', nick)
+                self.bot.metrics.counter('dcc_overflows').inc()
+                self.loop.call_soon_threadsafe(self.close_session, session, 'buffer full')
+                self.bot.say(nick, '$BDCC chat closed, the output was not read fast enough')
+            return False
+        self.loop.call_soon_threadsafe(self.flush, session)
+        return True
+
+    def offer(self, nick, lines):
+        """Offer a chat to nick and send it lines once accepted, returns False if the chat can't be offered"""
+        if not self.inip:
+            return False
+        with self.lock:
+            self.pending[nick] = list(lines)
+        if not self.dcc(nick):
+            with self.lock:
+                self.pending.pop(nick, None)
+            return False
+        return True
+
+    def expire_offers(self):
+        """Drop the offers not accepted in time and the lines waiting for them, called holding the lock"""
+        now = time.time()
+        for ip, (nick, expiry) in self.offers.items():
+            if expiry < now:
+                del self.offers[ip]
+                self.pending.pop(nick, None)
+
+    def say_block(self, nick, msgs):
+        """Send several lines already converted by conv_s2i with a single write"""
+        if msgs:
+            self.logger.debug('> %s %d lines', nick, len(msgs))
+            self.send(nick, '\r\n'.join(msgs) + '\r\n')
 
     def dcc(self, nick):
+        """Offer a chat to nick, returns False if it couldn't be offered"""
         if not self.inip:
             self.bot.say(nick, '$BDCC currently disabled')
-            return
+            return False
 
         target_ip = self.bot.get_ip(nick)
-
-        if nick in self.sockets and self.sockets[nick] is not None:
+        if target_ip == UNKNOWN_IP:
+            # the connection of the user couldn't be told from any other
+            self.logger.warn('*** DCC.dcc: unknown ip: %s', nick)
+            self.bot.say(nick, '$BDCC failed, your address could not be found. Try again later')
+            return False
+
+        if nick in self.sessions:
+            # the current session goes on until the new one is accepted
             self.logger.warn('*** DCC.dcc: already connected: %s', nick)
-            # this is breaking the select loop in inbound_loop
-            del self.sockets[nick]
-        self.sockets[nick] = None
-
-        self.ip2nick[target_ip] = nick
+        with self.lock:
+            self.expire_offers()
+            # a connection only tells its ip, two users behind the same address can't have an offer at once
+            other_nick, _ = self.offers.get(target_ip, (nick, 0))
+            if other_nick == nick:
+                self.offers[target_ip] = (nick, time.time() + OFFER_TTL)
+        if other_nick != nick:
+            self.logger.warn('*** DCC.dcc: offer to %s pending from the same ip: %s', other_nick, nick)
+            self.bot.say(nick, '$BDCC failed, a chat offered to someone at your address is pending. Try again later')
+            return False
         self.dcc_privmsg(nick, 'CHAT', 'CHAT %s %s' % (self.inip, self.inport))
+        return True
@@ -1,8 +1,12 @@
+import time
+
 from irc_lib.event import Event
 from irc_lib.user import User
 from irc_lib.utils.colors import conv_s2i
-from irc_lib.utils.ircname import get_nick, get_ip
-from irc_lib.protocol import Protocol
+from irc_lib.utils.ircname import get_nick
+from irc_lib.protocol import Protocol, inline
+from irc_lib.utils.outqueue import PROTOCOL, INTERACTIVE
+from irc_lib.utils.resolver import UNKNOWN_IP
 from irc_lib.protocols.ctcp import CTCPProtocol, CTCP_DELIMITER
 from irc_lib.protocols.nickserv import NickServProtocol, NICKSERV
 
@@ -13,6 +17,7 @@ class IRCProtocol(Protocol):
         self.nickserv = NickServProtocol(self.cnick, self.locks, self.bot, self)
         self.ctcp = CTCPProtocol(self.cnick, self.locks, self.bot, self)
         self.dcc = self.ctcp.dcc
+        self.handlers, self.bot_handlers = self.handler_tables('onIRC_', bot_default=False)
 
     def process_msg(self, msg):
         if not msg:
@@ -36,17 +41,17 @@ class IRCProtocol(Protocol):
             cmd = _IRC_REPLIES[cmd]
 
         # We call the corresponding raw event if it exist, or the rawDefault if not.
-        cmd_func = getattr(self, 'onIRC_%s' % cmd, self.onIRC_default)
-        self.bot.threadpool.add_task(cmd_func, cmd, prefix, args)
+        cmd_func = self.handlers.get(cmd) or self.handlers[None]
+        self.bot.dispatch(cmd_func, cmd, prefix, args)
 
         # We call the corresponding event if it exist, or the Default if not.
-        cmd_func = getattr(self.bot, 'onIRC_%s' % cmd, getattr(self.bot, 'onIRC_default', None))
+        cmd_func = self.bot_handlers.get(cmd) or self.bot_handlers[None]
         if cmd_func:
-            self.bot.threadpool.add_task(cmd_func, cmd, prefix, args)
+            self.bot.dispatch(cmd_func, cmd, prefix, args)
         else:
             # fake event used for logging and on_default, missing target
             evt = Event(prefix, cmd, '', str(args), 'IRC')
-            self.bot.threadpool.add_task(self.bot.on_default, evt)
+            self.bot.dispatch(self.bot.on_default, evt)
 
     def add_user(self, nick, chan=None):
         nick_status = '-'
@@ -59,6 +64,9 @@ class IRCProtocol(Protocol):
             self.bot.users[snick] = User(snick)
         if not chan:
             return
+        if not self.bot.users[snick].chans:
+            # a status got while the nick shared no channel can't be told from one of a previous owner
+            self.bot.invalidate_status(snick)
         self.bot.users[snick].chans[chan] = nick_status
 
     def del_user(self, nick, chan=None):
@@ -66,6 +74,9 @@ class IRCProtocol(Protocol):
             self.logger.info('*** IRC.del_user: unknown: %s', nick)
             return
 
+        # leaving a channel doesn't log out, but we can't see what the user does until they are back
+        self.bot.invalidate_status(nick)
+
         if not chan:
             del self.bot.users[nick]
             return
@@ -75,6 +86,14 @@ class IRCProtocol(Protocol):
         if not len(self.bot.users[nick].chans):
             del self.bot.users[nick]
 
+    def leave_chan(self, chan):
+        """Forget chan and the users seen only there"""
+        self.bot.channels.discard(chan)
+        for nick, user in self.bot.users.items():
+            if chan in user.chans:
+                self.del_user(nick, chan)
+
+    @inline
     def onIRC_PING(self, cmd, prefix, args):
         target = args[0]
         if len(args) > 1:
@@ -83,9 +102,11 @@ class IRCProtocol(Protocol):
             target2 = None
         self.pong(target, target2)
 
+    @inline
     def onIRC_NOTICE(self, cmd, prefix, args):
         self.onIRC_PRIVMSG(cmd, prefix, args)
 
+    @inline
     def onIRC_PRIVMSG(self, cmd, prefix, args):
         sender = get_nick(prefix)
         target = args[0]
@@ -105,6 +126,7 @@ class IRCProtocol(Protocol):
         if cmd == 'PRIVMSG':
             self.bot.process_msg(sender, target, msg)
 
+    @inline
     def onIRC_JOIN(self, cmd, prefix, args):
         sender = get_nick(prefix)
         chan = args[0]
@@ -118,6 +140,7 @@ class IRCProtocol(Protocol):
         else:
             self.add_user(sender, chan)
 
+    @inline
     def onIRC_PART(self, cmd, prefix, args):
         sender = get_nick(prefix)
         chan = args[0]
@@ -125,8 +148,12 @@ class IRCProtocol(Protocol):
             msg = args[1]
         else:
             msg = ''
-        self.del_user(sender, chan)
+        if sender == self.cnick:
+            self.leave_chan(chan)
+        else:
+            self.del_user(sender, chan)
 
+    @inline
     def onIRC_QUIT(self, cmd, prefix, args):
         sender = get_nick(prefix)
         if len(args) > 0:
@@ -135,6 +162,7 @@ class IRCProtocol(Protocol):
             msg = ''
         self.del_user(sender)
 
+    @inline
     def onIRC_RPL_WELCOME(self, cmd, prefix, args):
         server = prefix
         target = args[0]
@@ -145,6 +173,7 @@ class IRCProtocol(Protocol):
         self.locks['ServReg'].set()
         self.logger.info('# Connected to %s', server)
 
+    @inline
     def onIRC_RPL_NAMREPLY(self, cmd, prefix, args):
         server = prefix
         # Used for channel status, "@" is used for secret channels, "*" for private channels, and "=" for
@@ -157,6 +186,7 @@ class IRCProtocol(Protocol):
         for nick in nicks:
             self.add_user(nick, channel)
 
+    @inline
     def onIRC_RPL_WHOISUSER(self, cmd, prefix, args):
         server = prefix
         target = args[0]
@@ -169,18 +199,35 @@ class IRCProtocol(Protocol):
             if nick not in self.bot.users:
                 self.bot.users[nick] = User(nick)
             self.bot.users[nick].host = host
-            self.bot.users[nick].ip = get_ip(host)
+        self.bot.resolver.submit(host, self.on_whois_resolved, nick, host)
+
+    def on_whois_resolved(self, ip, nick, host):
+        with self.locks['WhoIs']:
+            user = self.bot.users.get(nick)
+            if user is None or user.host != host:
+                return
+            user.ip = ip
+            # a failed lookup is only for the get_ip waiting, the next one asks again
+            if ip == UNKNOWN_IP:
+                user.ip_time = 0
+            else:
+                user.ip_time = time.time()
             self.locks['WhoIs'].notifyAll()
 
+    @inline
     def onIRC_NICK(self, cmd, prefix, args):
         sender = get_nick(prefix)
         newnick = args[0]
         if sender == self.cnick:
             return
         if sender in self.bot.users:
+            self.bot.invalidate_status(sender)
             self.bot.users[newnick] = self.bot.users[sender]
+            self.bot.users[newnick].nick = newnick
             del self.bot.users[sender]
+        self.bot.invalidate_status(newnick)
 
+    @inline
     def onIRC_INVITE(self, cmd, prefix, args):
         sender = get_nick(prefix)
         target = args[0]
@@ -188,6 +235,7 @@ class IRCProtocol(Protocol):
         self.logger.info('# Invited to %s by %s', chan, sender)
         self.join(chan)
 
+    @inline
     def onIRC_KICK(self, cmd, prefix, args):
         sender = get_nick(prefix)
         chan = args[0]
@@ -195,10 +243,11 @@ class IRCProtocol(Protocol):
         reason = args[2]
         if target == self.cnick:
             self.logger.info('# Kicked from %s by %s %s', chan, sender, repr(reason))
-            self.bot.channels.discard(chan)
+            self.leave_chan(chan)
         else:
             self.del_user(target, chan)
 
+    @inline
     def onIRC_ERR_NOSUCHNICK(self, cmd, prefix, args):
         server = prefix
         target = args[0]
@@ -209,6 +258,7 @@ class IRCProtocol(Protocol):
         else:
             self.del_user(nick)
 
+    @inline
     def onIRC_ERR_NEEDREGGEDNICK(self, cmd, prefix, args):
         server = prefix
         nick = args[0]
@@ -216,6 +266,7 @@ class IRCProtocol(Protocol):
         reason = args[2]
         self.logger.warning('*** Join to %s failed: not identified', chan)
 
+    @inline
     def onIRC_ERR_INVITEONLYCHAN(self, cmd, prefix, args):
         server = prefix
         nick = args[0]
@@ -223,6 +274,7 @@ class IRCProtocol(Protocol):
         reason = args[2]
         self.logger.warning('*** Join to %s failed: invite only', chan)
 
+    @inline
     def onIRC_ERR_BANNEDFROMCHAN(self, cmd, prefix, args):
         server = prefix
         nick = args[0]
@@ -230,10 +282,12 @@ class IRCProtocol(Protocol):
         reason = args[2]
         self.logger.warning('*** Join to %s failed: banned', chan)
 
+    @inline
     def onIRC_default(self, cmd, prefix, args):
         pass
 
-    def rawcmd(self, cmd, args=None, text=None):
+    def format_cmd(self, cmd, args=None, text=None):
+        """The line sent for cmd"""
         if args is None:
             args = []
         if not isinstance(args, list):
@@ -244,8 +298,16 @@ class IRCProtocol(Protocol):
         if text:
             text = ':' + text
             out_list.append(text)
-        out = ' '.join(out_list)
-        self.bot.rawcmd(out)
+        return ' '.join(out_list)
+
+    def rawcmd(self, cmd, args=None, text=None):
+        out = self.format_cmd(cmd, args, text)
+        # messages to users and channels are scheduled per target, everything else (PONG, NickServ queries, ...)
+        # goes first
+        if cmd in ['PRIVMSG', 'NOTICE'] and args[0].lower() != NICKSERV.lower():
+            self.bot.rawcmd(out, INTERACTIVE, args[0].lower())
+        else:
+            self.bot.rawcmd(out, PROTOCOL)
 
     def password(self, password=None):
         if password:
@@ -289,6 +351,16 @@ class IRCProtocol(Protocol):
             msg = conv_s2i(msg)
         self.rawcmd('NOTICE', [target], msg)
 
+    def say_block(self, target, msgs):
+        """PRIVMSG to a channel or NOTICE to a user of several lines already converted, queued as one block"""
+        if target[0] in ['#', '&']:
+            cmd = 'PRIVMSG'
+        else:
+            cmd = 'NOTICE'
+        # the prefix and target are the same for each line, only the text is added per line
+        prefix = self.format_cmd(cmd, [target], ' ')[:-1]
+        self.bot.rawcmds([prefix + msg for msg in msgs], INTERACTIVE, target.lower())
+
     def names(self, channels=''):
         self.rawcmd('NAMES', [channels])
 
@@ -1,15 +1,22 @@
+import re
+import time
+
 from irc_lib.event import Event
 from irc_lib.user import User
-from irc_lib.protocol import Protocol
+from irc_lib.protocol import Protocol, inline
 
 
 NICKSERV = 'NickServ'
 
+# "<nick> has been logged out." about a user, the nick possibly in bold
+LOGOUT_RE = re.compile(r'^\x02?([^\s\x02]+)\x02? has been logged out\.?$')
+
 
 class NickServProtocol(Protocol):
     def __init__(self, nick, locks, bot, parent):
         Protocol.__init__(self, nick, locks, bot, parent, 'IRCBot.NSRV')
         self.irc = self.parent
+        self.handlers, self.bot_handlers = self.handler_tables('onNSRV_')
         self.online = False
         self.identified = False
 
@@ -27,38 +34,47 @@ class NickServProtocol(Protocol):
             cmd = 'ERR_LASTFAIL'
         elif msg.endswith('since last login.'):
             cmd = 'ERR_FAILCNT'
+        elif 'logged out' in msg:
+            cmd = 'LOGOUT'
         else:
             cmd = 'Unknown'
 
         evt = Event(prefix, cmd, target, msg, 'NSRV')
 
-        cmd_func = getattr(self, 'onNSRV_%s' % evt.cmd, self.onNSRV_default)
-        cmd_func(evt)
+        # called from onIRC_PRIVMSG on the reader, only the handlers marked @inline may run there
+        cmd_func = self.handlers.get(evt.cmd) or self.handlers[None]
+        self.bot.dispatch(cmd_func, evt)
 
-        cmd_func = getattr(self.bot, 'onNSRV_%s' % evt.cmd, getattr(self.bot, 'onNSRV_default', self.bot.on_default))
-        cmd_func(evt)
+        cmd_func = self.bot_handlers.get(evt.cmd) or self.bot_handlers[None]
+        self.bot.dispatch(cmd_func, evt)
 
+    @inline
     def onNSRV_NEED_ID(self, evt):
         pass
 
+    @inline
     def onNSRV_ID_DONE(self, evt):
         # logged in successfully
         self.online = True
         self.identified = True
         self.locks['NSID'].set()
 
+    @inline
     def onNSRV_ERR_PASS(self, evt):
         # bad password
         self.logger.warning('*** Bad %s password for %s', NICKSERV, self.cnick)
         self.online = True
         self.locks['NSID'].set()
 
+    @inline
     def onNSRV_ERR_LASTFAIL(self, evt):
         self.logger.warning('*** %s %s', NICKSERV, evt.msg.replace('\x02', ''))
 
+    @inline
     def onNSRV_ERR_FAILCNT(self, evt):
         self.logger.warning('*** %s %s', NICKSERV, evt.msg.replace('\x02', ''))
 
+    @inline
     def onNSRV_ACC(self, evt):
         msg = evt.msg.split()
         if len(msg) < 3:
@@ -72,8 +88,21 @@ class NickServProtocol(Protocol):
             if snick not in self.bot.users:
                 self.bot.users[snick] = User(snick)
             self.bot.users[snick].status = status
+            self.bot.users[snick].status_time = time.time()
             self.locks['NSStatus'].notifyAll()
 
+    @inline
+    def onNSRV_LOGOUT(self, evt):
+        # anything but the logout of a named user is taken as about our own session, or not understood, in which case
+        # none of the cached statuses can be trusted anymore
+        match = LOGOUT_RE.match(evt.msg)
+        if match and match.group(1) != self.cnick:
+            self.bot.invalidate_status(match.group(1))
+        else:
+            self.identified = False
+            self.bot.invalidate_status()
+
+    @inline
     def onNSRV_default(self, evt):
         self.logger.info('UNKNOWN NSRV EVENT: %s %s %s %s', evt.sender, evt.target, evt.cmd, repr(evt.msg))
 
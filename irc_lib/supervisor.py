@@ -0,0 +1,60 @@
+import time
+import logging
+
+from irc_lib.ircbot import IRCBotError
+from irc_lib.utils.threadpool import ThreadPool
+from irc_lib.utils.metrics import Registry, MetricsServer
+
+
+class BotSupervisor(object):
+    """Runs several bots, on as many connections, in one process. They share the threadpool lanes and the metrics
+    registry, where the metrics of each bot are labelled with its name. Connection, flood control, users and
+    whitelist stay per bot. Anything else to share, like a DBHandler, is handed to the bots by the caller."""
+
+    def __init__(self, threadpool=None):
+        self.logger = logging.getLogger('IRCBot.Supervisor')
+        self.metrics = Registry()
+        if threadpool is None:
+            threadpool = ThreadPool()
+        self.threadpool = threadpool
+        self.threadpool.add_gauges(self.metrics)
+        self.bots = {}
+        self.exit = False
+
+    def add_bot(self, name, cls, *args, **kargs):
+        """Build a bot of class cls (an IRCBotBase) running on the shared threadpool. The bot still has to be
+        connected."""
+        if name in self.bots:
+            raise IRCBotError('Bot %s already exists' % name)
+        kargs.update(threadpool=self.threadpool, metrics=self.metrics.labelled(bot=name), name=name)
+        bot = cls(*args, **kargs)  # pylint: disable-msg=W0142
+        self.bots[name] = bot
+        return bot
+
+    def running(self):
+        return sorted(name for name, bot in self.bots.items() if not bot.exit)
+
+    def stop(self):
+        self.exit = True
+        for bot in self.bots.values():
+            bot.exit = True
+
+    def serve_metrics(self, port, host='127.0.0.1'):
+        """Serve the metrics of all the bots on http://host:port/metrics until the supervisor exits"""
+        server = MetricsServer(self.metrics, port, host)
+        self.threadpool.add_task(server.serve_until, lambda: self.exit, threadname='MetricsLoop')
+        return server
+
+    def start(self):
+        """Same as IRCBotBase.start for all the bots, returns once every bot has exited or on ctrl+c"""
+        try:
+            while not self.exit and self.running():
+                try:
+                    time.sleep(2)
+                except (KeyboardInterrupt, SystemExit):
+                    self.logger.error('EXIT REQUESTED. SHUTTING DOWN THE BOTS')
+                    break
+            self.stop()
+            self.threadpool.wait_completion()
+        finally:
+            self.logger.info('*** BotSupervisor.start: exited')
@@ -2,6 +2,7 @@ import logging
 
 from irc_lib.utils.restricted import restricted
 from irc_lib.ircbot import IRCBotBase
+from irc_lib.protocol import inline
 
 
 class TestBot(IRCBotBase):
@@ -9,9 +10,11 @@ class TestBot(IRCBotBase):
         IRCBotBase.__init__(self, nick, log_level=logging.DEBUG)
         self.whitelist['ProfMobius'] = 5
 
+    @inline
     def onIRC_default(self, cmd, prefix, args):
         self.logger.debug('? IRC_%s %s %s', cmd, prefix, str(args))
 
+    @inline
     def on_default(self, evt):
         self.logger.debug('? %s_%s %s %s %s', evt.type, evt.cmd, evt.sender, evt.target, repr(evt.msg))
 
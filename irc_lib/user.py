@@ -1,9 +1,15 @@
 class User(object):
+    __slots__ = ('nick', 'status', 'status_time', 'host', 'ip', 'ip_time', 'chans', 'socket')
+
     def __init__(self, nick):
+        if type(nick) is str:
+            nick = intern(nick)
         self.nick = nick
         self.status = None
+        self.status_time = 0
         self.host = None
         self.ip = None
+        self.ip_time = 0
         self.chans = {}
         self.socket = None
 
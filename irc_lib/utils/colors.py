@@ -1,3 +1,6 @@
+import re
+
+
 # Short hand to IRC
 S2I = {
     '$B': '\x02',
@@ -7,9 +10,21 @@ S2I = {
     '$C': '\x03',
 }
 
+_S2I_ITEMS = S2I.items()
+# a color code goes with its foreground and background numbers
+_IRC_CODES_RE = re.compile(r'\x03(\d{1,2}(,\d{1,2})?)?|[\x02\x0f\x16\x1f]')
+
 
 def conv_s2i(text):
-    out_text = text
-    for code, char in S2I.items():
-        out_text = out_text.replace(code, char)
-    return out_text
+    # most lines have no code at all. For the others the chain of replace, each a pass in C, is still faster than a
+    # single regex pass calling back into python for every code.
+    if '$' not in text:
+        return text
+    for code, char in _S2I_ITEMS:
+        text = text.replace(code, char)
+    return text
+
+
+def strip_irc(text):
+    """Text converted by conv_s2i without its IRC codes, for output that isn't going to an IRC client"""
+    return _IRC_CODES_RE.sub('', text)
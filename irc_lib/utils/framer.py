@@ -0,0 +1,72 @@
+import logging
+
+
+class LineFramer(object):
+    """Splits a socket stream in lines. Data is received straight into a reusable bytearray and every byte is only
+    scanned once for the line separator, whatever the number of reads a line spans. A line growing past max_line
+    without separator is dropped up to the next separator."""
+
+    def __init__(self, name='', read_size=4096, max_line=8192):
+        self.logger = logging.getLogger('IRCBot.Framer')
+        self.name = name
+        self.read_size = read_size
+        self.max_line = max_line
+        self.buf = bytearray(max_line + read_size)
+        # buf[start:end] is the data not returned yet, buf[start:scan] is known not to hold a separator
+        self.start = 0
+        self.scan = 0
+        self.end = 0
+        self.overflow = False
+        self.noverflows = 0
+
+    def recv(self, skt):
+        """Read up to read_size bytes from skt, returns the number of bytes read (0 when the peer closed)"""
+        if len(self.buf) - self.end < self.read_size:
+            self.compact()
+        nbytes = skt.recv_into(memoryview(self.buf)[self.end:], self.read_size)
+        self.end += nbytes
+        return nbytes
+
+    def feed(self, data):
+        """Add data received by other means"""
+        if len(self.buf) - self.end < len(data):
+            self.compact()
+            if len(self.buf) - self.end < len(data):
+                self.buf.extend(bytearray(self.end + len(data) - len(self.buf)))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def compact(self):
+        pending = self.end - self.start
+        self.buf[:pending] = self.buf[self.start:self.end]
+        self.scan -= self.start
+        self.start = 0
+        self.end = pending
+
+    def lines(self):
+        """Complete lines received so far, without the \\r\\n or \\n separator"""
+        buf = self.buf
+        while True:
+            idx = buf.find('\n', self.scan, self.end)
+            if idx < 0:
+                break
+            line_end = idx
+            if line_end > self.start and buf[line_end - 1] == 13:
+                line_end -= 1
+            line = str(buf[self.start:line_end])
+            self.start = self.scan = idx + 1
+            if self.overflow:
+                # tail of a line already dropped
+                self.overflow = False
+                continue
+            yield line
+        self.scan = self.end
+
+        if self.end - self.start > self.max_line:
+            if not self.overflow:
+                self.noverflows += 1
+                self.logger.warning('*** Framer: line over %d bytes dropped: %s', self.max_line, self.name)
+            self.overflow = True
+            self.start = self.scan = self.end
+        if self.start == self.end:
+            self.start = self.scan = self.end = 0
@@ -0,0 +1,259 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+# Upper bounds in seconds of the histogram buckets, everything slower goes to the last, unbounded one
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def lines(self, name, labels):
+        return ['%s%s %s' % (name, format_labels(labels), self.value)]
+
+    def summary(self):
+        return '%d' % self.value
+
+
+class Gauge(object):
+    """Value read from func when the metrics are rendered, for things the bot already keeps like queue sizes"""
+    def __init__(self, func):
+        self.func = func
+
+    def get(self):
+        try:
+            return self.func()
+        except Exception:  # pylint: disable-msg=W0703
+            return float('nan')
+
+    def lines(self, name, labels):
+        return ['%s%s %s' % (name, format_labels(labels), format_value(self.get()))]
+
+    def summary(self):
+        return format_value(self.get())
+
+
+class Histogram(object):
+    """Bucketed distribution of durations in seconds. Quantiles are estimated as the upper bound of their bucket."""
+    def __init__(self, buckets=BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+    def quantile(self, q):
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            max_value = self.max
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for idx, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if idx < len(self.buckets):
+                    return min(self.buckets[idx], max_value)
+                break
+        return max_value
+
+    def lines(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.total
+        lines = []
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            seen += bucket_count
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', str(bound)),)), seen))
+        lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(total)))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), count))
+        return lines
+
+    def summary(self):
+        if not self.count:
+            return 'n=0'
+        return 'n=%d avg=%.1fms p50<=%.1fms p95<=%.1fms max=%.1fms' % (
+            self.count, self.total / self.count * 1000, self.quantile(0.5) * 1000, self.quantile(0.95) * 1000,
+            self.max * 1000)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels)
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '%.6g' % value
+    return str(value)
+
+
+class Registry(object):
+    """Named counters, gauges and histograms, each name possibly split by labels. Getting a metric creates it the
+    first time, so the code measuring something doesn't need to declare it anywhere."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = cls(*args)
+                    self.metrics[key] = metric
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def gauge(self, name, func, **labels):
+        """Register func as the source of a gauge, replacing the previous one with the same name and labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.metrics[key] = Gauge(func)
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def time(self, name, **labels):
+        """Context manager observing the time spent in its block"""
+        return self.histogram(name, **labels).time()
+
+    def labelled(self, **labels):
+        return LabelledRegistry(self, labels)
+
+    def items(self, prefix=''):
+        with self.lock:
+            items = sorted(self.metrics.items())
+        return [(name, labels, metric) for (name, labels), metric in items if name.startswith(prefix)]
+
+    def render(self):
+        """All the metrics in the Prometheus text format"""
+        lines = []
+        last_name = None
+        for name, labels, metric in self.items():
+            if name != last_name:
+                lines.append('# TYPE %s %s' % (name, type(metric).__name__.lower()))
+                last_name = name
+            lines.extend(metric.lines(name, labels))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, prefix=''):
+        """One short line per metric whose name starts with prefix"""
+        return ['%s%s %s' % (name, format_labels(labels), metric.summary())
+                for name, labels, metric in self.items(prefix)]
+
+
+class LabelledRegistry(object):
+    """View of a registry adding labels to every metric it creates, for one of several bots sharing a registry.
+    Listing and rendering show the whole registry."""
+    def __init__(self, registry, labels):
+        self.registry = registry
+        self.labels = labels
+
+    def _labels(self, labels):
+        merged = dict(self.labels)
+        merged.update(labels)
+        return merged
+
+    def counter(self, name, **labels):
+        return self.registry.counter(name, **self._labels(labels))
+
+    def histogram(self, name, **labels):
+        return self.registry.histogram(name, **self._labels(labels))
+
+    def gauge(self, name, func, **labels):
+        self.registry.gauge(name, func, **self._labels(labels))
+
+    def observe(self, name, value, **labels):
+        self.registry.observe(name, value, **self._labels(labels))
+
+    def time(self, name, **labels):
+        return self.registry.time(name, **self._labels(labels))
+
+    def labelled(self, **labels):
+        return LabelledRegistry(self.registry, self._labels(labels))
+
+    def items(self, prefix=''):
+        return self.registry.items(prefix)
+
+    def render(self):
+        return self.registry.render()
+
+    def summary(self, prefix=''):
+        return self.registry.summary(prefix)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable-msg=C0103
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        logging.getLogger('IRCBot.Metrics').debug('%s %s', self.address_string(), fmt % args)
+
+
+class MetricsServer(HTTPServer):
+    """Plain HTTP endpoint serving the registry on /metrics, meant to be bound to localhost and scraped"""
+    def __init__(self, registry, port, host='127.0.0.1'):
+        HTTPServer.__init__(self, (host, port), MetricsHandler)
+        self.registry = registry
+
+    def serve_until(self, until):
+        """Serve requests until until() returns True, then close the server"""
+        # handle_request returns after the timeout when nobody is scraping, so the loop notices the exit
+        self.timeout = 1
+        try:
+            while not until():
+                self.handle_request()
+        finally:
+            self.server_close()
+            logging.getLogger('IRCBot.Metrics').info('*** MetricsServer.serve_until: exited')
@@ -0,0 +1,117 @@
+import time
+import threading
+from collections import deque
+from Queue import Empty
+
+
+# Priority classes, lower is sent first
+PROTOCOL = 0
+INTERACTIVE = 1
+BULK = 2
+
+
+class OutQueue(object):
+    """Outbound line scheduler with the same interface as Queue.Queue for the consumer side.
+    Lines are sent by priority class (protocol, interactive, bulk), and round robin per target within a class. Once a
+    target has more than burst lines waiting, its following lines are demoted to bulk until its backlog is gone, so a
+    long dump can't hold back short replies to other targets. Lines to the same target are always sent in order."""
+
+    def __init__(self, burst=5):
+        self.burst = burst
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        self.unfinished_tasks = 0
+        self.nlines = 0
+        # per class, lines per target and the order the targets are served in
+        self.lines = [{}, {}, {}]
+        self.targets = [deque(), deque(), deque()]
+        # number of lines waiting per target, over all classes
+        self.pending = {}
+
+    def put(self, msg, priority=INTERACTIVE, target=None):
+        with self.mutex:
+            self._put(msg, priority, target)
+            self.not_empty.notify()
+
+    def put_many(self, msgs, priority=INTERACTIVE, target=None):
+        """Queue several lines at once, no other line to the same target can end up between them"""
+        with self.mutex:
+            for msg in msgs:
+                self._put(msg, priority, target)
+            self.not_empty.notify()
+
+    def _put(self, msg, priority, target):
+        if priority != PROTOCOL and target is not None:
+            npending = self.pending.get(target, 0)
+            if npending >= self.burst or target in self.lines[BULK]:
+                priority = BULK
+            self.pending[target] = npending + 1
+        lines = self.lines[priority].get(target)
+        if lines is None:
+            lines = self.lines[priority][target] = deque()
+            self.targets[priority].append(target)
+        lines.append(msg)
+        self.nlines += 1
+        self.unfinished_tasks += 1
+
+    def _get(self):
+        for priority in (PROTOCOL, INTERACTIVE, BULK):
+            targets = self.targets[priority]
+            if not targets:
+                continue
+            target = targets.popleft()
+            lines = self.lines[priority][target]
+            msg = lines.popleft()
+            if lines:
+                targets.append(target)
+            else:
+                del self.lines[priority][target]
+            if target in self.pending:
+                self.pending[target] -= 1
+                if not self.pending[target]:
+                    del self.pending[target]
+            self.nlines -= 1
+            return msg
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            if not block:
+                if not self.nlines:
+                    raise Empty
+            elif timeout is None:
+                while not self.nlines:
+                    self.not_empty.wait()
+            else:
+                endtime = time.time() + timeout
+                while not self.nlines:
+                    remaining = endtime - time.time()
+                    if remaining <= 0.0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+            return self._get()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def task_done(self):
+        with self.all_tasks_done:
+            unfinished = self.unfinished_tasks - 1
+            if unfinished < 0:
+                raise ValueError('task_done() called too many times')
+            if not unfinished:
+                self.all_tasks_done.notify_all()
+            self.unfinished_tasks = unfinished
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    def qsize(self):
+        with self.mutex:
+            return self.nlines
+
+    def empty(self):
+        with self.mutex:
+            return not self.nlines
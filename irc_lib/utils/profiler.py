@@ -0,0 +1,94 @@
+import os
+import time
+import pstats
+import cProfile
+import threading
+from StringIO import StringIO
+
+
+class CommandProfiler(object):
+    """Profiles the next count commands, or the next count runs of the command cmd (until stopped if count is None),
+    and aggregates the stats per command name. Each run gets its own cProfile.Profile since commands run in
+    parallel on the threadpool."""
+    def __init__(self, count=None, cmd=None, nick=None):
+        self.lock = threading.Lock()
+        self.remaining = count
+        self.cmd = cmd
+        # who started it, to be told when it is done
+        self.nick = nick
+        self.started = time.time()
+        self.active = True
+        self.finished = False
+        self.running = 0
+        self.stats = {}
+        self.calls = {}
+
+    def wants(self, cmd):
+        """True if this run of cmd is to be profiled, counts it against the remaining runs"""
+        if not self.active or self.cmd is not None and cmd != self.cmd:
+            return False
+        with self.lock:
+            if not self.active:
+                return False
+            if self.remaining is not None:
+                self.remaining -= 1
+                if self.remaining <= 0:
+                    self.active = False
+            self.running += 1
+            return True
+
+    def run(self, cmd, func, *args, **kargs):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.calls[cmd] = self.calls.get(cmd, 0) + 1
+                if cmd in self.stats:
+                    self.stats[cmd].add(profile)
+                else:
+                    self.stats[cmd] = pstats.Stats(profile)
+
+    def stop(self):
+        with self.lock:
+            self.active = False
+            self.finished = True
+
+    def finish(self):
+        """True for the caller ending the last run once the count is reached, and for no other"""
+        with self.lock:
+            if self.active or self.running or self.finished:
+                return False
+            self.finished = True
+            return True
+
+    def commands(self):
+        with self.lock:
+            return sorted(self.calls.items())
+
+    def dump(self, directory='profiles'):
+        """Write the stats of each command to directory/<start time>-<cmd>.prof, for pstats or any viewer reading
+        them. Returns the file names."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        prefix = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+        filenames = []
+        with self.lock:
+            for cmd, stats in sorted(self.stats.items()):
+                filename = os.path.join(directory, '%s-%s.prof' % (prefix, cmd))
+                stats.dump_stats(filename)
+                filenames.append(filename)
+        return filenames
+
+    def summary(self, cmd, limit=15, sort='cumulative'):
+        """Lines of the limit top functions of cmd as printed by pstats, None if cmd wasn't profiled"""
+        with self.lock:
+            stats = self.stats.get(cmd)
+            if stats is None:
+                return None
+            out = StringIO()
+            stats.stream = out
+            stats.sort_stats(sort).print_stats(limit)
+        # drop the blank lines and the header naming the (in memory) files
+        return [line for line in out.getvalue().splitlines() if line.strip() and not line.startswith('   Ordered')]
@@ -0,0 +1,46 @@
+from irc_lib.utils.colors import conv_s2i
+
+
+class ReplyBuilder(object):
+    """Lines of a reply to a target, converted as they are added and sent as one block by send. size is what the
+    block costs from the flood budget."""
+    def __init__(self, bot, target, dcc=False):
+        self.bot = bot
+        self.target = target
+        self.dcc = dcc
+        self.lines = []
+        self.size = 0
+        if target[0] in ['#', '&']:
+            cmd = 'PRIVMSG'
+        else:
+            cmd = 'NOTICE'
+        # ':<nick> NOTICE <target> :' and the line end, on top of each line
+        self.overhead = len(':%s %s %s :\r\n' % (bot.cnick, cmd, target))
+
+    def add(self, msg):
+        if not msg:
+            return
+        line = conv_s2i(msg)
+        self.lines.append(line)
+        self.size += len(line) + self.overhead
+
+    def head(self, max_size):
+        """The first lines costing at most max_size"""
+        size = 0
+        for idx, line in enumerate(self.lines):
+            size += len(line) + self.overhead
+            if size > max_size:
+                return self.lines[:idx]
+        return list(self.lines)
+
+    def clear(self):
+        self.lines = []
+        self.size = 0
+
+    def send(self):
+        lines = self.lines
+        self.clear()
+        self.bot.say_block(self.target, lines, dcc=self.dcc)
+
+    def __len__(self):
+        return len(self.lines)
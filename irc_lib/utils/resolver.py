@@ -0,0 +1,78 @@
+import time
+import socket
+import logging
+import threading
+from Queue import Queue
+
+
+UNKNOWN_IP = '0.0.0.0'
+
+
+class Resolver(object):
+    """Small pool of threads resolving hostnames, so DNS never runs on a protocol handler or under a bot lock.
+    Results are cached per host for ttl seconds. Callbacks get UNKNOWN_IP if the lookup fails or takes more than
+    timeout seconds, a late answer still ends up in the cache."""
+
+    def __init__(self, num_threads=2, timeout=5, ttl=600):
+        self.logger = logging.getLogger('IRCBot.Resolver')
+        self.timeout = timeout
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.pending = {}
+        self.hosts = Queue()
+        for i in range(num_threads):
+            thread = threading.Thread(target=self.worker, name='Resolver%d' % i)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, host, callback, *args):
+        """Call callback(ip, *args) once host is resolved, from the calling thread if the host is cached"""
+        with self.lock:
+            cached = self.cache.get(host)
+            if cached and time.time() - cached[1] < self.ttl:
+                ip = cached[0]
+            else:
+                ip = None
+                callbacks = self.pending.get(host)
+                if callbacks is None:
+                    callbacks = self.pending[host] = [(callback, args)]
+                    self.hosts.put(host)
+                    timer = threading.Timer(self.timeout, self.expire, [host, callbacks])
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    callbacks.append((callback, args))
+        if ip is not None:
+            self.call(callback, ip, args)
+
+    def worker(self):
+        while True:
+            host = self.hosts.get()
+            try:
+                ip = socket.gethostbyname(host)
+            except (socket.gaierror, socket.herror, UnicodeError):
+                self.logger.warning('*** Resolver: lookup failed: %s', host)
+                ip = UNKNOWN_IP
+            with self.lock:
+                if ip != UNKNOWN_IP:
+                    self.cache[host] = (ip, time.time())
+                callbacks = self.pending.pop(host, [])
+            for callback, args in callbacks:
+                self.call(callback, ip, args)
+
+    def expire(self, host, callbacks):
+        with self.lock:
+            # the worker still caches the answer when it comes, and hands it to anyone who asked again meanwhile
+            if self.pending.get(host) is not callbacks:
+                return
+            del self.pending[host]
+        self.logger.warning('*** Resolver: lookup timed out: %s', host)
+        for callback, args in callbacks:
+            self.call(callback, UNKNOWN_IP, args)
+
+    def call(self, callback, ip, args):
+        try:
+            callback(ip, *args)  # pylint: disable-msg=W0142
+        except Exception:  # pylint: disable-msg=W0703
+            self.logger.exception('ERROR in %s', callback.__name__)
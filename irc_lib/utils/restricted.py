@@ -12,12 +12,16 @@ def restricted(level=4):
                 status = 3
                 usrlevel = 4
             else:
-                status = bot.get_status(sender)
                 whitelisted = sender in bot.whitelist
-                if sender in bot.whitelist:
+                if whitelisted:
                     usrlevel = bot.whitelist[sender]
                 else:
                     usrlevel = 0
+                # no need to ask NickServ about someone who would be refused anyway
+                if whitelisted and level <= usrlevel:
+                    status = bot.get_status(sender)
+                else:
+                    status = None
 
             # Official auth check
             if not whitelisted or status != 3 or level > usrlevel:
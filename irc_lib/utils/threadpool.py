@@ -1,48 +1,201 @@
 import logging
-from Queue import Queue
-from threading import Thread
+import threading
+from Queue import Queue, Empty, Full
 
 
-class Worker(Thread):
-    """Thread executing tasks from a given tasks queue"""
-    def __init__(self, tasks):
-        Thread.__init__(self)
+# Lanes, each with its own workers and queue so a slow kind of task can't starve the others
+SERVICE = 'service'    # long running loops, one thread each
+PROTOCOL = 'protocol'  # short protocol event handlers
+COMMAND = 'command'    # bot commands, can block on the DB or on NickServ
+
+
+class Worker(threading.Thread):
+    """Thread executing tasks from a lane queue, exits once idle for a while if the lane has more than min_threads.
+    Given a task, runs only that one and exits."""
+    def __init__(self, lane, task=None):
+        threading.Thread.__init__(self)
         self.ncalls = 0
         self.nscalls = 0
         self.nfcalls = 0
-        self.tasks = tasks
+        self.lane = lane
+        self.task = task
         self.logger = logging.getLogger('IRCBot.ThreadPool')
         self.daemon = True
+        self.name = '%s-%s' % (lane.name, self.name)
+        self.lane_name = self.name
         self.start()
 
     def run(self):
+        if self.task:
+            self.execute(*self.task)  # pylint: disable-msg=W0142
+            self.lane.retire(self, force=True)
+            return
         while True:
-            func, args, kargs = self.tasks.get()
-            if 'threadname' in kargs:
-                self.name = kargs.pop('threadname')
-            self.ncalls += 1
             try:
-                func(*args, **kargs)  # pylint: disable-msg=W0142
+                func, args, kargs = self.lane.tasks.get(True, self.lane.idle_timeout)
+            except Empty:
+                if self.lane.retire(self):
+                    return
+                continue
+            self.execute(func, args, kargs)
+            self.lane.tasks.task_done()
+
+    def execute(self, func, args, kargs):
+        self.lane.busy(1)
+        threadname = kargs.pop('threadname', None)
+        if threadname:
+            self.name = threadname
+        success = False
+        try:
+            func(*args, **kargs)  # pylint: disable-msg=W0142
+            success = True
+        except Exception:  # pylint: disable-msg=W0703
+            self.logger.exception('ERROR in %s', self.name)
+        if threadname:
+            with self.lane.lock:
+                self.lane.running.discard(threadname)
+            self.name = self.lane_name
+        self.lane.done(self, success)
+
+
+class Lane(object):
+    """Bounded task queue with a number of workers growing from min_threads up to max_threads while tasks are waiting
+    and all workers are busy. When the queue is full, tasks either wait for room or run in the calling thread if
+    overflow is 'caller'. A dedicated lane has no queue and starts a thread per task."""
+    def __init__(self, name, min_threads, max_threads, queue_size, overflow='block', idle_timeout=60,
+                 dedicated=False):
+        self.name = name
+        self.dedicated = dedicated
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+        self.overflow = overflow
+        self.idle_timeout = idle_timeout
+        self.tasks = Queue(queue_size)
+        self.lock = threading.Lock()
+        self.workers = set()
+        self.nbusy = 0
+        self.ncaller = 0
+        self.nscalls = 0
+        self.nfcalls = 0
+        # names of the tasks started with a threadname, and the ones still running, both changed under the lock
+        self.started = set()
+        self.running = set()
+        for _ in range(min_threads):
+            self.spawn()
+
+    def spawn(self):
+        self.workers.add(Worker(self))
+
+    def busy(self, delta):
+        with self.lock:
+            self.nbusy += delta
+
+    def done(self, worker, success):
+        # the call counters are read by other threads, they change under the lane lock like nbusy
+        with self.lock:
+            self.nbusy -= 1
+            worker.ncalls += 1
+            if success:
+                worker.nscalls += 1
                 self.nscalls += 1
-            except Exception:  # pylint: disable-msg=W0703
+            else:
+                worker.nfcalls += 1
                 self.nfcalls += 1
-                self.logger.exception('ERROR in %s', self.name)
-            self.tasks.task_done()
+
+    def retire(self, worker, force=False):
+        with self.lock:
+            if not force and len(self.workers) <= self.min_threads:
+                return False
+            self.workers.discard(worker)
+            return True
+
+    def add_task(self, func, args, kargs, block=True):
+        """Returns False if the task was neither queued nor run, only possible with block=False"""
+        if 'threadname' in kargs:
+            with self.lock:
+                self.started.add(kargs['threadname'])
+                self.running.add(kargs['threadname'])
+        if self.dedicated:
+            with self.lock:
+                if len(self.workers) >= self.max_threads:
+                    raise Full
+                self.workers.add(Worker(self, (func, args, kargs)))
+            return True
+        with self.lock:
+            if self.nbusy + self.tasks.qsize() >= len(self.workers) and len(self.workers) < self.max_threads:
+                self.spawn()
+        try:
+            self.tasks.put((func, args, kargs), block and self.overflow == 'block')
+        except Full:
+            if self.overflow != 'caller':
+                return False
+            threadname = kargs.pop('threadname', None)
+            with self.lock:
+                self.ncaller += 1
+                self.running.discard(threadname)
+            try:
+                func(*args, **kargs)  # pylint: disable-msg=W0142
+            except Exception:  # pylint: disable-msg=W0703
+                logging.getLogger('IRCBot.ThreadPool').exception('ERROR in %s', func.__name__)
+        return True
+
+    def join(self):
+        if not self.dedicated:
+            self.tasks.join()
+            return
+        with self.lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.join()
+
+    def stats(self):
+        with self.lock:
+            return {'workers': len(self.workers), 'busy': self.nbusy, 'queued': self.tasks.qsize(),
+                    'min': self.min_threads, 'max': self.max_threads, 'caller': self.ncaller,
+                    'succeeded': self.nscalls, 'failed': self.nfcalls}
 
 
 class ThreadPool(object):
-    """Pool of threads consuming tasks from a queue"""
-    def __init__(self, num_threads):
+    """Pool of threads consuming tasks from one queue per lane"""
+    def __init__(self, command_threads=(2, 10), protocol_threads=(1, 4), queue_size=100):
         self.logger = logging.getLogger('IRCBot.ThreadPool')
-        self.tasks = Queue(num_threads)
-        for _ in range(num_threads):
-            Worker(self.tasks)
+        self.lanes = {
+            # service loops never end before the bot does, each gets a thread of its own right away
+            SERVICE: Lane(SERVICE, 0, 64, 0, dedicated=True),
+            # the inbound reader must never wait, handlers run inline when the lane is saturated
+            PROTOCOL: Lane(PROTOCOL, protocol_threads[0], protocol_threads[1], queue_size, overflow='caller'),
+            COMMAND: Lane(COMMAND, command_threads[0], command_threads[1], queue_size),
+        }
 
     def add_task(self, func, *args, **kargs):
-        """Add a task to the queue"""
-        self.tasks.put((func, args, kargs))
+        """Add a task to the queue of a lane (lane=..., COMMAND by default). Tasks named with threadname=... are
+        service loops and go to the SERVICE lane."""
+        lane = kargs.pop('lane', SERVICE if 'threadname' in kargs else COMMAND)
+        self.lanes[lane].add_task(func, args, kargs)
+
+    def try_add_task(self, func, *args, **kargs):
+        """Same as add_task, but returns False instead of waiting if the lane is full"""
+        lane = kargs.pop('lane', SERVICE if 'threadname' in kargs else COMMAND)
+        return self.lanes[lane].add_task(func, args, kargs, block=False)
+
+    def stats(self):
+        return dict((name, lane.stats()) for name, lane in self.lanes.items())
+
+    def add_gauges(self, metrics):
+        """Report the depth, busy and total workers of each lane in a metrics registry"""
+        for name, lane in self.lanes.items():
+            metrics.gauge('threadpool_queued', lane.tasks.qsize, lane=name)
+            metrics.gauge('threadpool_busy', lambda lane=lane: lane.nbusy, lane=name)
+            metrics.gauge('threadpool_workers', lambda lane=lane: len(lane.workers), lane=name)
+
+    def stopped_services(self):
+        """Names of the service loops that were started and are not running anymore"""
+        lane = self.lanes[SERVICE]
+        with lane.lock:
+            return sorted(lane.started - lane.running)
 
     def wait_completion(self):
         """Wait for completion of all the tasks in the queue"""
         self.logger.info('waiting for threads')
-        self.tasks.join()
+        for lane in self.lanes.values():
+            lane.join()
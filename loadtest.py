@@ -0,0 +1,327 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import random
+import logging
+import argparse
+import sqlite3
+import threading
+import subprocess
+
+import synthdb
+from fakeircd import FakeIRCd
+from mcpbot import MCPBot, LoopMCPBot
+from irc_lib.utils.framer import LineFramer
+
+
+DEFAULT_MIX = 'gcm=35,search=10,scm=10,dcc=5,chat=40'
+CHANNEL = '#test'
+BOT_NICK = 'MCPBot'
+BOT_PASSWORD = 'loadtest'
+
+# first line of a command reply once the formatting is stripped, the header every command starts with, an error or
+# the line pointing to a reply too large for IRC
+REPLY_START = re.compile(r'^(\[ |Error: |Syntax error: |You do not have|Reply to )')
+FORMATTING = re.compile(r'\x03\d{0,2}(,\d{1,2})?|[\x02\x0f\x16\x1f]')
+CTCP_DCC = re.compile(r'^\x01DCC CHAT chat (\d+) (\d+)\x01$', re.IGNORECASE)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    idx = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+def parse_mix(mix):
+    weights = []
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=synthdb.SCHEMA_DIR,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class VirtualUser(object):
+    """Simulated user issuing one command at a time, waiting for the start of the reply and thinking a bit before
+    the next one"""
+
+    def __init__(self, test, idx):
+        self.test = test
+        self.nick = 'user%03d' % idx
+        # one loopback address per user so the bot can tell the DCC connections apart
+        self.host = '127.0.%d.%d' % (idx // 250, idx % 250 + 2)
+        self.rnd = random.Random(test.seed + idx)
+        self.client = test.ircd.add_virtual(self.nick, self.host, self.on_irc_line)
+        self.lock = threading.Lock()
+        self.replied = threading.Event()
+        self.pending = None
+        self.dcc_socket = None
+
+    def send_irc(self, line):
+        self.test.ircd.handle(self.client, line)
+
+    def send_cmd(self, name, text, private=False):
+        dcc_socket = self.dcc_socket
+        if dcc_socket is not None:
+            name += '/dcc'
+        with self.lock:
+            self.replied.clear()
+            self.pending = (name, time.time())
+        if dcc_socket is not None:
+            try:
+                dcc_socket.sendall(text + '\r\n')
+            except socket.error:
+                self.dcc_socket = None
+        elif private:
+            self.send_irc('PRIVMSG %s :%s' % (BOT_NICK, text))
+        else:
+            self.send_irc('PRIVMSG %s :%s' % (CHANNEL, text))
+        self.test.sent(name)
+        if not self.replied.wait(self.test.reply_timeout):
+            with self.lock:
+                if self.pending is not None:
+                    self.test.lost(name)
+                    self.pending = None
+
+    def on_reply(self, text):
+        with self.lock:
+            if self.pending is None or not REPLY_START.match(text):
+                return
+            name, start = self.pending
+            self.pending = None
+        self.test.replied(name, time.time() - start)
+        self.replied.set()
+
+    def on_irc_line(self, line):
+        if not line.startswith(':%s!' % BOT_NICK):
+            return
+        _, _, text = line.partition(' :')
+        match = CTCP_DCC.match(text)
+        if match:
+            thread = threading.Thread(target=self.dcc_connect, args=(int(match.group(1)), int(match.group(2))))
+            thread.daemon = True
+            thread.start()
+            return
+        self.on_reply(FORMATTING.sub('', text))
+
+    def dcc_connect(self, longip, port):
+        ip = '.'.join(str(longip >> shift & 0xFF) for shift in [24, 16, 8, 0])
+        skt = socket.socket()
+        try:
+            skt.bind((self.host, 0))
+            skt.connect((ip, port))
+        except socket.error:
+            return
+        framer = LineFramer(self.nick)
+        try:
+            while framer.recv(skt):
+                for line in framer.lines():
+                    text = FORMATTING.sub('', line)
+                    if text.startswith('Connection with user'):
+                        self.dcc_socket = skt
+                        # the session is up, this is what !dcc is waiting for
+                        self.on_reply('[ DCC ]')
+                    else:
+                        self.on_reply(text)
+        except socket.error:
+            pass
+        self.dcc_socket = None
+
+    def run(self, until):
+        while time.time() < until:
+            name = self.test.pick(self.rnd)
+            if name == 'chat':
+                self.send_irc('PRIVMSG %s :%s' % (CHANNEL, ' '.join(self.rnd.choice(synthdb.SYLLABLES)
+                                                                    for _ in range(self.rnd.randint(2, 12)))))
+                self.test.sent(name)
+            elif name == 'gcm':
+                self.send_cmd(name, '!gcm %s' % self.rnd.choice(self.test.methods)[0])
+            elif name == 'search':
+                self.send_cmd(name, '!search %s' % self.rnd.choice(synthdb.SYLLABLES))
+            elif name == 'scm':
+                newname = synthdb.camel(self.rnd, 2)
+                self.send_cmd(name, '!scm %s %s Renamed to %s' % (self.rnd.choice(self.test.methods)[1], newname,
+                                                                  newname), private=True)
+            elif name == 'dcc':
+                if self.dcc_socket is None:
+                    self.send_cmd(name, '!dcc', private=True)
+            time.sleep(self.rnd.expovariate(1.0 / self.test.think_time))
+
+
+class LoadTest(object):
+    def __init__(self, args):
+        self.args = args
+        self.seed = args.seed
+        self.think_time = args.think
+        self.reply_timeout = args.timeout
+        self.mix = parse_mix(args.mix)
+        self.total_weight = sum(weight for _, weight in self.mix)
+        self.lock = threading.Lock()
+        self.nsent = {}
+        self.nlost = {}
+        self.latencies = {}
+        self.queue_depths = []
+        self.ircd = None
+        self.bot = None
+        self.methods = []
+
+    def pick(self, rnd):
+        value = rnd.random() * self.total_weight
+        for name, weight in self.mix:
+            value -= weight
+            if value < 0:
+                return name
+        return self.mix[-1][0]
+
+    def sent(self, name):
+        with self.lock:
+            self.nsent[name] = self.nsent.get(name, 0) + 1
+
+    def lost(self, name):
+        with self.lock:
+            self.nlost[name] = self.nlost.get(name, 0) + 1
+
+    def replied(self, name, latency):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(latency)
+
+    def sample_queue(self, until):
+        while time.time() < until:
+            self.queue_depths.append(self.bot.out_msg.qsize())
+            time.sleep(0.5)
+
+    def setup(self):
+        args = self.args
+        if not args.reuse or not os.path.exists(args.db):
+            synthdb.create(args.db, args.classes, seed=args.seed)
+        db_con = sqlite3.connect(args.db)
+        # (lookup by searge id, searge to rename) pairs of the members still unnamed, for !gcm and !scm
+        self.methods = [(row[0].split('_')[1], row[0]) for row in
+                        db_con.execute("SELECT searge FROM methods WHERE name=searge AND side=0")]
+        db_con.close()
+
+        self.ircd = FakeIRCd(ping_interval=args.ping_interval)
+        self.ircd.register_nick(BOT_NICK, BOT_PASSWORD)
+        self.ircd.start()
+
+        if args.loop:
+            self.bot = LoopMCPBot(BOT_NICK, '!', args.db, external_ip='127.0.0.1')
+        else:
+            self.bot = MCPBot(BOT_NICK, '!', args.db, external_ip='127.0.0.1')
+        logging.getLogger().setLevel(logging.WARN)
+        self.bot.floodprotec = args.flood
+        self.bot.connect(self.ircd.host, self.ircd.port)
+        self.bot.nickserv.identify(BOT_PASSWORD)
+        self.bot.irc.join(CHANNEL)
+        thread = threading.Thread(target=self.bot.start, name='BotMain')
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        args = self.args
+        self.setup()
+        users = [VirtualUser(self, idx) for idx in range(args.users)]
+        for user in users:
+            self.bot.add_whitelist(user.nick, 2)
+            user.send_irc('JOIN %s' % CHANNEL)
+
+        start = time.time()
+        until = start + args.duration
+        threads = [threading.Thread(target=user.run, args=(until,)) for user in users]
+        threads.append(threading.Thread(target=self.sample_queue, args=(until,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(args.duration + args.timeout + 5)
+        elapsed = time.time() - start
+        self.bot.exit = True
+        return self.results(elapsed)
+
+    def results(self, elapsed):
+        commands = {}
+        all_latencies = []
+        for name in sorted(set(self.nsent) | set(self.latencies)):
+            latencies = sorted(self.latencies.get(name, []))
+            all_latencies.extend(latencies)
+            commands[name] = {
+                'sent': self.nsent.get(name, 0),
+                'replied': len(latencies),
+                'lost': self.nlost.get(name, 0),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None,
+            }
+        all_latencies.sort()
+        depths = self.queue_depths
+        return {
+            'revision': git_revision(),
+            'timestamp': int(time.time()),
+            'config': vars(self.args),
+            'elapsed': elapsed,
+            'throughput': len(all_latencies) / elapsed,
+            'latency': {
+                'p50': percentile(all_latencies, 50),
+                'p95': percentile(all_latencies, 95),
+                'p99': percentile(all_latencies, 99),
+            },
+            'commands': commands,
+            'outqueue': {
+                'max': max(depths) if depths else 0,
+                'mean': sum(depths) / float(len(depths)) if depths else 0,
+            },
+            'pings': self.ircd.ping_stats(),
+        }
+
+
+def print_results(results):
+    print 'Revision %s, %.1fs, %.2f replies/s' % (results['revision'], results['elapsed'], results['throughput'])
+    print '%-12s %6s %7s %5s %8s %8s %8s' % ('command', 'sent', 'replied', 'lost', 'p50', 'p95', 'p99')
+    for name, stats in sorted(results['commands'].items()):
+        latencies = tuple(('%.3f' % stats[key]) if stats[key] is not None else '-' for key in ['p50', 'p95', 'p99'])
+        print '%-12s %6d %7d %5d %8s %8s %8s' % ((name, stats['sent'], stats['replied'], stats['lost']) + latencies)
+    print 'Outbound queue: max %(max)d, mean %(mean).1f' % results['outqueue']
+    print 'PINGs: %(sent)d sent, %(answered)d answered, %(late)d late, %(dropped)d dropped' % results['pings']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run MCPBot against a local fake IRC server and measure it')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='weighted command mix, default %s' % DEFAULT_MIX)
+    parser.add_argument('--think', type=float, default=2.0, help='mean seconds between commands of a user')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds before a command counts as lost')
+    parser.add_argument('--flood', type=int, default=1000, help='bot flood protection, chars per 30s')
+    parser.add_argument('--loop', action='store_true', help='run the bot on the event loop of LoopBotBase')
+    parser.add_argument('--ping-interval', type=float, default=10.0)
+    parser.add_argument('--db', default='loadtest.sqlite')
+    parser.add_argument('--classes', type=int, default=1000)
+    parser.add_argument('--reuse', action='store_true', help='reuse an existing database')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file, loadtest-<revision>.json by default')
+    args = parser.parse_args()
+
+    results = LoadTest(args).run()
+    print_results(results)
+    output = args.output or 'loadtest-%s.json' % results['revision']
+    with open(output, 'w') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+    print 'Results saved to %s' % output
+    sys.stdout.flush()
+    # the bot threads are still blocked on their queues, python 2 complains loudly if they see the interpreter go
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -2,23 +2,36 @@ import sys
 import logging
 
 from irc_lib.ircbot import IRCBotBase
+from irc_lib.loopbot import LoopBotBase
+from irc_lib.protocol import inline
+from irc_lib.supervisor import BotSupervisor
 from db_sqlite import DBHandler
 from mcpbotcmds import MCPBotCmds
 
 
+# (name, server, nick, channels) of the networks served, the bots share the database and its caches
+NETWORKS = [
+    ('esper', 'irc.esper.net', 'MCPBot', ['#test']),
+]
+
+
 class MCPBot(IRCBotBase):
-    def __init__(self, nick='DevBot', char='!', db_name='database.sqlite'):
-        IRCBotBase.__init__(self, nick, char, log_level=logging.INFO)
-        self.dbh = DBHandler(db_name)
+    def __init__(self, nick='DevBot', char='!', db_name='database.sqlite', external_ip=None, dbh=None, **kargs):
+        super(MCPBot, self).__init__(nick, char, log_level=logging.INFO, external_ip=external_ip, **kargs)
+        if dbh is None:
+            dbh = DBHandler(db_name, index=True, metrics=self.metrics)
+        self.dbh = dbh
         self.whitelist['ProfMobius'] = 5
         self.whitelist['Searge'] = 5
         self.whitelist['ZeuX'] = 5
         self.whitelist['Ingis'] = 5
         self.whitelist['Fesh0r'] = 5
 
+    @inline
     def onIRC_default(self, cmd, prefix, args):
         self.logger.debug('? IRC_%s %s %s', cmd, prefix, str(args))
 
+    @inline
     def on_default(self, evt):
         self.logger.debug('? %s_%s %s %s %s', evt.type, evt.cmd, evt.sender, evt.target, repr(evt.msg))
 
@@ -28,16 +41,34 @@ class MCPBot(IRCBotBase):
         MCPBotCmds(self, evt, self.dbh).process_cmd()
 
 
-def main(password):
-    bot = MCPBot('MCPBot', '!')
-    bot.connect('irc.esper.net')
-    bot.nickserv.identify(password)
-    bot.irc.join('#test')
-    bot.load_whitelist()
-    bot.start()
+class LoopMCPBot(MCPBot, LoopBotBase):
+    """MCPBot with its sockets, flood pacing and DCC sessions on the event loop of LoopBotBase"""
+    pass
+
+
+def main(password, metrics_port=None, db_name='database.sqlite', loop=False):
+    supervisor = BotSupervisor()
+    dbh = DBHandler(db_name, index=True, metrics=supervisor.metrics)
+    if metrics_port:
+        supervisor.serve_metrics(metrics_port)
+    for name, server, nick, channels in NETWORKS:
+        bot = supervisor.add_bot(name, LoopMCPBot if loop else MCPBot, nick, '!', dbh=dbh)
+        bot.connect(server)
+        bot.nickserv.identify(password)
+        for chan in channels:
+            bot.irc.join(chan)
+        bot.load_whitelist()
+    supervisor.start()
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print 'No password given. Try python mcpbot.py <password>.'
+    ARGS = sys.argv[1:]
+    LOOP = '--loop' in ARGS
+    if LOOP:
+        ARGS.remove('--loop')
+    if not ARGS:
+        print 'No password given. Try python mcpbot.py [--loop] <password> [metrics_port].'
         sys.exit(0)
-    main(sys.argv[1])
+    if len(ARGS) > 1:
+        main(ARGS[0], int(ARGS[1]), loop=LOOP)
+    else:
+        main(ARGS[0], loop=LOOP)
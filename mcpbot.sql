@@ -18,6 +18,22 @@ CREATE TABLE classes (
 );
 
 
+CREATE TABLE classesstats (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL,
+  side INT NOT NULL,
+  versionid INT NOT NULL,
+  methodst INT NOT NULL DEFAULT 0,
+  fieldst INT NOT NULL DEFAULT 0,
+  methodsr INT NOT NULL DEFAULT 0,
+  fieldsr INT NOT NULL DEFAULT 0,
+  methodsu INT NOT NULL DEFAULT 0,
+  fieldsu INT NOT NULL DEFAULT 0,
+  FOREIGN KEY(id) REFERENCES classes(id),
+  FOREIGN KEY(versionid) REFERENCES versions(id)
+);
+
+
 CREATE TABLE commits (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   timestamp INTEGER NOT NULL,
@@ -33,6 +49,7 @@ CREATE TABLE config (
 );
 
 INSERT INTO config VALUES(1, 'currentversion', -1);
+INSERT INTO config VALUES(2, 'schemaversion', 2);
 
 
 CREATE TABLE fields (
@@ -309,18 +326,92 @@ CREATE TRIGGER update_methods_dirty AFTER INSERT ON methodshist BEGIN
 END;
 
 
+CREATE TRIGGER insert_classes_stats AFTER INSERT ON classes
+  WHEN (SELECT name FROM packages WHERE id=new.packageid) LIKE "net/minecraft/%" BEGIN
+  INSERT INTO classesstats (id, name, side, versionid)
+    VALUES (new.id, new.name, new.side, new.versionid);
+END;
+
+
+CREATE TRIGGER delete_classes_stats AFTER DELETE ON classes BEGIN
+  DELETE FROM classesstats
+    WHERE id=old.id;
+END;
+
+
+CREATE TRIGGER insert_fields_stats AFTER INSERT ON fields WHEN new.searge LIKE "field_%" BEGIN
+  UPDATE classesstats SET fieldst=fieldst+1,
+      fieldsr=fieldsr+coalesce(new.name != new.searge, 0),
+      fieldsu=fieldsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid;
+END;
+
+
+CREATE TRIGGER update_fields_stats AFTER UPDATE OF name, searge, topid ON fields BEGIN
+  UPDATE classesstats SET fieldst=fieldst-1,
+      fieldsr=fieldsr-coalesce(old.name != old.searge, 0),
+      fieldsu=fieldsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid AND old.searge LIKE "field_%";
+  UPDATE classesstats SET fieldst=fieldst+1,
+      fieldsr=fieldsr+coalesce(new.name != new.searge, 0),
+      fieldsu=fieldsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid AND new.searge LIKE "field_%";
+END;
+
+
+CREATE TRIGGER delete_fields_stats AFTER DELETE ON fields WHEN old.searge LIKE "field_%" BEGIN
+  UPDATE classesstats SET fieldst=fieldst-1,
+      fieldsr=fieldsr-coalesce(old.name != old.searge, 0),
+      fieldsu=fieldsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid;
+END;
+
+
+CREATE TRIGGER insert_methods_stats AFTER INSERT ON methods WHEN new.searge LIKE "func_%" BEGIN
+  UPDATE classesstats SET methodst=methodst+1,
+      methodsr=methodsr+coalesce(new.name != new.searge, 0),
+      methodsu=methodsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid;
+END;
+
+
+CREATE TRIGGER update_methods_stats AFTER UPDATE OF name, searge, topid ON methods BEGIN
+  UPDATE classesstats SET methodst=methodst-1,
+      methodsr=methodsr-coalesce(old.name != old.searge, 0),
+      methodsu=methodsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid AND old.searge LIKE "func_%";
+  UPDATE classesstats SET methodst=methodst+1,
+      methodsr=methodsr+coalesce(new.name != new.searge, 0),
+      methodsu=methodsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid AND new.searge LIKE "func_%";
+END;
+
+
+CREATE TRIGGER delete_methods_stats AFTER DELETE ON methods WHEN old.searge LIKE "func_%" BEGIN
+  UPDATE classesstats SET methodst=methodst-1,
+      methodsr=methodsr-coalesce(old.name != old.searge, 0),
+      methodsu=methodsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid;
+END;
+
+
 CREATE INDEX classes_isinterf_idx ON classes(isinterf);
-CREATE INDEX classes_name_idx ON classes(name);
-CREATE INDEX classes_notch_idx ON classes(notch);
+CREATE INDEX classes_name_side_versionid_idx ON classes(name, side, versionid);
+CREATE INDEX classes_notch_side_versionid_idx ON classes(notch, side, versionid);
+CREATE INDEX classes_lowername_side_versionid_idx ON classes(lower(name), side, versionid);
 CREATE INDEX classes_packageid_idx ON classes(packageid);
 CREATE INDEX classes_side_idx ON classes(side);
 CREATE INDEX classes_superid_idx ON classes(superid);
 CREATE INDEX classes_topsuperid_idx ON classes(topsuperid);
 CREATE INDEX classes_versionid_idx ON classes(versionid);
 
+CREATE INDEX classesstats_side_versionid_idx ON classesstats(side, versionid);
+
 CREATE INDEX fields_dirtyid_idx ON fields(dirtyid);
-CREATE INDEX fields_notch_idx ON fields(notch);
+CREATE INDEX fields_name_side_versionid_idx ON fields(name, side, versionid);
+CREATE INDEX fields_notch_side_versionid_idx ON fields(notch, side, versionid);
 CREATE INDEX fields_notchsig_idx ON fields(notchsig);
+CREATE INDEX fields_pending_idx ON fields(versionid, side) WHERE dirtyid != 0;
 CREATE INDEX fields_searge_idx ON fields(searge);
 CREATE INDEX fields_side_idx ON fields(side);
 CREATE INDEX fields_sig_idx ON fields(sig);
@@ -336,8 +427,10 @@ CREATE INDEX interfaceslk_classid_idx ON interfaceslk(classid);
 CREATE INDEX interfaceslk_interfid_idx ON interfaceslk(interfid);
 
 CREATE INDEX methods_dirtyid_idx ON methods(dirtyid);
-CREATE INDEX methods_notch_idx ON methods(notch);
+CREATE INDEX methods_name_side_versionid_idx ON methods(name, side, versionid);
+CREATE INDEX methods_notch_side_versionid_idx ON methods(notch, side, versionid);
 CREATE INDEX methods_notchsig_idx ON methods(notchsig);
+CREATE INDEX methods_pending_idx ON methods(versionid, side) WHERE dirtyid != 0;
 CREATE INDEX methods_searge_idx ON methods(searge);
 CREATE INDEX methods_side_idx ON methods(side);
 CREATE INDEX methods_sig_idx ON methods(sig);
@@ -0,0 +1,96 @@
+BEGIN;
+
+
+CREATE TABLE classesstats (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL,
+  side INT NOT NULL,
+  versionid INT NOT NULL,
+  methodst INT NOT NULL DEFAULT 0,
+  fieldst INT NOT NULL DEFAULT 0,
+  methodsr INT NOT NULL DEFAULT 0,
+  fieldsr INT NOT NULL DEFAULT 0,
+  methodsu INT NOT NULL DEFAULT 0,
+  fieldsu INT NOT NULL DEFAULT 0,
+  FOREIGN KEY(id) REFERENCES classes(id),
+  FOREIGN KEY(versionid) REFERENCES versions(id)
+);
+
+
+CREATE TRIGGER insert_classes_stats AFTER INSERT ON classes
+  WHEN (SELECT name FROM packages WHERE id=new.packageid) LIKE "net/minecraft/%" BEGIN
+  INSERT INTO classesstats (id, name, side, versionid)
+    VALUES (new.id, new.name, new.side, new.versionid);
+END;
+
+
+CREATE TRIGGER delete_classes_stats AFTER DELETE ON classes BEGIN
+  DELETE FROM classesstats
+    WHERE id=old.id;
+END;
+
+
+CREATE TRIGGER insert_fields_stats AFTER INSERT ON fields WHEN new.searge LIKE "field_%" BEGIN
+  UPDATE classesstats SET fieldst=fieldst+1,
+      fieldsr=fieldsr+coalesce(new.name != new.searge, 0),
+      fieldsu=fieldsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid;
+END;
+
+
+CREATE TRIGGER update_fields_stats AFTER UPDATE OF name, searge, topid ON fields BEGIN
+  UPDATE classesstats SET fieldst=fieldst-1,
+      fieldsr=fieldsr-coalesce(old.name != old.searge, 0),
+      fieldsu=fieldsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid AND old.searge LIKE "field_%";
+  UPDATE classesstats SET fieldst=fieldst+1,
+      fieldsr=fieldsr+coalesce(new.name != new.searge, 0),
+      fieldsu=fieldsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid AND new.searge LIKE "field_%";
+END;
+
+
+CREATE TRIGGER delete_fields_stats AFTER DELETE ON fields WHEN old.searge LIKE "field_%" BEGIN
+  UPDATE classesstats SET fieldst=fieldst-1,
+      fieldsr=fieldsr-coalesce(old.name != old.searge, 0),
+      fieldsu=fieldsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid;
+END;
+
+
+CREATE TRIGGER insert_methods_stats AFTER INSERT ON methods WHEN new.searge LIKE "func_%" BEGIN
+  UPDATE classesstats SET methodst=methodst+1,
+      methodsr=methodsr+coalesce(new.name != new.searge, 0),
+      methodsu=methodsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid;
+END;
+
+
+CREATE TRIGGER update_methods_stats AFTER UPDATE OF name, searge, topid ON methods BEGIN
+  UPDATE classesstats SET methodst=methodst-1,
+      methodsr=methodsr-coalesce(old.name != old.searge, 0),
+      methodsu=methodsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid AND old.searge LIKE "func_%";
+  UPDATE classesstats SET methodst=methodst+1,
+      methodsr=methodsr+coalesce(new.name != new.searge, 0),
+      methodsu=methodsu+coalesce(new.name = new.searge, 0)
+    WHERE id=new.topid AND new.searge LIKE "func_%";
+END;
+
+
+CREATE TRIGGER delete_methods_stats AFTER DELETE ON methods WHEN old.searge LIKE "func_%" BEGIN
+  UPDATE classesstats SET methodst=methodst-1,
+      methodsr=methodsr-coalesce(old.name != old.searge, 0),
+      methodsu=methodsu-coalesce(old.name = old.searge, 0)
+    WHERE id=old.topid;
+END;
+
+
+CREATE INDEX classesstats_side_versionid_idx ON classesstats(side, versionid);
+
+
+INSERT INTO classesstats (id, name, side, versionid, methodst, fieldst, methodsr, fieldsr, methodsu, fieldsu)
+  SELECT id, name, side, versionid, methodst, fieldst, methodsr, fieldsr, methodsu, fieldsu
+  FROM vclassesstats;
+
+COMMIT;
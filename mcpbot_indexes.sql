@@ -0,0 +1,25 @@
+-- Composite indexes matching the DBQueries predicates, name lookups are always restricted to a side and a version.
+-- They replace the single column name and notch indexes they start with.
+BEGIN;
+
+
+DROP INDEX IF EXISTS classes_name_idx;
+DROP INDEX IF EXISTS classes_notch_idx;
+DROP INDEX IF EXISTS fields_notch_idx;
+DROP INDEX IF EXISTS methods_notch_idx;
+
+CREATE INDEX classes_name_side_versionid_idx ON classes(name, side, versionid);
+CREATE INDEX classes_notch_side_versionid_idx ON classes(notch, side, versionid);
+CREATE INDEX classes_lowername_side_versionid_idx ON classes(lower(name), side, versionid);
+
+CREATE INDEX fields_name_side_versionid_idx ON fields(name, side, versionid);
+CREATE INDEX fields_notch_side_versionid_idx ON fields(notch, side, versionid);
+CREATE INDEX fields_pending_idx ON fields(versionid, side) WHERE dirtyid != 0;
+
+CREATE INDEX methods_name_side_versionid_idx ON methods(name, side, versionid);
+CREATE INDEX methods_notch_side_versionid_idx ON methods(notch, side, versionid);
+CREATE INDEX methods_pending_idx ON methods(versionid, side) WHERE dirtyid != 0;
+
+ANALYZE;
+
+COMMIT;
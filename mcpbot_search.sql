@@ -0,0 +1,82 @@
+-- Trigram full text index used by !search, needs SQLite 3.34 or later built with FTS5.
+-- DBHandler falls back to LIKE scans if these tables don't exist.
+BEGIN;
+
+
+CREATE VIRTUAL TABLE classesfts USING fts5(name, side UNINDEXED, versionid UNINDEXED, tokenize='trigram');
+
+
+CREATE TRIGGER insert_classes_fts AFTER INSERT ON classes BEGIN
+  INSERT INTO classesfts (rowid, name, side, versionid)
+    VALUES (new.id, new.name, new.side, new.versionid);
+END;
+
+
+CREATE TRIGGER update_classes_fts AFTER UPDATE OF name ON classes BEGIN
+  UPDATE classesfts SET name=new.name
+    WHERE rowid=new.id;
+END;
+
+
+CREATE TRIGGER delete_classes_fts AFTER DELETE ON classes BEGIN
+  DELETE FROM classesfts
+    WHERE rowid=old.id;
+END;
+
+
+CREATE VIRTUAL TABLE fieldsfts USING fts5(name, desc, side UNINDEXED, versionid UNINDEXED, tokenize='trigram');
+
+
+CREATE TRIGGER insert_fields_fts AFTER INSERT ON fields BEGIN
+  INSERT INTO fieldsfts (rowid, name, desc, side, versionid)
+    SELECT id, name, desc, side, versionid FROM vfields WHERE id=new.id;
+END;
+
+
+CREATE TRIGGER update_fields_fts AFTER UPDATE OF name, desc, dirtyid, topid ON fields BEGIN
+  DELETE FROM fieldsfts
+    WHERE rowid=old.id;
+  INSERT INTO fieldsfts (rowid, name, desc, side, versionid)
+    SELECT id, name, desc, side, versionid FROM vfields WHERE id=new.id;
+END;
+
+
+CREATE TRIGGER delete_fields_fts AFTER DELETE ON fields BEGIN
+  DELETE FROM fieldsfts
+    WHERE rowid=old.id;
+END;
+
+
+CREATE VIRTUAL TABLE methodsfts USING fts5(name, desc, side UNINDEXED, versionid UNINDEXED, tokenize='trigram');
+
+
+CREATE TRIGGER insert_methods_fts AFTER INSERT ON methods BEGIN
+  INSERT INTO methodsfts (rowid, name, desc, side, versionid)
+    SELECT id, name, desc, side, versionid FROM vmethods WHERE id=new.id;
+END;
+
+
+CREATE TRIGGER update_methods_fts AFTER UPDATE OF name, desc, dirtyid, topid ON methods BEGIN
+  DELETE FROM methodsfts
+    WHERE rowid=old.id;
+  INSERT INTO methodsfts (rowid, name, desc, side, versionid)
+    SELECT id, name, desc, side, versionid FROM vmethods WHERE id=new.id;
+END;
+
+
+CREATE TRIGGER delete_methods_fts AFTER DELETE ON methods BEGIN
+  DELETE FROM methodsfts
+    WHERE rowid=old.id;
+END;
+
+
+INSERT INTO classesfts (rowid, name, side, versionid)
+  SELECT id, name, side, versionid FROM classes;
+
+INSERT INTO fieldsfts (rowid, name, desc, side, versionid)
+  SELECT id, name, desc, side, versionid FROM vfields;
+
+INSERT INTO methodsfts (rowid, name, desc, side, versionid)
+  SELECT id, name, desc, side, versionid FROM vmethods;
+
+COMMIT;
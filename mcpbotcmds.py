@@ -1,9 +1,14 @@
-import csv
+import os
 import re
+import time
 import threading
 
 from irc_lib.utils.restricted import restricted
 from irc_lib.utils.threadpool import Worker
+from irc_lib.utils.profiler import CommandProfiler
+from irc_lib.utils.colors import strip_irc
+from irc_lib.utils.reply import ReplyBuilder
+from csv_export import CSVExport, fetch_rows
 
 
 class Error(Exception):
@@ -28,28 +33,217 @@ class CmdSyntaxError(CmdError):
         return 'Syntax error: $B{cmd} {msg}'.format(cmd=self.cmd, msg=self.msg)
 
 
+# Where those files are written and served from, and how long they are kept
+REPLIES_DIR = '/home/mcpfiles/replies'
+REPLIES_URL = 'http://mcpold.ocean-labs.de/files/replies/'
+REPLIES_TTL = 24 * 3600
+
+# Rows per page of the paged replies, over IRC and over DCC, and seconds a user can ask for the next page
+PAGE_SIZE = 10
+DCC_PAGE_SIZE = 100
+CURSOR_TTL = 600
+
+# Flood budget cost of a row line of the paged replies, with the NOTICE prefix around it
+ROW_CHARS = 120
+
+# Replies costing more of the flood budget than this go over DCC or to a file, the IRC reply is a single line. A page
+# of rows with the title and status lines around it stays on IRC, larger paged replies are offloaded a page at a time.
+OFFLOAD_CHARS = (PAGE_SIZE + 5) * ROW_CHARS
+
+
 def maxlen(rows, field):
     return max([len(row[field]) for row in rows])
 
 
+def db_writer(func):
+    """Run the whole method holding the DB writer, so the checks and the update they guard can't interleave with
+    another command"""
+    def wrap_func(self, *args, **kwargs):
+        with self.dbh.get_writer():
+            return func(self, *args, **kwargs)
+    return wrap_func
+
+
+class Cursor(object):
+    """Where the paged reply of a user stopped, [title, page method, args, offset] of each result with rows left"""
+    def __init__(self, pages):
+        self.pages = pages
+        self.expiry = time.time() + CURSOR_TTL
+
+
 class MCPBotCmds(object):
     def __init__(self, bot, evt, dbh):
         self.bot = bot
         self.evt = evt
         self.dbh = dbh
-        self.queries = None
+        # reader connection, taken from the pool by the first use of queries
+        self.db_con = None
+        self._queries = None
+        # replies are held until the command is done, to see how large they are before sending them
+        self.replies = ReplyBuilder(bot, evt.sender, evt.dcc)
+        # results with more rows than the page sent, kept for !more
+        self.pages = []
+
+    @property
+    def queries(self):
+        """DBQueries on a reader kept until the command is done. It is only taken when first needed so the waits on
+        NickServ in @restricted or on a WHOIS in !dcc don't hold one."""
+        if self._queries is None:
+            self.db_con = self.dbh.checkout_reader()
+            self._queries = self.dbh.get_queries(self.db_con)
+        return self._queries
 
     def reply(self, msg):
-        self.bot.say(self.evt.sender, msg, dcc=self.evt.dcc)
+        self.replies.add(msg)
+
+    def offloaded(self):
+        """True if the reply is too large for IRC and goes over DCC or to a file"""
+        return not self.evt.dcc and self.replies.size > OFFLOAD_CHARS
+
+    def flush_replies(self):
+        if not self.replies:
+            return
+        if not self.offloaded():
+            self.replies.send()
+            return
+        self.offload_replies()
+
+    def offload_replies(self):
+        """Send a large reply over the DCC chat of the sender if there is one, or to a file it gets the link of.
+        Without either, a chat is offered and the reply sent once it is accepted."""
+        sender = self.evt.sender
+        lines = self.replies.lines
+        if sender in self.bot.dcc.sessions:
+            self.bot.say_block(sender, lines, dcc=True)
+            self.bot.say(sender, "Reply to $B%s$N sent over DCC (%d lines)" % (self.evt.cmd, len(lines)))
+            return
+        try:
+            location = self.write_replies(lines)
+        except (IOError, OSError):
+            self.bot.logger.exception('*** MCPBotCmds.offload_replies: writing the reply failed')
+        else:
+            self.bot.say(sender, "Reply to $B%s$N (%d lines): %s" % (self.evt.cmd, len(lines), location))
+            return
+        if self.bot.dcc.offer(sender, lines):
+            self.bot.say(sender, "Reply to $B%s$N too long (%d lines), accept the DCC chat to get it" % (
+                self.evt.cmd, len(lines)))
+            return
+        # nowhere to put it, send what fits
+        sent = self.replies.head(OFFLOAD_CHARS)
+        self.bot.say_block(sender, sent)
+        self.bot.say(sender, " Too many to display (%d more lines)" % (len(lines) - len(sent)))
+
+    def write_replies(self, lines):
+        """Write lines to a new file of the replies directory, returns its URL (its path in debug mode)"""
+        if self.bot.debug:
+            trgdir = 'devconf/replies'
+        else:
+            trgdir = REPLIES_DIR
+        if not os.path.isdir(trgdir):
+            os.makedirs(trgdir)
+        now = time.time()
+        for name in os.listdir(trgdir):
+            filename = os.path.join(trgdir, name)
+            if name.endswith('.txt') and now - os.path.getmtime(filename) > REPLIES_TTL:
+                os.remove(filename)
+        name = '%s-%s-%d.txt' % (time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), self.evt.cmd, self.evt.id)
+        with open(os.path.join(trgdir, name), 'w') as fh:
+            for line in lines:
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                fh.write(strip_irc(line) + '\n')
+        if self.bot.debug:
+            return os.path.join(trgdir, name)
+        return REPLIES_URL + name
 
     def process_cmd(self):
+        start = time.time()
+        cmd_func = getattr(self, 'cmd_%s' % self.evt.cmd, None)
         try:
-            with self.dbh.get_con() as db_con:
-                self.queries = self.dbh.get_queries(db_con)
-                cmd_func = getattr(self, 'cmd_%s' % self.evt.cmd, self.cmd_default)
+            if cmd_func is None:
+                self.cmd_default()
+            elif self.bot.profiler is not None and self.evt.cmd != 'profile':
+                self.profile_cmd(cmd_func)
+            else:
                 cmd_func()
         except CmdError as exc:
             self.reply(str(exc))
+        finally:
+            if self.db_con is not None:
+                self.dbh.checkin_reader(self.db_con)
+                self.db_con = None
+                self._queries = None
+            self.flush_replies()
+            self.save_cursor()
+            # unknown commands are left out, anybody could fill the registry with made up names
+            if cmd_func is not None:
+                metrics = self.bot.metrics
+                metrics.observe('command_wait_seconds', start - self.evt.stamp, cmd=self.evt.cmd)
+                metrics.observe('command_seconds', time.time() - self.evt.stamp, cmd=self.evt.cmd)
+
+    def profile_cmd(self, cmd_func):
+        profiler = self.bot.profiler
+        if not profiler.wants(self.evt.cmd):
+            cmd_func()
+            return
+        try:
+            profiler.run(self.evt.cmd, cmd_func)
+        finally:
+            # the last of the runs asked for writes the results
+            if profiler.finish():
+                filenames = profiler.dump()
+                if profiler.nick:
+                    self.bot.say(profiler.nick, "Profiling done, stats written to $B%s" % ', '.join(filenames))
+
+    def page_size(self):
+        if self.evt.dcc:
+            return DCC_PAGE_SIZE
+        return PAGE_SIZE
+
+    def fetch_page(self, query, offset, *args):
+        """The rows of a page of a DBQueries getter taking limit and offset, and the offset of the next page or None
+        if this is the last one"""
+        size = self.page_size()
+        rows = query(*args, limit=size + 1, offset=offset)
+        if len(rows) > size:
+            return rows[:size], offset + size
+        return rows, None
+
+    def paged(self, title, page, *args):
+        """Reply with the first page of a result, page being the method replying with the page at an offset and
+        returning the offset of the next one. The following pages are sent by !more, also when the reply is
+        offloaded."""
+        next_offset = getattr(self, page)(0, *args)
+        if next_offset is not None:
+            self.pages.append([title, page, args, next_offset])
+
+    def save_cursor(self):
+        if not self.pages:
+            return
+        cursors = self.bot.cursors
+        now = time.time()
+        for nick, cursor in cursors.items():
+            if cursor.expiry < now:
+                cursors.pop(nick, None)
+        cursors[self.evt.sender] = Cursor(self.pages)
+        # a line of its own, after the reply
+        self.bot.say(self.evt.sender, " More results, use $B%smore$N to see them" % self.bot.controlchar,
+                     self.evt.dcc)
+
+    def cmd_more(self):
+        """$Bmore$N : Next page of the last reply too long to be sent at once."""
+        self.check_args(0)
+
+        cursor = self.bot.cursors.pop(self.evt.sender, None)
+        if cursor is None or cursor.expiry < time.time():
+            raise CmdError('Nothing more to show')
+
+        title, page, args, offset = cursor.pages[0]
+        self.reply("$B[ %s ]" % title)
+        next_offset = getattr(self, page)(offset, *args)
+        if next_offset is not None:
+            self.pages.append([title, page, args, next_offset])
+        self.pages.extend(cursor.pages[1:])
 
     def check_args(self, max_args, min_args=None, text=False, syntax=''):
         if min_args is None:
@@ -176,30 +370,16 @@ class MCPBotCmds(object):
 
         if self.evt.dcc:
             lowlimit = 10
-            highlimit = 999
         else:
             lowlimit = 1
-            highlimit = 10
 
-        rows = self.queries.get_member(cname, mname, sname, side, etype)
+        rows = self.queries.get_member(cname, mname, sname, side, etype, limit=lowlimit + 1)
 
         if not rows:
             self.reply(" No result for $R%s" % self.evt.msg)
-        elif len(rows) > highlimit:
-            self.reply(" $BVERY$N ambiguous request $R%s" % self.evt.msg)
-            self.reply(" Found %s results" % len(rows))
-            self.reply(" Too many to display")
-        elif highlimit >= len(rows) > lowlimit:
+        elif len(rows) > lowlimit:
             self.reply(" Ambiguous request $R%s" % self.evt.msg)
-            self.reply(" Found %s results" % len(rows))
-            l_name = maxlen(rows, 'fullname')
-            l_notch = maxlen(rows, 'fullnotch') + 2
-            l_searge = maxlen(rows, 'searge') + 2
-            for row in rows:
-                p_name = (row['fullname']).ljust(l_name)
-                p_notch = ('[%s]' % row['fullnotch']).ljust(l_notch)
-                p_searge = ('[%s]' % row['searge']).ljust(l_searge)
-                self.reply(" %s %s %s %s %s" % (p_searge, p_name, p_notch, row['sig'], row['notchsig']))
+            self.paged('GET %s %s' % (side.upper(), etype.upper()), 'page_members', cname, mname, sname, side, etype)
         else:
             for row in rows:
                 self.reply(" Side        : $B%s" % side)
@@ -210,6 +390,18 @@ class MCPBotCmds(object):
                 if row['desc']:
                     self.reply(" Description : %s" % row['desc'])
 
+    def page_members(self, offset, cname, mname, sname, side, etype):
+        rows, next_offset = self.fetch_page(self.queries.get_member, offset, cname, mname, sname, side, etype)
+        l_name = maxlen(rows, 'fullname')
+        l_notch = maxlen(rows, 'fullnotch') + 2
+        l_searge = maxlen(rows, 'searge') + 2
+        for row in rows:
+            p_name = (row['fullname']).ljust(l_name)
+            p_notch = ('[%s]' % row['fullnotch']).ljust(l_notch)
+            p_searge = ('[%s]' % row['searge']).ljust(l_searge)
+            self.reply(" %s %s %s %s %s" % (p_searge, p_name, p_notch, row['sig'], row['notchsig']))
+        return next_offset
+
     #====================== Search commands ============================
     def cmd_search(self):
         """$Bsearch <pattern>$N  : Search for a pattern."""
@@ -217,43 +409,49 @@ class MCPBotCmds(object):
 
         self.reply("$B[ SEARCH ]")
 
-        if self.evt.dcc:
-            highlimit = 100
-        else:
-            highlimit = 10
+        for side in ['client', 'server']:
+            self.paged('SEARCH %s CLASSES' % side.upper(), 'page_classes', search_str, side)
+            for etype in ['fields', 'methods']:
+                self.paged('SEARCH %s %s' % (side.upper(), etype.upper()), 'page_search_members', search_str, side,
+                           etype, 'name')
+
+    def cmd_searchdesc(self):
+        """$Bsearchdesc <pattern>$N  : Search for a pattern in member descriptions."""
+        search_str, = self.check_args(1, text=True, syntax='<text>')
 
-        rows = {'classes': None, 'fields': None, 'methods': None}
+        self.reply("$B[ SEARCH DESCRIPTIONS ]")
 
         for side in ['client', 'server']:
-            rows['classes'] = self.queries.search_class(search_str, side)
             for etype in ['fields', 'methods']:
-                rows[etype] = self.queries.search_member(search_str, side, etype)
+                self.paged('SEARCH %s %s' % (side.upper(), etype.upper()), 'page_search_members', search_str, side,
+                           etype, 'desc')
 
-            if not rows['classes']:
-                self.reply(" [%s][  CLASS] No results" % side.upper())
-            elif len(rows['classes']) > highlimit:
-                self.reply(" [%s][  CLASS] Too many results : %d" % (side.upper(), len(rows['classes'])))
-            else:
-                l_name = maxlen(rows['classes'], 'name')
-                l_notch = maxlen(rows['classes'], 'notch')
-                for row in rows['classes']:
-                    p_name = (row['name']).ljust(l_name)
-                    p_notch = (row['notch']).ljust(l_notch)
-                    self.reply(" [%s][  CLASS] %s %s" % (side.upper(), p_name, p_notch))
+    def page_classes(self, offset, search_str, side):
+        rows, next_offset = self.fetch_page(self.queries.search_class, offset, search_str, side)
+        if not rows:
+            self.reply(" [%s][  CLASS] No results" % side.upper())
+            return None
+        l_name = maxlen(rows, 'name')
+        l_notch = maxlen(rows, 'notch')
+        for row in rows:
+            p_name = (row['name']).ljust(l_name)
+            p_notch = (row['notch']).ljust(l_notch)
+            self.reply(" [%s][  CLASS] %s %s" % (side.upper(), p_name, p_notch))
+        return next_offset
 
-            for etype in ['fields', 'methods']:
-                if not rows[etype]:
-                    self.reply(" [%s][%7s] No results" % (side.upper(), etype.upper()))
-                elif len(rows[etype]) > highlimit:
-                    self.reply(" [%s][%7s] Too many results : %d" % (side.upper(), etype.upper(), len(rows[etype])))
-                else:
-                    l_name = maxlen(rows[etype], 'fullname')
-                    l_notch = maxlen(rows[etype], 'fullnotch') + 2
-                    for row in rows[etype]:
-                        p_name = (row['fullname']).ljust(l_name)
-                        p_notch = ('[%s]' % row['fullnotch']).ljust(l_notch)
-                        self.reply(" [%s][%7s] %s %s %s %s" % (side.upper(), etype.upper(), p_name, p_notch,
-                            row['sig'], row['notchsig']))
+    def page_search_members(self, offset, search_str, side, etype, column):
+        rows, next_offset = self.fetch_page(self.queries.search_member, offset, search_str, side, etype, column)
+        if not rows:
+            self.reply(" [%s][%7s] No results" % (side.upper(), etype.upper()))
+            return None
+        l_name = maxlen(rows, 'fullname')
+        l_notch = maxlen(rows, 'fullnotch') + 2
+        for row in rows:
+            p_name = (row['fullname']).ljust(l_name)
+            p_notch = ('[%s]' % row['fullnotch']).ljust(l_notch)
+            self.reply(" [%s][%7s] %s %s %s %s" % (side.upper(), etype.upper(), p_name, p_notch,
+                row['sig'], row['notchsig']))
+        return next_offset
 
     #====================== Setters for members ========================
     def cmd_scm(self):
@@ -288,6 +486,7 @@ class MCPBotCmds(object):
         """$Bssf [<id>|<searge>] <newname> [description]$N : Set Server Field."""
         self.set_member('server', 'fields', forced=True)
 
+    @db_writer
     def set_member(self, side, etype, forced=False):
         member, newname, newdesc = self.check_args(3, min_args=2, text=True,
                                                    syntax='<membername> <newname> [newdescription]')
@@ -365,6 +564,7 @@ class MCPBotCmds(object):
     def cmd_fpsf(self):
         self.port_member('server', 'fields', forced=True)
 
+    @db_writer
     def port_member(self, side, etype, forced=False):
         origin, target = self.check_args(2, syntax='<origin_member> <target_member>')
 
@@ -471,6 +671,7 @@ class MCPBotCmds(object):
     def cmd_rsf(self):
         self.revert_member('server', 'fields')
 
+    @db_writer
     def revert_member(self, side, etype):
         member, = self.check_args(1, syntax='<member>')
 
@@ -487,41 +688,40 @@ class MCPBotCmds(object):
         else:
             full_log = False
 
-        if not self.bot.debug:
-            if not self.evt.dcc:
-                self.reply("$BPlease use DCC for getlog")
-                return
-
         self.reply("$B[ LOGS ]")
 
         for side in ['client', 'server']:
             for etype in ['methods', 'fields']:
-                rows = self.queries.get_log(side, etype)
-                if rows:
-                    l_nick = maxlen(rows, 'nick')
-                    l_searge = maxlen(rows, 'searge')
-                    l_name = maxlen(rows, 'name')
-
-                    for forcedstatus in [0, 1]:
-                        for row in rows:
-                            if row['forced'] == forcedstatus:
-                                p_nick = (row['nick']).ljust(l_nick)
-                                p_searge = (row['searge']).ljust(l_searge)
-                                p_name = (row['name']).ljust(l_name)
-                                index_re = re.search('[0-9]+', row['searge'])
-                                if index_re is not None:
-                                    p_index = index_re.group()
-                                else:
-                                    p_index = row['searge']
-                                if full_log:
-                                    self.reply("+ %s, %s, %s" % (row['timestamp'], row['nick'], row['cmd']))
-                                    self.reply("  [%s%s][%s] %s => %s" % (side[0].upper(), etype[0].upper(), p_searge,
-                                        p_name, row['newname']))
-                                    self.reply("  [%s%s][%s] %s => %s" % (side[0].upper(), etype[0].upper(), p_searge,
-                                        row['desc'], row['newdesc']))
-                                else:
-                                    self.reply("+ %s, %s [%s%s][%5s][%4s] %s => %s" % (row['timestamp'], p_nick,
-                                        side[0].upper(), etype[0].upper(), p_index, row['cmd'], p_name, row['newname']))
+                self.paged('LOGS %s %s' % (side.upper(), etype.upper()), 'page_log', side, etype, full_log)
+
+    def page_log(self, offset, side, etype, full_log):
+        rows, next_offset = self.fetch_page(self.queries.get_log, offset, side, etype)
+        if not rows:
+            return None
+        l_nick = maxlen(rows, 'nick')
+        l_searge = maxlen(rows, 'searge')
+        l_name = maxlen(rows, 'name')
+
+        # the normal changes come before the forced ones
+        for row in rows:
+            p_nick = (row['nick']).ljust(l_nick)
+            p_searge = (row['searge']).ljust(l_searge)
+            p_name = (row['name']).ljust(l_name)
+            index_re = re.search('[0-9]+', row['searge'])
+            if index_re is not None:
+                p_index = index_re.group()
+            else:
+                p_index = row['searge']
+            if full_log:
+                self.reply("+ %s, %s, %s" % (row['timestamp'], row['nick'], row['cmd']))
+                self.reply("  [%s%s][%s] %s => %s" % (side[0].upper(), etype[0].upper(), p_searge,
+                    p_name, row['newname']))
+                self.reply("  [%s%s][%s] %s => %s" % (side[0].upper(), etype[0].upper(), p_searge,
+                    row['desc'], row['newdesc']))
+            else:
+                self.reply("+ %s, %s [%s%s][%5s][%4s] %s => %s" % (row['timestamp'], p_nick,
+                    side[0].upper(), etype[0].upper(), p_index, row['cmd'], p_name, row['newname']))
+        return next_offset
 
     @restricted(3)
     def cmd_commit(self):
@@ -531,18 +731,48 @@ class MCPBotCmds(object):
     def cmd_fcommit(self):
         self.db_commit(forced=True)
 
+    @db_writer
     def db_commit(self, forced=False):
         self.check_args(0)
 
         self.reply("$B[ COMMIT ]")
 
-        nentries = self.queries.db_commit(forced)
-        if nentries:
+        report = self.queries.db_commit(forced)
+        if report['entries']:
             self.queries.add_commit(self.evt.sender)
-            self.reply(" Committed %d entries" % nentries)
+            self.reply(" Committed %d entries (%d normal, %d forced)" % (report['entries'], report['normal'],
+                                                                           report['forced']))
+            counts = []
+            for side in ['client', 'server']:
+                for etype in ['methods', 'fields']:
+                    if report['counts'].get((side, etype)):
+                        counts.append("%s %s: %d" % (side, etype, report['counts'][(side, etype)]))
+            self.reply(" %s" % ', '.join(counts))
+            self.reply(" Changes by: %s" % ', '.join(report['nicks']))
         else:
             self.reply(" No new entries to commit")
 
+    @restricted(4)
+    def cmd_rebuildstats(self):
+        self.check_args(0)
+
+        self.reply("$B[ REBUILD STATS ]")
+
+        nclasses = self.queries.rebuild_stats()
+        self.reply(" Rebuilt stats for %d classes" % nclasses)
+
+    @restricted(4)
+    def cmd_rebuildsearch(self):
+        self.check_args(0)
+
+        self.reply("$B[ REBUILD SEARCH ]")
+
+        if not self.dbh.fts:
+            raise CmdError("Full text search not available")
+
+        nentries = self.queries.rebuild_search()
+        self.reply(" Rebuilt search index for %d entries" % nentries)
+
     @restricted(3)
     def cmd_altcsv(self):
         self.check_args(0)
@@ -555,8 +785,10 @@ class MCPBotCmds(object):
         else:
             trgdir = '/home/mcpfiles/mcprolling_%s/mcp/conf' % mcpversion
 
-        self.write_csvs(trgdir)
-        self.reply("New CSVs exported for MCP %s" % mcpversion)
+        if self.write_csvs(trgdir):
+            self.reply("New CSVs exported for MCP %s" % mcpversion)
+        else:
+            self.reply("CSVs for MCP %s unchanged" % mcpversion)
 
     @restricted(2)
     def cmd_testcsv(self):
@@ -570,23 +802,20 @@ class MCPBotCmds(object):
         else:
             trgdir = '/home/mcpfiles/mcptest'
 
-        self.write_csvs(trgdir)
-        self.reply("Test CSVs for MCP %s exported: http://mcpold.ocean-labs.de/files/mcptest/" % mcpversion)
+        if self.write_csvs(trgdir):
+            self.reply("Test CSVs for MCP %s exported: http://mcpold.ocean-labs.de/files/mcptest/" % mcpversion)
+        else:
+            self.reply("Test CSVs for MCP %s unchanged: http://mcpold.ocean-labs.de/files/mcptest/" % mcpversion)
 
     def write_csvs(self, trgdir):
-        methodswriter = csv.DictWriter(open('%s/methods.csv' % trgdir, 'wb'), ('searge', 'name', 'side', 'desc'))
-        methodswriter.writeheader()
-        rows = self.queries.csv_member('methods')
-        for row in rows:
-            methodswriter.writerow({'searge': row['searge'], 'name': row['name'], 'side': row['side'],
-                                    'desc': row['desc']})
-
-        fieldswriter = csv.DictWriter(open('%s/fields.csv' % trgdir, 'wb'), ('searge', 'name', 'side', 'desc'))
-        fieldswriter.writeheader()
-        rows = self.queries.csv_member('fields')
-        for row in rows:
-            fieldswriter.writerow({'searge': row['searge'], 'name': row['name'], 'side': row['side'],
-                                   'desc': row['desc']})
+        changed = False
+        for etype in ['methods', 'fields']:
+            export = CSVExport('%s/%s.csv' % (trgdir, etype), '%s/%s_delta.csv' % (trgdir, etype))
+            export.write(fetch_rows(self.queries.csv_member(etype)))
+            if export.changed:
+                changed = True
+                self.reply(" %s: %d entries, %d changed" % (etype, export.nrows, export.ndelta))
+        return changed
 
     #====================== Whitelist Handling =========================
     @restricted(0)
@@ -706,6 +935,10 @@ class MCPBotCmds(object):
                         percent = 0.
                     self.reply(" [%s][%7s] : T $B%4d$N | R $B%4d$N | U $B%4d$N | $B%5.2f%%$N" % (
                         side[0].upper(), etype.upper(), row['total'], row['ren'], row['urn'], percent))
+            if self.dbh.cache:
+                stats = self.dbh.cache.stats()
+                self.reply(" Cache  : $B%d$N/%d entries | $B%d$N hits | $B%d$N misses | $B%d$N evictions" % (
+                    stats['entries'], stats['size'], stats['hits'], stats['misses'], stats['evictions']))
 
     @restricted(4)
     def cmd_listthreads(self):
@@ -724,11 +957,74 @@ class MCPBotCmds(object):
                 line = '%s %4d %4d %4d' % (p_name, 0, 0, 0)
             self.reply(line)
 
-        nthreads = len(threads)
-        if nthreads == self.bot.nthreads + 1:
+        for name, stats in sorted(self.bot.threadpool.stats().items()):
+            self.reply(" %-8s : %d workers (%d-%d), %d busy, %d queued, %d run by caller, %d ok, %d failed" % (
+                name, stats['workers'], stats['min'], stats['max'], stats['busy'], stats['queued'], stats['caller'],
+                stats['succeeded'], stats['failed']))
+
+        stopped = self.bot.threadpool.stopped_services()
+        if not stopped:
             self.reply(" All threads up and running")
         else:
-            self.reply(" Found only $R%d$N threads $BThere is a problem!" % (nthreads - 1))
+            self.reply(" $R%s$N stopped $BThere is a problem!" % ', '.join(stopped))
+
+    @restricted(4)
+    def cmd_stats(self):
+        prefix, = self.check_args(1, min_args=0, syntax='[prefix]')
+
+        self.reply("$B[ STATS ]")
+
+        lines = self.bot.metrics.summary(prefix)
+        if not lines:
+            self.reply(" No metric starting with $R%s" % prefix)
+        for line in lines:
+            self.reply(" %s" % line)
+
+    @restricted(4)
+    def cmd_profile(self):
+        action, arg = self.check_args(2, min_args=1, syntax='<count>|<command> [count]|stop|show [command]')
+        profiler = self.bot.profiler
+
+        if action == 'stop':
+            if profiler is None or not profiler.active:
+                raise CmdError('No profiling running')
+            profiler.stop()
+            filenames = profiler.dump()
+            self.reply("Profiling stopped, stats written to $B%s" % ', '.join(filenames or ['nothing']))
+            return
+
+        if action == 'show':
+            if profiler is None:
+                raise CmdError('Nothing profiled')
+            if not arg:
+                self.reply("$B[ PROFILE ]")
+                for cmd, calls in profiler.commands():
+                    self.reply(" %-12s : %d runs" % (cmd, calls))
+                return
+            if not self.evt.dcc:
+                raise CmdError('The profile of a command is only shown over DCC')
+            lines = profiler.summary(arg)
+            if lines is None:
+                raise CmdError('%s was not profiled' % arg)
+            self.reply("$B[ PROFILE %s ]" % arg)
+            for line in lines:
+                self.reply(line)
+            return
+
+        if action.isdigit():
+            cmd, count = None, action
+        else:
+            cmd, count = action, arg
+        if count and not count.isdigit() or count == '0':
+            raise CmdSyntaxError(self.evt.cmd, '<count>|<command> [count]|stop|show [command]')
+        if cmd is not None and not hasattr(self, 'cmd_%s' % cmd):
+            raise CmdError('Unknown command %s' % cmd)
+        if profiler is not None and profiler.active:
+            raise CmdError('Profiling already running, stop it first')
+
+        self.bot.profiler = CommandProfiler(int(count) if count else None, cmd, self.evt.sender)
+        what = '%s runs of' % count if count else 'all runs of'
+        self.reply("Profiling %s %s" % (what, cmd or 'any command'))
 
     @restricted(4)
     def cmd_listdcc(self):
@@ -736,7 +1032,7 @@ class MCPBotCmds(object):
 
         self.reply("$B[ DCC USERS ]")
 
-        self.reply(str(self.bot.dcc.sockets.keys()))
+        self.reply(str(self.bot.dcc.sessions.keys()))
 
     def cmd_todo(self):
         search_side, = self.check_args(1, syntax='<client|server>')
@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+
+
+SYLLABLES = ['get', 'set', 'is', 'has', 'update', 'render', 'block', 'entity', 'item', 'world', 'chunk', 'player',
+             'tile', 'pos', 'count', 'list', 'map', 'texture', 'sound', 'light', 'height', 'biome', 'stack', 'slot',
+             'tick', 'random', 'motion', 'damage', 'health', 'spawn', 'name', 'data', 'meta', 'id', 'value']
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TYPES = ['I', 'Z', 'F', 'D', 'J', 'Ljava/lang/String;', 'Ljava/util/List;']
+
+PACKAGES = ['net/minecraft/src', 'net/minecraft/client', 'net/minecraft/server', 'net/minecraft/world']
+
+NICKS = ['Searge', 'ProfMobius', 'Fesh0r', 'ZeuX', 'Ingis', 'Cadde', 'Lex', 'Vazkii', 'Pahimar', 'Sengir']
+
+DAY = 24 * 3600
+
+
+def notch_name(idx):
+    """a, b, ..., z, aa, ab, ... the way the obfuscator names things"""
+    name = ''
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        name = chr(97 + rem) + name
+    return name
+
+
+def camel(rnd, nparts, capitalize=False):
+    parts = [rnd.choice(SYLLABLES) for _ in range(nparts)]
+    name = parts[0] + ''.join(part.capitalize() for part in parts[1:])
+    if capitalize:
+        name = name[0].upper() + name[1:]
+    return name
+
+
+class Generator(object):
+    """Fills the bot schema with synthetic mappings, one full copy of the classes and members per version the way
+    the real database keeps one per MCP release. Rows are inserted in batches with explicit ids."""
+
+    def __init__(self, db_con, rnd, nclasses, nmethods, nfields, named, history, pending, subclasses):
+        self.db_con = db_con
+        self.rnd = rnd
+        self.nclasses = nclasses
+        self.nmethods = nmethods
+        self.nfields = nfields
+        self.named = named
+        self.history = history
+        self.pending = pending
+        self.subclasses = subclasses
+        self.start_time = int(time.time()) - 365 * DAY
+        self.last_ids = {'classes': 0, 'methods': 0, 'fields': 0, 'methodshist': 0, 'fieldshist': 0}
+
+    def next_id(self, table):
+        self.last_ids[table] += 1
+        return self.last_ids[table]
+
+    def add_version(self, version_id, nversions):
+        timestamp = self.start_time + version_id * 365 * DAY // (nversions + 1)
+        self.db_con.execute("INSERT INTO versions VALUES (:id, :mcpversion, '4.0', '1', :mcversion, :mcversion, "
+                            ":timestamp)", {'id': version_id, 'mcpversion': '7.%d' % version_id,
+                                            'mcversion': '1.%d' % version_id, 'timestamp': timestamp})
+        # searge ids stay the same from one version to the next, like the real ones
+        searge_id = 1000
+        for side in [0, 1]:
+            classes = []
+            names = set()
+            for class_idx in range(self.nclasses):
+                name = camel(self.rnd, self.rnd.randint(1, 3), capitalize=True)
+                while name in names:
+                    name += self.rnd.choice(SYLLABLES).capitalize()
+                names.add(name)
+                superid = topsuperid = None
+                if classes and self.rnd.random() < self.subclasses:
+                    parent = self.rnd.choice(classes)
+                    superid = parent[0]
+                    topsuperid = parent[4] or parent[0]
+                classes.append((self.next_id('classes'), side, name, notch_name(class_idx), topsuperid, superid,
+                                self.rnd.randint(1, len(PACKAGES)), version_id))
+            self.db_con.executemany("""
+                INSERT INTO classes (id, side, name, notch, topsuperid, superid, isinterf, packageid, versionid)
+                VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)
+            """, classes)
+
+            subclasses = {}
+            for row in classes:
+                if row[5]:
+                    subclasses.setdefault(row[5], []).append(row[0])
+            for etype, prefix, nmembers in [('methods', 'func', self.nmethods), ('fields', 'field', self.nfields)]:
+                searge_id = self.add_members(etype, prefix, nmembers, side, version_id, timestamp, classes,
+                                             subclasses, searge_id)
+
+    def add_members(self, etype, prefix, nmembers, side, version_id, timestamp, classes, subclasses, searge_id):
+        # the command that made the change, scm, fssf, ...
+        cmd = 's' + 'cs'[side] + etype[0]
+        members = []
+        links = []
+        committed = []
+        pending = []
+        for class_row in classes:
+            class_id = class_row[0]
+            for member_idx in range(nmembers):
+                searge_id += 1
+                member_id = self.next_id(etype)
+                notch = notch_name(member_idx)
+                searge = '%s_%d_%s' % (prefix, searge_id, notch)
+                sig = self.rnd.choice(TYPES)
+                if etype == 'methods':
+                    sig = '(%s)V' % sig
+                name = searge
+                desc = ''
+                if self.rnd.random() < self.named:
+                    name = camel(self.rnd, self.rnd.randint(1, 3))
+                    desc = 'Synthetic description of %s' % name
+                    if self.rnd.random() < self.history:
+                        committed.append((self.next_id(etype + 'hist'), member_id, searge, '', name, desc,
+                                          timestamp - self.rnd.randint(0, 30 * DAY), self.rnd.choice(NICKS), 0, cmd))
+                elif self.rnd.random() < self.pending:
+                    newname = camel(self.rnd, 2)
+                    forced = int(self.rnd.random() < 0.2)
+                    pending.append((self.next_id(etype + 'hist'), member_id, searge, '', newname,
+                                    'Pending description of %s' % newname, timestamp, self.rnd.choice(NICKS), forced,
+                                    'f' * forced + cmd))
+                members.append((member_id, side, searge, notch, name, sig, sig, desc, class_id, version_id))
+                links.append((member_id, class_id))
+                # methods are also looked up through the subclasses inheriting them
+                if etype == 'methods':
+                    for subclass_id in subclasses.get(class_id, []):
+                        links.append((member_id, subclass_id))
+
+        self.db_con.executemany("""
+            INSERT INTO {etype} (id, side, searge, notch, name, sig, notchsig, desc, topid, versionid)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """.format(etype=etype), members)
+        self.db_con.executemany("INSERT INTO {etype}lk VALUES (?, ?)".format(etype=etype), links)
+        query = """
+            INSERT INTO {etype}hist (id, memberid, oldname, olddesc, newname, newdesc, timestamp, nick, forced, cmd)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """.format(etype=etype)
+        self.db_con.executemany(query, committed)
+        # the hist trigger marks members dirty, only the pending ones should stay that way
+        self.db_con.executemany("UPDATE {etype} SET dirtyid=0 WHERE id=?".format(etype=etype),
+                                [(row[1],) for row in committed])
+        self.db_con.executemany(query, pending)
+        return searge_id
+
+
+def create(db_name, nclasses=1000, nmethods=12, nfields=6, named=0.5, seed=0, search=True, nversions=1,
+           history=0.3, pending=0.01, subclasses=0.3, schema=os.path.join(SCHEMA_DIR, 'mcpbot.sql'),
+           search_schema=os.path.join(SCHEMA_DIR, 'mcpbot_search.sql')):
+    """Build a database with the bot schema and nversions versions of synthetic mappings: nclasses classes per side
+    with nmethods methods and nfields fields each, the last version being the current one. The named fraction of
+    the members has a name, some of them with a committed hist entry, and the pending fraction of the others has an
+    uncommitted change. The same arguments always give the same database."""
+    rnd = random.Random(seed)
+    for filename in [db_name, db_name + '-wal', db_name + '-shm']:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    db_con = sqlite3.connect(db_name)
+    with open(schema) as fh:
+        db_con.executescript(fh.read())
+    db_con.executemany("INSERT INTO packages VALUES (?, ?)", list(enumerate(PACKAGES, 1)))
+    generator = Generator(db_con, rnd, nclasses, nmethods, nfields, named, history, pending, subclasses)
+    for version_id in range(1, nversions + 1):
+        generator.add_version(version_id, nversions)
+    db_con.execute("UPDATE config SET value=:version WHERE name='currentversion'", {'version': nversions})
+    db_con.commit()
+
+    if search:
+        try:
+            with open(search_schema) as fh:
+                db_con.executescript(fh.read())
+        except sqlite3.OperationalError:
+            # no fts5 trigram support in this sqlite, the bot falls back to LIKE
+            db_con.rollback()
+    db_con.execute('ANALYZE')
+    db_con.close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print 'Usage: python synthdb.py <db_name> [nclasses] [nversions]'
+        sys.exit(0)
+    nclasses = 1000
+    nversions = 1
+    if len(sys.argv) > 2:
+        nclasses = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        nversions = int(sys.argv[3])
+    create(sys.argv[1], nclasses, nversions=nversions)
+
+if __name__ == '__main__':
+    main()
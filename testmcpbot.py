@@ -2,6 +2,7 @@ import sys
 import logging
 
 from irc_lib.ircbot import IRCBotBase
+from irc_lib.protocol import inline
 from db_sqlite import DBHandler
 from mcpbotcmds import MCPBotCmds
 
@@ -10,12 +11,14 @@ class MCPBot(IRCBotBase):
     def __init__(self, nick='DevBot', char='!', db_name='database.sqlite'):
         IRCBotBase.__init__(self, nick, char, log_level=logging.DEBUG)
         self.debug = True
-        self.dbh = DBHandler(db_name)
+        self.dbh = DBHandler(db_name, metrics=self.metrics)
         self.whitelist['ProfMobius'] = 5
 
+    @inline
     def onIRC_default(self, cmd, prefix, args):
         self.logger.debug('? IRC_%s %s %s', cmd, prefix, str(args))
 
+    @inline
     def on_default(self, evt):
         self.logger.debug('? %s_%s %s %s %s', evt.type, evt.cmd, evt.sender, evt.target, repr(evt.msg))
 
@@ -0,0 +1,99 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+from csv_export import CSVExport, CSV_FIELDS, fetch_rows
+
+
+def member(searge, name, side=0, desc=None):
+    return {'searge': searge, 'name': name, 'side': side, 'desc': desc}
+
+
+def read_csv(filename):
+    with open(filename, 'rb') as fh:
+        return list(csv.reader(fh))
+
+
+class FakeCursor(object):
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        rows = self.rows[:size]
+        del self.rows[:size]
+        return rows
+
+
+class CSVExportTest(unittest.TestCase):
+    def setUp(self):
+        self.trgdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.trgdir, 'methods.csv')
+        self.delta_filename = os.path.join(self.trgdir, 'methods_delta.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.trgdir)
+
+    def export(self, rows):
+        export = CSVExport(self.filename, self.delta_filename)
+        export.write(iter(rows))
+        return export
+
+    def test_first_export(self):
+        export = self.export([member('func_1_a', 'first', desc='a, "quoted" desc'), member('func_2_b', 'second')])
+        self.assertTrue(export.changed)
+        self.assertEqual(export.nrows, 2)
+        self.assertEqual(export.ndelta, 2)
+        self.assertEqual(read_csv(self.filename), [list(CSV_FIELDS), ['func_1_a', 'first', '0', 'a, "quoted" desc'],
+                                                   ['func_2_b', 'second', '0', '']])
+        self.assertEqual(len(read_csv(self.delta_filename)), 3)
+
+    def test_unchanged_export_is_skipped(self):
+        rows = [member('func_1_a', 'first'), member('func_2_b', 'second')]
+        self.export(rows)
+        mtime = int(os.path.getmtime(self.filename)) - 100
+        os.utime(self.filename, (mtime, mtime))
+
+        export = self.export(rows)
+        self.assertFalse(export.changed)
+        self.assertEqual(export.ndelta, 0)
+        self.assertEqual(os.path.getmtime(self.filename), mtime)
+        # the delta of the export before is kept
+        self.assertEqual(len(read_csv(self.delta_filename)), 3)
+
+    def test_delta_holds_new_and_changed_rows(self):
+        self.export([member('func_1_a', 'first'), member('func_2_b', 'second'), member('func_2_b', 'server', 1)])
+        export = self.export([member('func_1_a', 'first'), member('func_2_b', 'renamed'),
+                              member('func_2_b', 'server', 1, 'now with a desc'), member('func_3_c', 'third')])
+        self.assertTrue(export.changed)
+        self.assertEqual(export.nrows, 4)
+        self.assertEqual(export.ndelta, 3)
+        self.assertEqual(read_csv(self.delta_filename)[1:], [['func_2_b', 'renamed', '0', ''],
+                                                             ['func_2_b', 'server', '1', 'now with a desc'],
+                                                             ['func_3_c', 'third', '0', '']])
+
+    def test_no_temporary_files_left(self):
+        rows = [member('func_1_a', 'first')]
+        self.export(rows)
+        self.export(rows)
+        self.assertEqual(sorted(os.listdir(self.trgdir)), ['methods.csv', 'methods_delta.csv'])
+
+    def test_failed_export_keeps_the_live_file(self):
+        self.export([member('func_1_a', 'first')])
+
+        def rows():
+            yield member('func_1_a', 'changed')
+            raise IOError('connection lost')
+
+        self.assertRaises(IOError, self.export, rows())
+        self.assertEqual(read_csv(self.filename)[1:], [['func_1_a', 'first', '0', '']])
+        self.assertEqual(sorted(os.listdir(self.trgdir)), ['methods.csv', 'methods_delta.csv'])
+
+    def test_fetch_rows(self):
+        rows = range(25)
+        self.assertEqual(list(fetch_rows(FakeCursor(rows), size=10)), rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import synthdb
+from db_cache import QueryCache, _MISSING
+from db_sqlite import DBHandler
+
+
+class QueryCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = QueryCache(size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # b is the least recently used now
+        cache.put('c', 3)
+        self.assertIs(cache.get('b'), _MISSING)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'entries': 2, 'size': 2, 'hits': 3, 'misses': 1, 'evictions': 1})
+
+    def test_large_results_are_not_kept(self):
+        cache = QueryCache(max_rows=2)
+        cache.put('list', [1, 2, 3])
+        cache.put('tuple', (1, 2, 3))
+        cache.put('small', (1, 2))
+        self.assertIs(cache.get('list'), _MISSING)
+        self.assertIs(cache.get('tuple'), _MISSING)
+        self.assertEqual(cache.get('small'), (1, 2))
+
+    def test_clear(self):
+        cache = QueryCache()
+        cache.put('a', 1)
+        cache.clear()
+        self.assertIs(cache.get('a'), _MISSING)
+
+
+class CachedTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.template = os.path.join(cls.tmpdir, 'template.sqlite')
+        synthdb.create(cls.template, nclasses=20, nmethods=3, nfields=2, pending=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def dbh(self, index=False):
+        db_name = os.path.join(self.tmpdir, '%s.sqlite' % self._testMethodName)
+        shutil.copyfile(self.template, db_name)
+        return DBHandler(db_name, readers=1, index=index)
+
+    def test_hit_until_a_write(self):
+        dbh = self.dbh()
+        with dbh.get_con() as db_con:
+            queries = dbh.get_queries(db_con)
+            self.assertEqual(queries.get_log('client', 'methods'), [])
+            self.assertEqual(queries.get_log('client', 'methods'), [])
+            self.assertEqual(dbh.cache.hits, 1)
+
+            row = db_con.execute("SELECT searge FROM methods WHERE side=0 AND versionid=? LIMIT 1",
+                                 (queries.version_id,)).fetchone()
+            queries.update_member(row['searge'].split('_')[1], 'newName', '', 'client', 'methods', 'nick', 0,
+                                  'scm')
+            rows = queries.get_log('client', 'methods')
+            self.assertEqual([(r['searge'], r['newname']) for r in rows], [(row['searge'], 'newName')])
+            self.assertEqual(dbh.cache.hits, 1)
+
+    def test_rows_are_not_shared(self):
+        dbh = self.dbh(index=True)
+        with dbh.get_con() as db_con:
+            queries = dbh.get_queries(db_con)
+            # the members answered from the index are its own records, the most common name gives several
+            name = db_con.execute("SELECT name FROM methods WHERE side=0 AND versionid=? AND name != searge "
+                                  "GROUP BY name ORDER BY count(*) DESC LIMIT 1", (queries.version_id,)).fetchone()[0]
+            first = queries.get_member(None, name, None, 'client', 'methods')
+            self.assertTrue(len(first) > 1)
+            desc = first[0]['desc']
+            first[0].desc = 'changed'
+            del first[1:]
+
+            second = queries.get_member(None, name, None, 'client', 'methods')
+            self.assertEqual(dbh.cache.hits, 1)
+            self.assertEqual(second[0]['desc'], desc)
+            self.assertTrue(len(second) > 1)
+            second[0].desc = 'changed again'
+            self.assertEqual(queries.get_member(None, name, None, 'client', 'methods')[0]['desc'], desc)
+
+            # nor the index
+            dbh.cache.clear()
+            self.assertEqual(queries.get_member(None, name, None, 'client', 'methods')[0]['desc'], desc)
+
+    def test_no_cache(self):
+        dbh = self.dbh()
+        dbh.cache = None
+        with dbh.get_con() as db_con:
+            queries = dbh.get_queries(db_con)
+            self.assertEqual(queries.todo('client'), queries.todo('client'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import sqlite3
+import unittest
+
+from db_sqlite import like_range
+
+
+SEARGES = ['func_1_a', 'func_10_b', 'func_1234_c', 'func_1234_d', 'func_12_e', 'field_1_a', 'field_1234_b',
+           'func_', 'func']
+
+
+class LikeRangeTest(unittest.TestCase):
+    def setUp(self):
+        self.db_con = sqlite3.connect(':memory:')
+        self.db_con.execute('CREATE TABLE methods (searge TEXT)')
+        self.db_con.executemany('INSERT INTO methods VALUES (?)', [(searge,) for searge in SEARGES])
+
+    def tearDown(self):
+        self.db_con.close()
+
+    def like(self, pattern):
+        return sorted(row[0] for row in self.db_con.execute(
+            "SELECT searge FROM methods WHERE searge LIKE ? ESCAPE '!'", (pattern,)))
+
+    def bounded(self, pattern):
+        low, high = like_range(pattern)
+        return sorted(row[0] for row in self.db_con.execute(
+            "SELECT searge FROM methods WHERE searge >= ? AND searge < ? AND searge LIKE ? ESCAPE '!'",
+            (low, high, pattern)))
+
+    def test_bounds(self):
+        self.assertEqual(like_range('func!_1234!_%'), ('func_1234_', 'func_1234`'))
+        self.assertEqual(like_range('func!_12%'), ('func_12', 'func_13'))
+        # '_' is a wildcard unless escaped
+        self.assertEqual(like_range('func_1'), ('func', 'fund'))
+        self.assertEqual(like_range('FUNC!_1!_%'), ('func_1_', 'func_1`'))
+
+    def test_empty_prefix(self):
+        low, high = like_range('%')
+        self.assertEqual(low, '')
+        self.assertTrue(all(low <= searge < high for searge in SEARGES))
+        self.assertEqual(like_range(''), like_range('%'))
+
+    def test_same_rows_as_like(self):
+        for pattern in ['func!_1234!_%', 'func!_1!_%', 'func!_12%', 'FUNC!_1234!_%', 'Field!_1!_%', 'func_1%',
+                        'func!_', '%', '%1234%', 'func!_9!_%']:
+            self.assertEqual(self.bounded(pattern), self.like(pattern), pattern)
+
+
+if __name__ == '__main__':
+    unittest.main()
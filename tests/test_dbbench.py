@@ -0,0 +1,56 @@
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+
+from dbbench import Bench, full_scans, compare, check_scans
+
+
+def case(mean, scans=()):
+    return {'mean': mean, 'statements': [{'sql': 'SELECT 1', 'scans': list(scans)}]}
+
+
+class HelpersTest(unittest.TestCase):
+    def test_full_scans(self):
+        plan = ['SCAN m', 'SCAN m USING INDEX methods_searge', 'SEARCH c USING INTEGER PRIMARY KEY (rowid=?)',
+                'SCAN methodsfts VIRTUAL TABLE INDEX 0:', 'SCAN CONSTANT ROW']
+        self.assertEqual(full_scans(plan), ['SCAN m'])
+
+    def test_compare(self):
+        baseline = {'cases': {'fast': case(0.0001), 'slow': case(0.01), 'scan': case(0.01), 'new': case(0.01)}}
+        results = {'cases': {'fast': case(0.0009), 'slow': case(0.02), 'scan': case(0.01, ['SCAN m']),
+                             'same': case(0.01), 'new': case(0.011)}}
+        regressions = compare(results, baseline, 1.5, 0.001)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('scan: new full table scan "SCAN m"'))
+        self.assertTrue(regressions[1].startswith('slow: 20.00ms'))
+
+    def test_check_scans(self):
+        results = {'cases': {'csv_member': case(1, ['SCAN m']), 'get_member': case(1, ['SCAN m'])}}
+        self.assertEqual(len(check_scans(results)), 1)
+
+
+class RunCaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        args = argparse.Namespace(db=os.path.join(self.tmpdir, 'bench.sqlite'), reuse=False, classes=10, seed=0,
+                                  versions=1, index=False, repeat=3)
+        self.bench = Bench(args)
+        self.bench.setup()
+
+    def tearDown(self):
+        self.bench.plan_con.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_every_call_runs_the_query(self):
+        result = self.bench.run_case('search_class', ('a', 'client'), None)
+        self.assertEqual(result['calls'], 3)
+        self.assertTrue(result['rows'] > 0)
+        self.assertIsNone(self.bench.dbh.cache)
+        # the last call ran the same statements as the first one, with a cache hit it would only read the version
+        self.assertEqual(len(self.bench.dbh.statements), len(result['statements']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+
+from fakeircd import FakeIRCd
+from loadtest import percentile, parse_mix
+
+
+class FakeIRCdTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeIRCd(ping_interval=3600)
+        self.lines = {}
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, nick):
+        self.lines[nick] = []
+        return self.server.add_virtual(nick, '10.0.0.%d' % len(self.lines), self.lines[nick].append)
+
+    def test_channel_messages(self):
+        alice = self.client('Alice')
+        bob = self.client('Bob')
+        self.server.handle(alice, 'JOIN #mcp')
+        self.server.handle(bob, 'JOIN #mcp')
+        self.assertIn(':Bob!bob@10.0.0.2 JOIN #mcp', self.lines['Alice'])
+        names, = [line for line in self.lines['Bob'] if ' 353 ' in line]
+        self.assertEqual(sorted(names.split(' :')[1].split()), ['Alice', 'Bob'])
+        del self.lines['Alice'][:]
+        del self.lines['Bob'][:]
+
+        self.server.handle(alice, 'PRIVMSG #MCP :!gm get')
+        self.assertEqual(self.lines['Alice'], [])
+        self.assertEqual(self.lines['Bob'], [':Alice!alice@10.0.0.1 PRIVMSG #MCP :!gm get'])
+
+        self.server.handle(bob, 'PART #mcp')
+        self.server.handle(alice, 'PRIVMSG #mcp :anyone?')
+        self.assertEqual(self.lines['Bob'], [':Alice!alice@10.0.0.1 PRIVMSG #MCP :!gm get',
+                                             ':Bob!bob@10.0.0.2 PART #mcp'])
+
+    def test_private_messages(self):
+        alice = self.client('Alice')
+        self.client('Bob')
+        self.server.handle(alice, 'NOTICE bob :hello')
+        self.assertEqual(self.lines['Bob'], [':Alice!alice@10.0.0.1 NOTICE bob :hello'])
+        self.server.handle(alice, 'PRIVMSG Nobody :hello')
+        self.assertEqual(self.lines['Alice'], [':fakeircd 401 Alice Nobody :No such nick/channel'])
+
+    def test_nick_change(self):
+        alice = self.client('Alice')
+        bob = self.client('Bob')
+        self.server.handle(alice, 'JOIN #mcp')
+        self.server.handle(bob, 'JOIN #mcp')
+        self.server.handle(alice, 'NICK Bob')
+        self.assertEqual(self.lines['Alice'][-1], ':fakeircd 433 Alice Bob :Nickname is already in use')
+        self.server.handle(alice, 'NICK Carol')
+        self.assertEqual(self.lines['Bob'][-1], ':Alice!alice@10.0.0.1 NICK Carol')
+        self.assertEqual(self.server.channels['#mcp'], set(['carol', 'bob']))
+        self.assertFalse(alice.identified)
+
+    def test_nickserv(self):
+        alice = self.client('Alice')
+        self.server.register_nick('Alice', 'secret')
+        self.server.handle(alice, 'NICK Alicia')
+        self.server.handle(alice, 'PRIVMSG NickServ :ACC Alicia')
+        self.assertTrue(self.lines['Alice'][-1].endswith(':Alicia ACC 1'))
+        self.server.handle(alice, 'NICK Alice')
+        self.server.handle(alice, 'PRIVMSG NickServ :IDENTIFY wrong')
+        self.assertFalse(alice.identified)
+        self.server.handle(alice, 'PRIVMSG NickServ :IDENTIFY secret')
+        self.assertTrue(alice.identified)
+        self.server.handle(alice, 'PRIVMSG NickServ :ACC Alice')
+        self.assertTrue(self.lines['Alice'][-1].endswith(':Alice ACC 3'))
+        self.server.handle(alice, 'PRIVMSG NickServ :ACC Nobody')
+        self.assertTrue(self.lines['Alice'][-1].endswith(':Nobody ACC 0'))
+
+    def test_whois(self):
+        alice = self.client('Alice')
+        self.client('Bob')
+        self.server.handle(alice, 'WHOIS bob')
+        self.assertEqual(self.lines['Alice'], [':fakeircd 311 Alice Bob bob 10.0.0.2 * :Bob',
+                                               ':fakeircd 318 Alice Bob :End of /WHOIS list.'])
+
+
+class LoadTestHelpersTest(unittest.TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 51)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertIsNone(percentile([], 50))
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('gm=3, search ,more=0.5'), [('gm', 3.0), ('search', 1.0), ('more', 0.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import socket
+import logging
+import unittest
+
+from irc_lib.utils.framer import LineFramer
+
+
+# the dropped lines are logged as warnings
+logging.getLogger('IRCBot').addHandler(logging.NullHandler())
+
+
+class LineFramerTest(unittest.TestCase):
+    def test_lines(self):
+        framer = LineFramer()
+        framer.feed('PING :a\r\nPRIVMSG #chan :b\nPART')
+        self.assertEqual(list(framer.lines()), ['PING :a', 'PRIVMSG #chan :b'])
+        framer.feed(' #chan\r\n')
+        self.assertEqual(list(framer.lines()), ['PART #chan'])
+        self.assertEqual((framer.start, framer.scan, framer.end), (0, 0, 0))
+
+    def test_line_over_many_reads(self):
+        framer = LineFramer(read_size=4, max_line=64)
+        for char in 'a long line\r':
+            framer.feed(char)
+            self.assertEqual(list(framer.lines()), [])
+        framer.feed('\n\r\n')
+        self.assertEqual(list(framer.lines()), ['a long line', ''])
+
+    def test_buffer_is_reused(self):
+        framer = LineFramer(read_size=8, max_line=16)
+        size = len(framer.buf)
+        for idx in range(100):
+            framer.feed('line %d\r\n' % idx)
+            self.assertEqual(list(framer.lines()), ['line %d' % idx])
+        framer.feed('half')
+        for idx in range(100):
+            list(framer.lines())
+            framer.feed('\nhalf')
+        self.assertEqual(list(framer.lines()), ['half'])
+        self.assertEqual(len(framer.buf), size)
+        self.assertEqual(framer.end - framer.start, 4)
+
+    def test_long_line_is_dropped(self):
+        framer = LineFramer(read_size=8, max_line=16)
+        framer.feed('x' * 20)
+        self.assertEqual(list(framer.lines()), [])
+        self.assertEqual(framer.noverflows, 1)
+        framer.feed('still the same line\r\nnext\r\n')
+        self.assertEqual(list(framer.lines()), ['next'])
+        self.assertEqual(framer.noverflows, 1)
+
+    def test_recv(self):
+        reader, writer = socket.socketpair()
+        try:
+            framer = LineFramer(read_size=4)
+            writer.sendall('NICK a\r\nUSER')
+            while framer.end < 12:
+                self.assertTrue(framer.recv(reader) > 0)
+            self.assertEqual(list(framer.lines()), ['NICK a'])
+            writer.close()
+            self.assertEqual(framer.recv(reader), 0)
+        finally:
+            reader.close()
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+import mcpbotcmds
+from mcpbotcmds import MCPBotCmds, PAGE_SIZE, DCC_PAGE_SIZE
+from irc_lib.event import Event
+from irc_lib.utils.metrics import Registry
+from irc_lib.utils.colors import conv_s2i
+
+
+class FakeDCC(object):
+    def __init__(self):
+        self.sessions = {}
+
+    def offer(self, nick, lines):
+        return False
+
+
+class FakeBot(object):
+    cnick = 'MCPBot'
+    controlchar = '!'
+    debug = False
+    profiler = None
+
+    def __init__(self):
+        self.out = []
+        self.cursors = {}
+        self.metrics = Registry()
+        self.dcc = FakeDCC()
+        self.logger = logging.getLogger('IRCBot.Test')
+
+    def say(self, target, msg, dcc=False):
+        self.out.append(conv_s2i(msg))
+
+    def say_block(self, target, msgs, dcc=False):
+        self.out.extend(msgs)
+
+
+class RowsCmds(MCPBotCmds):
+    """Commands paging over rows held in memory, the limits asked for are kept"""
+    rows = []
+    limits = []
+
+    def get_rows(self, limit=None, offset=0):
+        self.limits.append(limit)
+        if limit is None:
+            return self.rows[offset:]
+        return self.rows[offset:offset + limit]
+
+    def cmd_rows(self):
+        self.reply('$B[ ROWS ]')
+        self.paged('ROWS', 'page_rows')
+
+    def page_rows(self, offset):
+        rows, next_offset = self.fetch_page(self.get_rows, offset)
+        for row in rows:
+            self.reply(' %s' % row)
+        return next_offset
+
+
+class PagingTest(unittest.TestCase):
+    def setUp(self):
+        self.bot = FakeBot()
+        RowsCmds.rows = ['row %d' % idx for idx in range(25)]
+        RowsCmds.limits = []
+
+    def run_cmd(self, cmd, dcc=False):
+        self.bot.out = []
+        evt = Event('nick!user@host', cmd, self.bot.cnick, '', 'CMD', dcc=dcc)
+        RowsCmds(self.bot, evt, None).process_cmd()
+        return self.bot.out
+
+    def test_fetch_page(self):
+        evt = Event('nick!user@host', 'rows', self.bot.cnick, '', 'CMD')
+        cmds = RowsCmds(self.bot, evt, None)
+        self.assertEqual(cmds.fetch_page(cmds.get_rows, 0), (RowsCmds.rows[:PAGE_SIZE], PAGE_SIZE))
+        self.assertEqual(cmds.fetch_page(cmds.get_rows, 20), (RowsCmds.rows[20:], None))
+        RowsCmds.rows = RowsCmds.rows[:PAGE_SIZE]
+        self.assertEqual(cmds.fetch_page(cmds.get_rows, 0), (RowsCmds.rows, None))
+        # one more row than the page tells if there is a next one
+        self.assertEqual(RowsCmds.limits, [PAGE_SIZE + 1] * 3)
+
+    def test_more(self):
+        out = self.run_cmd('rows')
+        self.assertEqual(out[1:-1], [' row %d' % idx for idx in range(PAGE_SIZE)])
+        self.assertEqual(out[-1], conv_s2i(' More results, use $B!more$N to see them'))
+        self.assertEqual(self.bot.cursors.keys(), ['nick'])
+
+        out = self.run_cmd('more')
+        self.assertEqual(out[1:-1], [' row %d' % idx for idx in range(PAGE_SIZE, 2 * PAGE_SIZE)])
+        out = self.run_cmd('more')
+        self.assertEqual(out[1:], [' row %d' % idx for idx in range(2 * PAGE_SIZE, 25)])
+        self.assertEqual(self.bot.cursors, {})
+
+        out = self.run_cmd('more')
+        self.assertEqual(out, [conv_s2i('Error: $RNothing more to show')])
+        self.assertNotIn(None, RowsCmds.limits)
+
+    def test_several_results(self):
+        evt = Event('nick!user@host', 'rows', self.bot.cnick, '', 'CMD')
+        cmds = RowsCmds(self.bot, evt, None)
+        cmds.paged('FIRST', 'page_rows')
+        cmds.paged('SECOND', 'page_rows')
+        cmds.flush_replies()
+        cmds.save_cursor()
+
+        out = self.run_cmd('more')
+        self.assertEqual(out[0], conv_s2i('$B[ FIRST ]'))
+        self.assertEqual(out[-1], conv_s2i(' More results, use $B!more$N to see them'))
+        self.run_cmd('more')
+        out = self.run_cmd('more')
+        self.assertEqual(out[0], conv_s2i('$B[ SECOND ]'))
+        self.assertEqual(out[1], ' row %d' % PAGE_SIZE)
+
+    def test_expired_cursor(self):
+        self.run_cmd('rows')
+        self.bot.cursors['nick'].expiry = time.time() - 1
+        self.assertEqual(self.run_cmd('more'), [conv_s2i('Error: $RNothing more to show')])
+
+    def test_one_page_stays_inline(self):
+        # about the width of the !search and !gm rows
+        RowsCmds.rows = ['[CLIENT][METHODS] %s %s' % (('Class%d.method%d' % (idx, idx)).ljust(30), 'x' * 50)
+                         for idx in range(25)]
+        out = self.run_cmd('rows')
+        self.assertEqual(out[1:-1], [' ' + row for row in RowsCmds.rows[:PAGE_SIZE]])
+
+    def test_offloaded_reply_keeps_paging(self):
+        trgdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, trgdir)
+        self.addCleanup(setattr, mcpbotcmds, 'REPLIES_DIR', mcpbotcmds.REPLIES_DIR)
+        mcpbotcmds.REPLIES_DIR = trgdir
+        RowsCmds.rows = ['row %d %s' % (idx, 'x' * 200) for idx in range(25)]
+
+        out = self.run_cmd('rows')
+        self.assertEqual(len(out), 2)
+        self.assertTrue(out[0].startswith(conv_s2i('Reply to $Brows$N (11 lines): %s' % mcpbotcmds.REPLIES_URL)))
+        self.assertEqual(out[1], conv_s2i(' More results, use $B!more$N to see them'))
+        name, = os.listdir(trgdir)
+        with open(os.path.join(trgdir, name)) as fh:
+            self.assertEqual(fh.read().splitlines()[1:], [' ' + row for row in RowsCmds.rows[:PAGE_SIZE]])
+        self.assertEqual(RowsCmds.limits, [PAGE_SIZE + 1])
+
+        self.run_cmd('more')
+        self.assertEqual(RowsCmds.limits, [PAGE_SIZE + 1] * 2)
+        self.assertEqual(len(os.listdir(trgdir)), 2)
+
+    def test_dcc_page_size(self):
+        RowsCmds.rows = ['row %d' % idx for idx in range(DCC_PAGE_SIZE + 1)]
+        out = self.run_cmd('rows', dcc=True)
+        self.assertEqual(len(out), DCC_PAGE_SIZE + 2)
+        self.assertEqual(RowsCmds.limits, [DCC_PAGE_SIZE + 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from Queue import Empty
+
+from irc_lib.utils.outqueue import OutQueue, PROTOCOL, INTERACTIVE, BULK
+
+
+def drain(queue):
+    msgs = []
+    while not queue.empty():
+        msgs.append(queue.get_nowait())
+        queue.task_done()
+    return msgs
+
+
+class OutQueueTest(unittest.TestCase):
+    def test_priority_classes(self):
+        queue = OutQueue()
+        queue.put('bulk', BULK, 'a')
+        queue.put('reply', INTERACTIVE, 'b')
+        queue.put('PONG', PROTOCOL)
+        self.assertEqual(drain(queue), ['PONG', 'reply', 'bulk'])
+
+    def test_round_robin_per_target(self):
+        queue = OutQueue(burst=10)
+        queue.put_many(['a1', 'a2', 'a3'], target='a')
+        queue.put_many(['b1', 'b2'], target='b')
+        queue.put('c1', target='c')
+        self.assertEqual(drain(queue), ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+
+    def test_long_dump_is_demoted(self):
+        queue = OutQueue(burst=2)
+        queue.put_many(['a%d' % idx for idx in range(5)], target='a')
+        queue.put('b1', target='b')
+        # a keeps its burst, the rest of the dump goes after the short reply to b
+        self.assertEqual(drain(queue), ['a0', 'b1', 'a1', 'a2', 'a3', 'a4'])
+
+    def test_target_stays_demoted_until_its_backlog_is_gone(self):
+        queue = OutQueue(burst=1)
+        queue.put_many(['a0', 'a1'], target='a')
+        self.assertEqual(queue.get_nowait(), 'a0')
+        # a1 is still waiting in bulk, a new line to a can't overtake it
+        queue.put('a2', target='a')
+        queue.put('b1', target='b')
+        self.assertEqual([queue.get_nowait() for _ in range(3)], ['b1', 'a1', 'a2'])
+        self.assertEqual(queue.pending, {})
+        queue.put('a3', target='a')
+        queue.put('b2', BULK, 'b')
+        self.assertEqual([queue.get_nowait() for _ in range(2)], ['a3', 'b2'])
+
+    def test_protocol_lines_are_not_counted(self):
+        queue = OutQueue(burst=1)
+        queue.put('PING', PROTOCOL, 'a')
+        queue.put('reply', INTERACTIVE, 'a')
+        queue.put('other', INTERACTIVE, 'b')
+        self.assertEqual(drain(queue), ['PING', 'reply', 'other'])
+
+    def test_queue_interface(self):
+        queue = OutQueue()
+        self.assertRaises(Empty, queue.get_nowait)
+        self.assertRaises(Empty, queue.get, True, 0.01)
+        queue.put_many(['a', 'b'], target='x')
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.unfinished_tasks, 2)
+        drain(queue)
+        self.assertEqual(queue.qsize(), 0)
+        queue.join()
+        self.assertRaises(ValueError, queue.task_done)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import synthdb
+
+
+def dump(db_name):
+    """The mappings of a database, the tables with timestamps following the clock are left out"""
+    db_con = sqlite3.connect(db_name)
+    try:
+        return [db_con.execute('SELECT * FROM %s ORDER BY id' % table).fetchall()
+                for table in ['classes', 'methods', 'fields', 'packages']]
+    finally:
+        db_con.close()
+
+
+class SynthDBTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create(self, name, **kargs):
+        db_name = os.path.join(self.tmpdir, name)
+        synthdb.create(db_name, nclasses=10, nmethods=3, nfields=2, search=False, **kargs)
+        return db_name
+
+    def test_notch_name(self):
+        self.assertEqual([synthdb.notch_name(idx) for idx in [0, 25, 26, 27, 701, 702]],
+                         ['a', 'z', 'aa', 'ab', 'zz', 'aaa'])
+
+    def test_same_arguments_same_database(self):
+        first = dump(self.create('first.sqlite', seed=1))
+        second = dump(self.create('second.sqlite', seed=1))
+        other = dump(self.create('other.sqlite', seed=2))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+
+    def test_versions(self):
+        db_con = sqlite3.connect(self.create('versions.sqlite', nversions=3))
+        try:
+            self.assertEqual(db_con.execute("SELECT value FROM config WHERE name='currentversion'").fetchone()[0],
+                             '3')
+            for version_id in [1, 2, 3]:
+                counts = [db_con.execute("SELECT count(*) FROM %s WHERE versionid=?" % table,
+                                         (version_id,)).fetchone()[0] for table in ['classes', 'methods', 'fields']]
+                self.assertEqual(counts, [20, 60, 40])
+        finally:
+            db_con.close()
+
+
+if __name__ == '__main__':
+    unittest.main()